@@ -0,0 +1,39 @@
+"""
+Times pico runtimes on compiled benchmark programs.
+
+usage:
+    python3 benchmarks/bench.py --pico out/pico --pico out/pico-switch --lib ./lib fib.pbc loops.pbc
+
+every (runtime, program) pair is run `--runs` times and the best wall clock time is reported,
+which is the most stable number on a noisy machine.
+"""
+import argparse
+import subprocess
+import time
+
+
+def best_of(cmd: list[str], runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="time pico runtimes on .pbc programs")
+    arg_parser.add_argument("programs", nargs="+", help="compiled .pbc files")
+    arg_parser.add_argument("--pico", action="append", required=True, help="runtime binary, can be repeated")
+    arg_parser.add_argument("--lib", default="./lib", help="native library directory passed to the runtime")
+    arg_parser.add_argument("--runs", type=int, default=10)
+    args = arg_parser.parse_args()
+
+    print(f"{'program':<24}" + "".join(f"{pico:>20}" for pico in args.pico))
+    for program in args.programs:
+        timings = [best_of([pico, program, args.lib], args.runs) for pico in args.pico]
+        print(f"{program:<24}" + "".join(f"{t * 1000:>17.1f} ms" for t in timings))
+
+
+if __name__ == '__main__':
+    main()
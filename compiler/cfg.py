@@ -0,0 +1,540 @@
+# control-flow graph of a function, with its locals in ssa form
+
+from constfold import child_attrs
+from hir import HirNodeTag
+from pico_ast import OpTag
+from pico_types import TypeRegistry
+from symtab import SymbolKind
+
+# steps change the local or field they are applied to
+step_ops = (OpTag.PreIncrement, OpTag.PreDecrement, OpTag.PostIncrement, OpTag.PostDecrement)
+
+binop_symbols = {
+    OpTag.OR: "||", OpTag.AND: "&&", OpTag.EQ: "==", OpTag.NEQ: "!=", OpTag.LT: "<", OpTag.LTE: "<=",
+    OpTag.GT: ">", OpTag.GTE: ">=", OpTag.ADD: "+", OpTag.SUB: "-", OpTag.MUL: "*", OpTag.DIV: "/",
+    OpTag.MOD: "%", OpTag.BAND: "&", OpTag.BOR: "|", OpTag.BXOR: "^", OpTag.SHL: "<<", OpTag.SHR: ">>",
+}
+
+
+class Jump:
+    def __init__(self, target=None):
+        self.target = target
+
+    def successors(self) -> list:
+        return [self.target]
+
+
+class CondJump:
+    """
+    to if_true when condition holds, to if_false otherwise
+    """
+
+    def __init__(self, condition, if_true=None, if_false=None):
+        self.condition = condition
+        self.if_true = if_true
+        self.if_false = if_false
+
+    def successors(self) -> list:
+        return [self.if_true, self.if_false]
+
+
+class SwitchJump:
+    """
+    cases are (labels, block) pairs, default is the block taken when no label matches
+    """
+
+    def __init__(self, expr, cases, default=None):
+        self.expr = expr
+        self.cases = cases
+        self.default = default
+
+    def successors(self) -> list:
+        return [self.default] + [block for (_, block) in self.cases]
+
+
+class Ret:
+    """
+    leaves the function, node is the hir Return or None where control runs off its end
+    """
+
+    def __init__(self, node=None):
+        self.node = node
+
+    def successors(self) -> list:
+        return []
+
+
+class Phi:
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.version = 0
+        # predecessor block -> version of symbol at the end of it
+        self.args = {}
+
+
+class BasicBlock:
+    def __init__(self, index: int):
+        self.index = index
+        # statements without control flow, the terminator ends the block
+        self.nodes = []
+        self.terminator = None
+        self.preds = []
+        # symbol -> Phi, only for symbols live into the block
+        self.phis = {}
+
+    def successors(self) -> list:
+        return self.terminator.successors()
+
+    @property
+    def label(self) -> str:
+        return f"b{self.index}"
+
+
+def eval_order(node) -> list:
+    """
+    the child nodes of node in the order the backends evaluate them
+    """
+    if node.kind == HirNodeTag.InlinedCall:
+        return [*node.stores, node.value]
+    if node.kind in (HirNodeTag.StoreField, HirNodeTag.StoreIndexed):
+        return [node.obj, node.value]
+    if node.kind == HirNodeTag.IndexedAccess:
+        return [node.container, node.index]
+    children = []
+    for attr in child_attrs:
+        child = getattr(node, attr, None)
+        if isinstance(child, (list, tuple)):
+            children += child
+        elif child is not None:
+            children.append(child)
+    return children
+
+
+def local_accesses(node, found: list) -> list:
+    """
+    the reads and writes of locals in node as (node, symbol, is_write) in evaluation
+    order. a step reads its local and then writes it. a write in the right operand
+    of && or || is counted as made, ssa values do not follow control flow inside an
+    expression.
+    """
+    for child in eval_order(node):
+        local_accesses(child, found)
+    if node.kind == HirNodeTag.VarRef and is_local(node.symbol):
+        found.append((node, node.symbol, False))
+    elif node.kind == HirNodeTag.StoreLocal and is_local(node.symbol):
+        found.append((node, node.symbol, True))
+    elif (node.kind == HirNodeTag.UnOp and node.op_tag in step_ops and node.expr.kind == HirNodeTag.VarRef
+          and is_local(node.expr.symbol)):
+        found.append((node, node.expr.symbol, True))
+    return found
+
+
+def is_local(symbol) -> bool:
+    return symbol is not None and symbol.kind in (SymbolKind.Variable, SymbolKind.Parameter)
+
+
+class ControlFlowGraph:
+    """
+    the basic blocks of a function, built from its folded hir. loops, branches,
+    switches, break, continue and return become explicit edges between blocks that
+    hold straight-line statements only, so passes and backends no longer track
+    loop nesting. blocks are numbered in source order and unreachable ones are
+    dropped, jumps through empty blocks go straight to their target.
+
+    with ssa, which only the dumps ask for, every local also gets ssa values:
+    each write starts a new version of the symbol, parameters start at version 0 in the entry block, and a block that
+    two paths with different versions of a live local reach starts with a phi
+    merging them. the versions annotate the hir nodes, the statements themselves
+    still read and write frame slots, so the backends emit code straight from the
+    blocks without leaving ssa first.
+    """
+
+    def __init__(self, func, ssa: bool = False):
+        self.func = func
+        self.blocks = []
+        # (continue target, blocks ending in a break) of each enclosing loop
+        self.loops = []
+        self.entry = self._new_block()
+        end = self._build(func.nodes, self.entry)
+        if end is not None:
+            end.terminator = Ret()
+        self._thread_jumps()
+        self._drop_unreachable()
+        self._link()
+        # id of a VarRef, StoreLocal or step -> version of the local it reads or writes
+        self.versions = {}
+        if ssa:
+            self._build_ssa()
+
+    def _new_block(self) -> BasicBlock:
+        block = BasicBlock(len(self.blocks))
+        self.blocks.append(block)
+        return block
+
+    def _build(self, nodes, block):
+        """
+        add nodes to the end of block
+        :return: the block control continues in, None when it cannot get past nodes
+        """
+        for node in nodes:
+            if block is None:
+                # code no path reaches, it is dropped with its block
+                block = self._new_block()
+            kind = node.kind
+            if kind in (HirNodeTag.Block, HirNodeTag.FunctionBlock):
+                block = self._build(node.nodes, block)
+            elif kind == HirNodeTag.LoopBlock:
+                header = self._new_block()
+                block.terminator = Jump(header)
+                self.loops.append((header, []))
+                end = self._build(node.nodes, header)
+                if end is not None:
+                    end.terminator = Jump(header)
+                (_, breaks) = self.loops.pop()
+                block = self._join(breaks)
+            elif kind == HirNodeTag.Branch:
+                block = self._build_branches(block, [(node.condition, node.then_block)], node.else_block)
+            elif kind == HirNodeTag.MultiBranch:
+                block = self._build_branches(block, node.branches, node.else_block)
+            elif kind == HirNodeTag.Switch:
+                block = self._build_switch(block, node)
+            elif kind == HirNodeTag.Return:
+                block.terminator = Ret(node)
+                block = None
+            elif kind == HirNodeTag.Break:
+                block.terminator = Jump()
+                self.loops[-1][1].append(block)
+                block = None
+            elif kind == HirNodeTag.Continue:
+                block.terminator = Jump(self.loops[-1][0])
+                block = None
+            else:
+                block.nodes.append(node)
+        return block
+
+    def _build_branches(self, block, branches, else_block):
+        # each condition that fails falls to the test of the next one
+        ends = []
+        for (condition, then_block) in branches:
+            jump = CondJump(condition, self._new_block())
+            block.terminator = jump
+            ends.append(self._build(then_block.nodes, jump.if_true))
+            block = jump.if_false = self._new_block()
+        if else_block:
+            ends.append(self._build(else_block.nodes, block))
+        else:
+            ends.append(block)
+        return self._join(ends)
+
+    def _build_switch(self, block, node):
+        jump = SwitchJump(node.expr, [])
+        block.terminator = jump
+        ends = []
+        if node.else_block:
+            jump.default = self._new_block()
+            ends.append(self._build(node.else_block.nodes, jump.default))
+        for (labels, case_block) in node.branches:
+            target = self._new_block()
+            jump.cases.append((labels, target))
+            ends.append(self._build(case_block.nodes, target))
+        merge = self._join(ends)
+        if jump.default is None:
+            jump.default = merge = merge or self._new_block()
+        return merge
+
+    def _join(self, ends):
+        """
+        a new block that the blocks in ends jump to
+        :return: the block, None when no block reaches it
+        """
+        ends = [end for end in ends if end is not None]
+        if not ends:
+            return None
+        merge = self._new_block()
+        for end in ends:
+            end.terminator = Jump(merge)
+        return merge
+
+    @staticmethod
+    def _forward(block):
+        seen = set()
+        while not block.nodes and isinstance(block.terminator, Jump) and block not in seen:
+            seen.add(block)
+            block = block.terminator.target
+        return block
+
+    def _thread_jumps(self):
+        for block in self.blocks:
+            term = block.terminator
+            if isinstance(term, Jump):
+                term.target = self._forward(term.target)
+            elif isinstance(term, CondJump):
+                term.if_true = self._forward(term.if_true)
+                term.if_false = self._forward(term.if_false)
+            elif isinstance(term, SwitchJump):
+                term.default = self._forward(term.default)
+                term.cases = [(labels, self._forward(target)) for (labels, target) in term.cases]
+
+    def _drop_unreachable(self):
+        reached = {self.entry}
+        pending = [self.entry]
+        while pending:
+            for succ in pending.pop().successors():
+                if succ not in reached:
+                    reached.add(succ)
+                    pending.append(succ)
+        self.blocks = [block for block in self.blocks if block in reached]
+        for (index, block) in enumerate(self.blocks):
+            block.index = index
+
+    def _link(self):
+        for block in self.blocks:
+            for succ in block.successors():
+                if block not in succ.preds:
+                    succ.preds.append(block)
+
+    def _dominators(self) -> dict:
+        """
+        the immediate dominator of every block, the entry block maps to itself
+        """
+        # depth-first postorder, with an explicit stack since a function can be
+        # thousands of blocks deep
+        order = []
+        seen = {self.entry}
+        stack = [(self.entry, iter(self.entry.successors()))]
+        while stack:
+            (block, succs) = stack[-1]
+            for succ in succs:
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append((succ, iter(succ.successors())))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        rpo = {block: i for (i, block) in enumerate(reversed(order))}
+        idom = {self.entry: self.entry}
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(order):
+                if block is self.entry:
+                    continue
+                new = None
+                for pred in block.preds:
+                    if pred not in idom:
+                        continue
+                    if new is None:
+                        new = pred
+                        continue
+                    # walk both up the tree until they meet
+                    a, b = pred, new
+                    while a is not b:
+                        while rpo[a] > rpo[b]:
+                            a = idom[a]
+                        while rpo[b] > rpo[a]:
+                            b = idom[b]
+                    new = a
+                if idom.get(block) is not new:
+                    idom[block] = new
+                    changed = True
+        return idom
+
+    def _liveness(self, accesses: dict) -> dict:
+        """
+        :return: the locals each block reads before writing them, its own or a successor's
+        """
+        uses = {}
+        defs = {}
+        for block in self.blocks:
+            uses[block] = set()
+            defs[block] = set()
+            for (_, symbol, is_write) in accesses[block]:
+                if is_write:
+                    defs[block].add(symbol)
+                elif symbol not in defs[block]:
+                    uses[block].add(symbol)
+        live_in = {block: set(uses[block]) for block in self.blocks}
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(self.blocks):
+                live_out = set()
+                for succ in block.successors():
+                    live_out |= live_in[succ]
+                live = uses[block] | (live_out - defs[block])
+                if live != live_in[block]:
+                    live_in[block] = live
+                    changed = True
+        return live_in
+
+    def _build_ssa(self):
+        accesses = {}
+        for block in self.blocks:
+            found = []
+            for node in block.nodes:
+                local_accesses(node, found)
+            term = block.terminator
+            if isinstance(term, CondJump):
+                local_accesses(term.condition, found)
+            elif isinstance(term, SwitchJump):
+                local_accesses(term.expr, found)
+            elif isinstance(term, Ret) and term.node is not None and term.node.expr is not None:
+                local_accesses(term.node.expr, found)
+            accesses[block] = found
+
+        idom = self._dominators()
+        frontiers = {block: set() for block in self.blocks}
+        for block in self.blocks:
+            if len(block.preds) < 2:
+                continue
+            for pred in block.preds:
+                runner = pred
+                while runner is not idom[block]:
+                    frontiers[runner].add(block)
+                    runner = idom[runner]
+
+        # phis go on the iterated dominance frontier of the writes, where the local is live
+        live_in = self._liveness(accesses)
+        def_blocks = {}
+        for block in self.blocks:
+            for (_, symbol, is_write) in accesses[block]:
+                if is_write:
+                    def_blocks.setdefault(symbol, set()).add(block)
+        params = self.params()
+        for symbol in params:
+            def_blocks.setdefault(symbol, set()).add(self.entry)
+        for (symbol, blocks) in def_blocks.items():
+            pending = list(blocks)
+            while pending:
+                for frontier in frontiers[pending.pop()]:
+                    if symbol not in frontier.phis and symbol in live_in[frontier]:
+                        frontier.phis[symbol] = Phi(symbol)
+                        pending.append(frontier)
+
+        children = {block: [] for block in self.blocks}
+        for block in self.blocks:
+            if block is not self.entry:
+                children[idom[block]].append(block)
+        self.next_version = {symbol: 1 for symbol in params}
+        # preorder over the dominator tree, each block starts from the versions
+        # its immediate dominator ends with
+        pending = [(self.entry, {symbol: 0 for symbol in params})]
+        while pending:
+            (block, current) = pending.pop()
+            current = self._rename(block, current, accesses)
+            pending += [(child, current) for child in reversed(children[block])]
+
+    def params(self) -> list:
+        """
+        the parameter symbols the body reads, the function symbol keeps copies of them
+        """
+        return sorted((symbol for symbol in self.func.symbols.values() if symbol.kind == SymbolKind.Parameter),
+                      key=lambda symbol: symbol.local_offset)
+
+    def _rename(self, block, current: dict, accesses: dict) -> dict:
+        """
+        :return: the version of every local at the end of block
+        """
+        current = dict(current)
+        for phi in block.phis.values():
+            phi.version = self._new_version(phi.symbol)
+            current[phi.symbol] = phi.version
+        for (node, symbol, is_write) in accesses[block]:
+            if is_write:
+                current[symbol] = self._new_version(symbol)
+            # a read of a local no path wrote before it has no version
+            self.versions[id(node)] = current.get(symbol)
+        for succ in block.successors():
+            for phi in succ.phis.values():
+                phi.args[block] = current.get(phi.symbol)
+        return current
+
+    def _new_version(self, symbol) -> int:
+        version = self.next_version.get(symbol, 1)
+        self.next_version[symbol] = version + 1
+        return version
+
+    def dump(self, out):
+        params = ", ".join(f"{symbol.name}.0" for symbol in self.params())
+        out.write(f"fn {self.func.name}({params})\n")
+        for block in self.blocks:
+            preds = ", ".join(pred.label for pred in block.preds)
+            out.write(f"  {block.label}:" + (f"  ; preds {preds}" if preds else "") + "\n")
+            for phi in block.phis.values():
+                args = ", ".join(f"{pred.label}: {self._value(phi.symbol, version)}"
+                                 for (pred, version) in phi.args.items())
+                out.write(f"    {self._value(phi.symbol, phi.version)} = phi({args})\n")
+            for node in block.nodes:
+                out.write(f"    {self.format(node)}\n")
+            out.write(f"    {self._format_terminator(block.terminator)}\n")
+
+    @staticmethod
+    def _value(symbol, version) -> str:
+        return f"{symbol.name}.{'?' if version is None else version}"
+
+    def _format_terminator(self, term) -> str:
+        if isinstance(term, Jump):
+            return f"goto {term.target.label}"
+        if isinstance(term, CondJump):
+            return f"if {self.format(term.condition)} goto {term.if_true.label} else {term.if_false.label}"
+        if isinstance(term, SwitchJump):
+            cases = ", ".join(f"{'/'.join(str(label.val) for label in labels)}: {target.label}"
+                              for (labels, target) in term.cases)
+            return f"switch {self.format(term.expr)} [{cases}] default {term.default.label}"
+        if term.node is None or term.node.expr is None:
+            return "return"
+        return f"return {self.format(term.node.expr)}"
+
+    def format(self, node) -> str:
+        """
+        a hir statement or expression as source-like text, locals with their ssa version
+        """
+        kind = node.kind
+        if kind == HirNodeTag.ConstInt:
+            return str(node.val)
+        if kind == HirNodeTag.ConstBool:
+            return "true" if node.val else "false"
+        if kind == HirNodeTag.ConstStr:
+            return repr(node.val)
+        if kind == HirNodeTag.VarRef:
+            if is_local(node.symbol):
+                return self._value(node.symbol, self.versions.get(id(node)))
+            return node.name
+        if kind == HirNodeTag.StoreLocal:
+            target = self._value(node.symbol, self.versions.get(id(node))) if is_local(node.symbol) else node.name
+            return f"{target} = {self.format(node.value)}"
+        if kind == HirNodeTag.BinOp:
+            return f"({self.format(node.lhs)} {binop_symbols[node.op_tag]} {self.format(node.rhs)})"
+        if kind == HirNodeTag.UnOp:
+            if node.op_tag == OpTag.Not:
+                return f"!{self.format(node.expr)}"
+            sign = "++" if node.op_tag in (OpTag.PreIncrement, OpTag.PostIncrement) else "--"
+            if node.expr.kind == HirNodeTag.VarRef and id(node) in self.versions:
+                return f"({self._value(node.expr.symbol, self.versions[id(node)])} = {self.format(node.expr)}{sign})"
+            return f"{self.format(node.expr)}{sign}"
+        if kind == HirNodeTag.Cast:
+            return f"({self.format(node.expr)} as {TypeRegistry.get_instance().get_type(node.to_type).kind})"
+        if kind == HirNodeTag.BoolCast:
+            return f"bool({self.format(node.expr)})"
+        if kind == HirNodeTag.Call:
+            return f"{node.function_symbol.name}({', '.join(self.format(arg) for arg in node.args)})"
+        if kind == HirNodeTag.InlinedCall:
+            stores = "".join(f"{self.format(store)}; " for store in node.stores)
+            return f"inline {node.function_symbol.name}{{{stores}{self.format(node.value)}}}"
+        if kind == HirNodeTag.FieldAccess:
+            return f"{self.format(node.obj)}.{node.target.value}"
+        if kind == HirNodeTag.StoreField:
+            return f"{self.format(node.obj)}.{node.field_name.value} = {self.format(node.value)}"
+        if kind == HirNodeTag.IndexedAccess:
+            return f"{self.format(node.container)}[{self.format(node.index)}]"
+        if kind == HirNodeTag.StoreIndexed:
+            return f"{self.format(node.obj)} = {self.format(node.value)}"
+        if kind == HirNodeTag.CreateStruct:
+            fields = ", ".join(f".{field.name.value}={self.format(field.value)}" for field in node.values)
+            return f"{self.format(node.name)}{{{fields}}}"
+        if kind == HirNodeTag.ArrayLiteral:
+            return f"[{', '.join(self.format(element) for element in node.elements)}]"
+        if kind == HirNodeTag.Log:
+            return f"log {self.format(node.expr)}"
+        return kind.value
@@ -0,0 +1,322 @@
+# constant folding and propagation over the analyzed hir
+
+from hir import ConstBool, ConstInt, HirNodeTag
+from pico_ast import OpTag
+from pico_types import TypeRegistry
+from symtab import SymbolKind
+
+INT_MIN = -(1 << 31)
+
+
+def wrap_int(value: int) -> int:
+    """
+    truncate a python int to the vm's 32-bit two's complement integer
+    """
+    value &= 0xFFFFFFFF
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+def c_div(a: int, b: int) -> int:
+    # C division truncates towards zero, python's floors
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def c_rem(a: int, b: int) -> int:
+    return a - b * c_div(a, b)
+
+
+int_folds = {
+    OpTag.ADD: lambda a, b: a + b,
+    OpTag.SUB: lambda a, b: a - b,
+    OpTag.MUL: lambda a, b: a * b,
+    OpTag.DIV: c_div,
+    OpTag.MOD: c_rem,
+    OpTag.BAND: lambda a, b: a & b,
+    OpTag.BOR: lambda a, b: a | b,
+    OpTag.BXOR: lambda a, b: a ^ b,
+    OpTag.SHL: lambda a, b: a << b,
+    OpTag.SHR: lambda a, b: a >> b,
+}
+
+compare_folds = {
+    OpTag.EQ: lambda a, b: a == b,
+    OpTag.NEQ: lambda a, b: a != b,
+    OpTag.LT: lambda a, b: a < b,
+    OpTag.LTE: lambda a, b: a <= b,
+    OpTag.GT: lambda a, b: a > b,
+    OpTag.GTE: lambda a, b: a >= b,
+}
+
+# && and || only evaluate their right operand when the left one does not decide the result
+short_circuit_ops = (OpTag.AND, OpTag.OR)
+
+# nodes after which the rest of a block can never run
+terminators = (HirNodeTag.Return, HirNodeTag.Break, HirNodeTag.Continue)
+
+# attributes that hold child nodes, walked when counting writes
+child_attrs = ("nodes", "value", "expr", "lhs", "rhs", "args", "condition", "then_block", "else_block",
+               "branches", "elements", "values", "obj", "container", "index", "stores")
+
+
+def is_const(node) -> bool:
+    return node.kind in (HirNodeTag.ConstInt, HirNodeTag.ConstBool)
+
+
+class ConstFold:
+    """
+    runs between sema and ir. folds operators whose operands are int or bool
+    constants, replaces loads of locals that are only ever assigned a constant
+    by that constant and drops branches whose condition is known.
+    the folds follow the vm's int32 semantics, anything that would trap or is
+    undefined in C (division by zero, shifts out of range) is left to the vm.
+    """
+
+    def __init__(self, block):
+        self.block = block
+        self.write_counts = {}
+        # variables whose only write is a constant declaration
+        self.constants = {}
+
+    def run(self):
+        for node in self.block.nodes:
+            if node.kind == HirNodeTag.FunctionBlock:
+                self._fold_function(node)
+
+    def _fold_function(self, fb):
+        self.write_counts = {}
+        self.constants = {}
+        self._count_writes(fb)
+        self._fold_block(fb)
+
+    def _count_writes(self, node):
+        """
+        count the stores to every local in a function, increments and
+        decrements included. every variable is declared with an initializer,
+        so a count of one means the declaration is the only write.
+        :return:None
+        """
+        if isinstance(node, (list, tuple)):
+            for child in node:
+                self._count_writes(child)
+            return
+        if node.kind == HirNodeTag.StoreLocal:
+            self.write_counts[node.symbol] = self.write_counts.get(node.symbol, 0) + 1
+        elif node.kind == HirNodeTag.UnOp and node.op_tag != OpTag.Not and node.expr.kind == HirNodeTag.VarRef:
+            self.write_counts[node.expr.symbol] = self.write_counts.get(node.expr.symbol, 0) + 1
+        for attr in child_attrs:
+            child = getattr(node, attr, None)
+            if child is not None:
+                self._count_writes(child)
+
+    def _fold_block(self, block):
+        nodes = []
+        for node in block.nodes:
+            nodes += self._fold_stmt(node)
+            # nothing after a return, break or continue can run
+            if nodes and nodes[-1].kind in terminators:
+                break
+        block.nodes = nodes
+
+    def _fold_stmt(self, node) -> list:
+        """
+        fold a statement, returning the nodes that replace it
+        """
+        kind = node.kind
+        if kind == HirNodeTag.StoreLocal:
+            node.value = self._fold_expr(node.value)
+            if self.write_counts.get(node.symbol) == 1 and self._propagates(node.symbol, node.value):
+                self.constants[node.symbol] = node.value
+                return []
+            return [node]
+        elif kind in (HirNodeTag.Return, HirNodeTag.Log):
+            if node.expr:
+                node.expr = self._fold_expr(node.expr)
+            return [node]
+        elif kind in (HirNodeTag.Block, HirNodeTag.LoopBlock):
+            self._fold_block(node)
+            return [node]
+        elif kind == HirNodeTag.Branch:
+            return self._fold_branch(node)
+        elif kind == HirNodeTag.MultiBranch:
+            return self._fold_multibranch(node)
+        elif kind == HirNodeTag.Switch:
+            return self._fold_switch(node)
+        elif kind in (HirNodeTag.Break, HirNodeTag.Continue):
+            return [node]
+        else:
+            return [self._fold_expr(node)]
+
+    def _fold_branch(self, node) -> list:
+        node.condition = self._fold_expr(node.condition)
+        if node.condition.kind == HirNodeTag.ConstBool:
+            taken = node.then_block if node.condition.val else node.else_block
+            return self._inline_block(taken)
+        self._fold_block(node.then_block)
+        if node.else_block:
+            self._fold_block(node.else_block)
+        return [node]
+
+    def _fold_multibranch(self, node) -> list:
+        branches = []
+        else_block = node.else_block
+        for (condition, block) in node.branches:
+            condition = self._fold_expr(condition)
+            if condition.kind == HirNodeTag.ConstBool:
+                if not condition.val:
+                    continue
+                # the first branch that is always taken ends the chain
+                else_block = block
+                break
+            branches.append((condition, block))
+        for (_, block) in branches:
+            self._fold_block(block)
+        if not branches:
+            return self._inline_block(else_block)
+        if else_block:
+            self._fold_block(else_block)
+        node.branches = branches
+        node.else_block = else_block
+        return [node]
+
+    def _fold_switch(self, node) -> list:
+        node.expr = self._fold_expr(node.expr)
+        if node.expr.kind == HirNodeTag.ConstInt:
+            # a known value always takes the same case
+            for (labels, block) in node.branches:
+                if any(label.val == node.expr.val for label in labels):
+                    return self._inline_block(block)
+            return self._inline_block(node.else_block)
+        for (_, block) in node.branches:
+            self._fold_block(block)
+        if node.else_block:
+            self._fold_block(node.else_block)
+        return [node]
+
+    def _inline_block(self, block) -> list:
+        """
+        the nodes of a branch that is always taken. symbols are already resolved,
+        so a plain block can be spliced into its parent.
+        """
+        if block is None:
+            return []
+        self._fold_block(block)
+        if block.kind == HirNodeTag.Block:
+            return block.nodes
+        return [block]
+
+    def _propagates(self, symbol, value) -> bool:
+        # a parameter assigned once still holds the argument before the store
+        if symbol.kind != SymbolKind.Variable:
+            return False
+        if value.kind == HirNodeTag.ConstInt:
+            return symbol.type == TypeRegistry.IntType
+        if value.kind == HirNodeTag.ConstBool:
+            return symbol.type == TypeRegistry.BoolType
+        return False
+
+    def _fold_expr(self, expr):
+        kind = expr.kind
+        if kind == HirNodeTag.VarRef:
+            const = self.constants.get(expr.symbol)
+            if const is not None:
+                return self._const_like(expr, const.val)
+            return expr
+        elif kind == HirNodeTag.BinOp:
+            expr.lhs = self._fold_expr(expr.lhs)
+            expr.rhs = self._fold_expr(expr.rhs)
+            return self._fold_binop(expr)
+        elif kind == HirNodeTag.UnOp:
+            if expr.op_tag != OpTag.Not:
+                # increments and decrements take the variable itself
+                if expr.expr.kind != HirNodeTag.VarRef:
+                    expr.expr = self._fold_expr(expr.expr)
+                return expr
+            expr.expr = self._fold_expr(expr.expr)
+            if expr.expr.kind == HirNodeTag.ConstBool:
+                return self._const_like(expr, not expr.expr.val)
+            return expr
+        elif kind == HirNodeTag.BoolCast:
+            expr.expr = self._fold_expr(expr.expr)
+            if expr.expr.kind == HirNodeTag.ConstInt:
+                return self._const_like(expr, expr.expr.val != 0)
+            return expr
+        elif kind == HirNodeTag.Cast:
+            expr.expr = self._fold_expr(expr.expr)
+            # long constants have no constant table entry, so only casts to int fold
+            if expr.to_type == TypeRegistry.IntType and expr.expr.kind == HirNodeTag.ConstBool:
+                return self._const_like(expr, int(expr.expr.val))
+            return expr
+        elif kind == HirNodeTag.Call:
+            expr.args = [self._fold_expr(arg) for arg in expr.args]
+        elif kind == HirNodeTag.InlinedCall:
+            stores = []
+            for store in expr.stores:
+                store.value = self._fold_expr(store.value)
+                if self.write_counts.get(store.symbol) == 1 and self._propagates(store.symbol, store.value):
+                    self.constants[store.symbol] = store.value
+                else:
+                    stores.append(store)
+            expr.stores = stores
+            expr.value = self._fold_expr(expr.value)
+            # once every argument is propagated only the callee's expression is left
+            return expr if stores else expr.value
+        elif kind == HirNodeTag.StoreLocal:
+            expr.value = self._fold_expr(expr.value)
+        elif kind == HirNodeTag.StoreField:
+            expr.obj = self._fold_expr(expr.obj)
+            expr.value = self._fold_expr(expr.value)
+        elif kind == HirNodeTag.StoreIndexed:
+            expr.obj = self._fold_expr(expr.obj)
+            expr.value = self._fold_expr(expr.value)
+        elif kind == HirNodeTag.FieldAccess:
+            expr.obj = self._fold_expr(expr.obj)
+        elif kind == HirNodeTag.IndexedAccess:
+            expr.container = self._fold_expr(expr.container)
+            expr.index = self._fold_expr(expr.index)
+        elif kind == HirNodeTag.CreateStruct:
+            for field in expr.values:
+                field.value = self._fold_expr(field.value)
+        elif kind == HirNodeTag.ArrayLiteral:
+            expr.elements = [self._fold_expr(ele) for ele in expr.elements]
+        return expr
+
+    def _fold_binop(self, expr):
+        lhs, rhs = expr.lhs, expr.rhs
+        if expr.op_tag in short_circuit_ops and lhs.kind == HirNodeTag.ConstBool:
+            # a constant left operand either decides the result, and the right one is
+            # never evaluated, or leaves the result to the right operand
+            decides = expr.op_tag == OpTag.OR
+            return self._const_like(expr, decides) if lhs.val == decides else rhs
+        if (expr.op_tag in short_circuit_ops and rhs.kind == HirNodeTag.ConstBool
+                and rhs.val != (expr.op_tag == OpTag.OR)):
+            # `x && true` and `x || false` are x, which is evaluated either way
+            return lhs
+        if not (is_const(lhs) and is_const(rhs)) or lhs.kind != rhs.kind:
+            return expr
+        a, b = lhs.val, rhs.val
+        op = expr.op_tag
+        if lhs.kind == HirNodeTag.ConstBool:
+            if op in (OpTag.EQ, OpTag.NEQ):
+                return self._const_like(expr, compare_folds[op](a, b))
+            return expr
+        if op in compare_folds:
+            return self._const_like(expr, compare_folds[op](a, b))
+        if op not in int_folds:
+            return expr
+        if op in (OpTag.DIV, OpTag.MOD) and (b == 0 or (a == INT_MIN and b == -1)):
+            return expr
+        if op in (OpTag.SHL, OpTag.SHR) and not 0 <= b < 32:
+            return expr
+        return self._const_like(expr, wrap_int(int_folds[op](a, b)))
+
+    @staticmethod
+    def _const_like(expr, value):
+        if isinstance(value, bool):
+            const = ConstBool(value)
+            const.token = expr.token
+            const.type_id = TypeRegistry.BoolType
+        else:
+            const = ConstInt(expr.token, value)
+            const.type_id = TypeRegistry.IntType
+        return const
@@ -21,6 +21,7 @@ class HirNodeTag(Enum):
     StoreField = "StoreField"
 
     MultiBranch = "MultiBranch"
+    Switch = "Switch"
     IndexedAccess = "IndexedAccess"
 
     Break = "Break"
@@ -37,6 +38,7 @@ class HirNodeTag(Enum):
     ConstStr = "ConstStr"
     ConstBool = "ConstBool"
     Call = "Call"
+    InlinedCall = "InlinedCall"
     StoreIndexed = "StoreIndexed"
 
 
@@ -137,6 +139,15 @@ class MultiBranch(HirNode):
         super().__init__(HirNodeTag.MultiBranch, token=token, branches=branches, else_block=else_block)
 
 
+class Switch(HirNode):
+    """
+    branches are (labels, block) pairs, the labels are the ConstInts that select the block
+    """
+
+    def __init__(self, token, expr, branches, else_block):
+        super().__init__(HirNodeTag.Switch, token=token, expr=expr, branches=branches, else_block=else_block)
+
+
 class Return(HirNode):
     def __init__(self, token=None, expr=None):
         super().__init__(HirNodeTag.Return, token=token, expr=expr)
@@ -180,7 +191,7 @@ class Cast(HirNode):
 
 class BoolCast(HirNode):
     def __init__(self, token, expr):
-        super().__init__(HirNodeTag.Cast, token=token, expr=expr)
+        super().__init__(HirNodeTag.BoolCast, token=token, expr=expr)
 
 
 class StaticAccess(HirNode):
@@ -238,6 +249,17 @@ class Call(HirNode):
         self.function_symbol = None  # filled by sema
 
 
+class InlinedCall(HirNode):
+    """
+    a call replaced by the callee's return expression. stores copy the arguments
+    into the caller slots that stand in for the parameters, then value is evaluated.
+    """
+
+    def __init__(self, token, function_symbol, stores, value):
+        super().__init__(HirNodeTag.InlinedCall, token=token, function_symbol=function_symbol, stores=stores,
+                         value=value)
+
+
 class BinOp(HirNode):
     def __init__(self, token, op_tag, lhs, rhs):
         super().__init__(HirNodeTag.BinOp, token=token, op_tag=op_tag, lhs=lhs, rhs=rhs)
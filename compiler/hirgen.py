@@ -4,7 +4,7 @@ from function_id import FunctionIdGenerator
 from hir import BinOp, HirBlock, FunctionBlock, Return as HirReturn, ConstInt, HirNodeTag, HirLog, StoreLocal, BlockTag, \
     VarRef, Branch, LoopBlock, Continue, Break, Call, HirExternalLibBlock, ConstStr, ConstBool, StaticAccess, \
     FieldValue, CreateStruct, FieldAccess, Cast, UnOp, StoreField, MultiBranch, ArrayLiteral, IndexedAccess, \
-    StoreIndexed
+    StoreIndexed, Switch
 from pico_ast import Program, FunctionDeclaration, FunctionPrototype, Block, Return, NodeTag, OpTag
 from pico_error import PicoError
 from pico_types import TypeRegistry
@@ -110,6 +110,7 @@ class HirGen:
             self.function_block = FunctionBlock(
                 func_symbol.function_id,
                 node.proto.name,
+                token=node.proto.token,
                 symbol=func_symbol,
                 type_id=func_symbol.type,
                 parent=self.global_block,
@@ -189,6 +190,8 @@ class HirGen:
             self._generate_block(node)
         elif node.tag == NodeTag.If:
             self._generate_if_stmt(node)
+        elif node.tag == NodeTag.Switch:
+            self._generate_switch_stmt(node)
         elif node.tag == NodeTag.LoopStmt:
             self._generate_loop_stmt(node)
         elif node.tag == NodeTag.WhileLoopStmt:
@@ -452,6 +455,28 @@ class HirGen:
             self.current_block = self.current_block.parent
         self.current_block.add_node(MultiBranch(node.token, branches, else_block))
 
+    def _generate_switch_stmt(self, node):
+        subject = self._generate_expr(node.subject)
+        branches = []
+        for case in node.cases:
+            labels = [ConstInt(label.token, label.value) for label in case.labels]
+            branches.append((labels, self._generate_case_block(case.body, BlockLabelGenerator.next("case"))))
+        else_block = None
+        if node.default_stmt:
+            else_block = self._generate_case_block(node.default_stmt, BlockLabelGenerator.next("default"))
+        self.current_block.add_node(Switch(node.token, subject, branches, else_block))
+
+    def _generate_case_block(self, body: Block, label):
+        self._begin_scope()
+        case_block = HirBlock(HirNodeTag.Block, label, body.token, BlockTag.Local, self.scope_depth,
+                              self.current_block)
+        self.current_block = case_block
+        for stmt in body.stmts:
+            self._generate_stmt(stmt)
+        self._end_scope()
+        self.current_block = self.current_block.parent
+        return case_block
+
     def _generate_block(self, node: Block):
         self._begin_scope()
         block = HirBlock(HirNodeTag.Block, BlockLabelGenerator.temp(), node.token, block_tag=BlockTag.Local,
@@ -0,0 +1,175 @@
+# inlining of small internal functions at their call sites
+
+import copy
+
+from constfold import child_attrs
+from hir import HirNodeTag, InlinedCall, StoreLocal
+from symtab import Linkage, Symbol, SymbolKind
+
+# largest callee return expression, counted in hir nodes, that gets inlined
+INLINE_MAX_NODES = 24
+
+
+def count_nodes(node) -> int:
+    if isinstance(node, (list, tuple)):
+        return sum(count_nodes(child) for child in node)
+    return 1 + sum(count_nodes(child) for attr in child_attrs
+                   if (child := getattr(node, attr, None)) is not None)
+
+
+def clone_expr(node, symbols: dict):
+    """
+    copy an expression, reads and writes of a symbol in symbols use its replacement
+    """
+    if isinstance(node, list):
+        return [clone_expr(child, symbols) for child in node]
+    if isinstance(node, tuple):
+        return tuple(clone_expr(child, symbols) for child in node)
+    clone = copy.copy(node)
+    if node.kind in (HirNodeTag.VarRef, HirNodeTag.StoreLocal) and node.symbol in symbols:
+        clone.symbol = symbols[node.symbol]
+    for attr in child_attrs:
+        child = getattr(node, attr, None)
+        if child is not None:
+            setattr(clone, attr, clone_expr(child, symbols))
+    return clone
+
+
+def return_expr(func):
+    """
+    the returned expression of a function whose whole body is `return expr;`
+    :return: the expression, None for any other body
+    """
+    nodes = func.nodes
+    while len(nodes) == 1 and nodes[0].kind == HirNodeTag.Block:
+        nodes = nodes[0].nodes
+    if len(nodes) == 1 and nodes[0].kind == HirNodeTag.Return:
+        return nodes[0].expr
+    return None
+
+
+class Inliner:
+    """
+    runs between sema and constfold. a call to an internal function whose body is a
+    single return of at most max_nodes hir nodes, and that cannot reach itself through
+    the call graph, is replaced by an InlinedCall: the arguments are stored into fresh
+    slots appended to the caller's locals and a copy of the callee's expression reads
+    them in place of the parameters. extern functions are never inlined.
+    """
+
+    def __init__(self, block, max_nodes: int = INLINE_MAX_NODES):
+        self.block = block
+        self.max_nodes = max_nodes
+        # function_id -> FunctionBlock
+        self.functions = {}
+        # function_id -> untouched copy of the expression that gets inlined
+        self.bodies = {}
+        # function_id -> why calls to it are not inlined
+        self.rejected = {}
+        # (callee, caller, line, reason), reason is None for an inlined call
+        self.decisions = []
+        self.function_block = None
+
+    def run(self):
+        for node in self.block.nodes:
+            if node.kind == HirNodeTag.FunctionBlock:
+                self.functions[node.function_id] = node
+        callees = {fid: self._callees(fb, set()) for fid, fb in self.functions.items()}
+        for fid, fb in self.functions.items():
+            expr = return_expr(fb)
+            if expr is None:
+                self.rejected[fid] = "not a single return"
+            elif self._reaches(callees, fid, fid):
+                self.rejected[fid] = "recursive"
+            elif (size := count_nodes(expr)) > self.max_nodes:
+                self.rejected[fid] = f"too large ({size} nodes)"
+            else:
+                self.bodies[fid] = clone_expr(expr, {})
+        for fb in self.functions.values():
+            self.function_block = fb
+            self._visit(fb)
+
+    def _callees(self, node, found: set) -> set:
+        if isinstance(node, (list, tuple)):
+            for child in node:
+                self._callees(child, found)
+            return found
+        if node.kind == HirNodeTag.Call and node.function_symbol.linkage == Linkage.Internal:
+            found.add(node.function_symbol.function_id)
+        for attr in child_attrs:
+            child = getattr(node, attr, None)
+            if child is not None:
+                self._callees(child, found)
+        return found
+
+    @staticmethod
+    def _reaches(callees: dict, start: int, target: int) -> bool:
+        seen = set()
+        pending = list(callees.get(start, ()))
+        while pending:
+            fid = pending.pop()
+            if fid == target:
+                return True
+            if fid not in seen:
+                seen.add(fid)
+                pending += callees.get(fid, ())
+        return False
+
+    def _visit(self, node):
+        """
+        inline the calls below node, children first so arguments are already inlined
+        :return: the node that replaces node
+        """
+        if isinstance(node, list):
+            return [self._visit(child) for child in node]
+        if isinstance(node, tuple):
+            return tuple(self._visit(child) for child in node)
+        for attr in child_attrs:
+            child = getattr(node, attr, None)
+            if child is not None:
+                setattr(node, attr, self._visit(child))
+        if node.kind == HirNodeTag.Call:
+            return self._inline_call(node)
+        return node
+
+    def _inline_call(self, call):
+        callee = call.function_symbol
+        if callee.linkage == Linkage.External:
+            self._decide(call, "external")
+            return call
+        reason = self.rejected.get(callee.function_id)
+        if reason:
+            self._decide(call, reason)
+            return call
+
+        caller = self.function_block
+        params = sorted((sym for sym in self.functions[callee.function_id].symbols.values()
+                         if sym.kind == SymbolKind.Parameter), key=lambda sym: sym.local_offset)
+        slots = {}
+        stores = []
+        # the body's parameter symbols may still hold the declared type, the
+        # function symbol's params have the resolved type ids
+        for param, resolved, arg in zip(params, callee.params, call.args):
+            slot = Symbol(f"{callee.name}.{param.name}", SymbolKind.Variable, resolved.type, caller.scope_depth)
+            slot.local_offset = caller.local_count
+            caller.local_count += 1
+            slots[param] = slot
+            store = StoreLocal(slot.name, call.token, slot, arg)
+            store.type_id = resolved.type
+            stores.append(store)
+        # calls in the callee's expression are inlined into the caller as well
+        value = self._visit(clone_expr(self.bodies[callee.function_id], slots))
+        inlined = InlinedCall(call.token, callee, stores, value)
+        inlined.type_id = call.type_id
+        self._decide(call, None)
+        return inlined
+
+    def _decide(self, call, reason):
+        self.decisions.append((call.function_symbol.name, self.function_block.name, call.token.loc.line, reason))
+
+    def report(self, out):
+        inlined = sum(1 for decision in self.decisions if decision[3] is None)
+        out.write(f"inline: {inlined} of {len(self.decisions)} call sites inlined\n")
+        for (callee, caller, line, reason) in self.decisions:
+            status = "inlined" if reason is None else f"kept, {reason}"
+            out.write(f"  {callee} into {caller} at line {line}: {status}\n")
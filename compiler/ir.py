@@ -1,8 +1,16 @@
-from hir import FunctionBlock, HirBlock, HirNodeTag
+from cfg import CondJump, ControlFlowGraph, Jump, SwitchJump
+from hir import FunctionBlock, HirNodeTag
 from pico_ast import OpTag
-from pico_types import TypeRegistry
+from pico_types import TypeRegistry, ArrayRepr
 from symtab import Linkage
 
+# instruction set of the emitted code, byte 4 of the .pbc header
+MODE_STACK = 0
+MODE_REGISTER = 1
+
+# the operands of the next instruction are four bytes wide, see opcodes.md
+OP_WIDE = 0x01
+
 # data
 OP_LIC = 0x05
 OP_LSC = 0x06
@@ -14,6 +22,8 @@ OP_ILOAD = 0x0B
 OP_LOAD = 0x0C
 OP_IINC = 0x0D
 OP_IDEC = 0x0E
+OP_TEE = 0x0F
+OP_POP = 0x10
 
 # integer arithmetic
 OP_IADD = 0x20
@@ -47,12 +57,16 @@ OP_I2B = 0x5E
 
 # control flow
 OP_JF = 0x60
+OP_JT = 0x61
 OP_JMP = 0x62
+OP_TABLESWITCH = 0x63
+OP_LOOKUPSWITCH = 0x64
 OP_RET = 0x66
 OP_CALL = 0x68
 OP_VOID_CALL = 0x69
 OP_CALL_EXTERN = 0x6A
 OP_VOID_CALL_EXTERN = 0x6B
+OP_TAIL_CALL = 0x6C
 
 # structs
 OP_ALLOCA_STRUCT = 0x70
@@ -67,8 +81,37 @@ OP_ARRAY_STORE = 0x7A
 OP_ARRAY_SET = 0x7B
 OP_ARRAY_GET = 0x7C
 
+# packed int32/bool arrays
+OP_ALLOCA_IARRAY = 0x7D
+OP_IARRAY_SET = 0x7E
+OP_IARRAY_GET = 0x7F
+OP_IARRAY_STORE = 0x80
+OP_ALLOCA_BARRAY = 0x81
+OP_BARRAY_SET = 0x82
+OP_BARRAY_GET = 0x83
+OP_BARRAY_STORE = 0x84
+
 OP_LOG = 0x85
 
+# superinstructions, see include/opcodes.h
+OP_JF_ILT = 0x90
+OP_JF_ILE = 0x91
+OP_JF_IGT = 0x92
+OP_JF_IGE = 0x93
+OP_JF_IEQ = 0x94
+OP_JF_INE = 0x95
+OP_JF_ILT_LC = 0x98
+OP_JF_ILE_LC = 0x99
+OP_JF_IGT_LC = 0x9A
+OP_JF_IGE_LC = 0x9B
+OP_JF_IEQ_LC = 0x9C
+OP_JF_INE_LC = 0x9D
+OP_IADD_LC = 0xA0
+OP_ISUB_LC = 0xA1
+OP_IBAND_LC = 0xA2
+OP_IADD_LL = 0xA4
+OP_ISUB_LL = 0xA5
+
 # TODO: replace with type_tag_matrix
 optag_to_opcode = {
     OpTag.ADD: OP_IADD,
@@ -76,8 +119,6 @@ optag_to_opcode = {
     OpTag.MUL: OP_IMUL,
     OpTag.DIV: OP_IDIV,
     OpTag.MOD: OP_IREM,
-    OpTag.AND: OP_IAND,
-    OpTag.OR: OP_IOR,
     OpTag.BAND: OP_IBAND,
     OpTag.BOR: OP_IBOR,
     OpTag.BXOR: OP_IBXOR,
@@ -93,38 +134,108 @@ optag_to_opcode = {
     OpTag.Not: OP_BNOT,
 }
 
+# int comparison -> compare-and-branch superinstructions (stack operands, local and constant)
+# that jump when the comparison is false
+compare_jump_opcodes = {
+    OpTag.LT: (OP_JF_ILT, OP_JF_ILT_LC),
+    OpTag.LTE: (OP_JF_ILE, OP_JF_ILE_LC),
+    OpTag.GT: (OP_JF_IGT, OP_JF_IGT_LC),
+    OpTag.GTE: (OP_JF_IGE, OP_JF_IGE_LC),
+    OpTag.EQ: (OP_JF_IEQ, OP_JF_IEQ_LC),
+    OpTag.NEQ: (OP_JF_INE, OP_JF_INE_LC),
+}
+negated_compares = {
+    OpTag.LT: OpTag.GTE,
+    OpTag.LTE: OpTag.GT,
+    OpTag.GT: OpTag.LTE,
+    OpTag.GTE: OpTag.LT,
+    OpTag.EQ: OpTag.NEQ,
+    OpTag.NEQ: OpTag.EQ,
+}
+# int arithmetic on a local and a constant, or on two locals
+local_const_arith_opcodes = {OpTag.ADD: OP_IADD_LC, OpTag.SUB: OP_ISUB_LC, OpTag.BAND: OP_IBAND_LC}
+local_local_arith_opcodes = {OpTag.ADD: OP_IADD_LL, OpTag.SUB: OP_ISUB_LL}
+
+# a switch gets a jump table when the range its labels span has at most this many
+# entries per label, sparser labels are binary searched instead
+SWITCH_TABLE_DENSITY = 2
+
+# largest operand of a plain instruction, a constant index or jump target above
+# it needs OP_WIDE
+SHORT_OPERAND_MAX = 0xFFFF
+
 bool_cast_table = {3: OP_I2B, 4: OP_L2B}
 cast_table = {(3, 4): OP_I2L, (4, 3): OP_L2I, (2, 3): OP_B2I}
 
+# ++ and -- -> (opcode on a local, opcode on a field)
+inc_dec_opcodes = {
+    OpTag.PreIncrement: (OP_IINC, OP_IFIELD_INC),
+    OpTag.PreDecrement: (OP_IDEC, OP_IFIELD_DEC),
+    OpTag.PostIncrement: (OP_IINC, OP_IFIELD_INC),
+    OpTag.PostDecrement: (OP_IDEC, OP_IFIELD_DEC),
+}
+
+# array representation chosen by sema -> (alloca, set element) and (get, store)
+array_literal_opcodes = {
+    ArrayRepr.Boxed: (OP_ALLOCA_ARRAY, OP_ARRAY_SET),
+    ArrayRepr.PackedInt: (OP_ALLOCA_IARRAY, OP_IARRAY_SET),
+    ArrayRepr.PackedBool: (OP_ALLOCA_BARRAY, OP_BARRAY_SET),
+}
+array_access_opcodes = {
+    ArrayRepr.Boxed: (OP_ARRAY_GET, OP_ARRAY_STORE),
+    ArrayRepr.PackedInt: (OP_IARRAY_GET, OP_IARRAY_STORE),
+    ArrayRepr.PackedBool: (OP_BARRAY_GET, OP_BARRAY_STORE),
+}
+
 
 class FunctionIR:
-    def __init__(self, function_id: int, name_idx: int, local_count: int, param_count: int, bytecode: bytes):
+    def __init__(self, function_id: int, name_idx: int, local_count: int, param_count: int, bytecode: bytes,
+                 returns_value: bool = False):
         self.function_id = function_id
         self.name_idx = name_idx
         self.bytecode = bytecode
         self.local_count = local_count
         self.param_count = param_count
+        # most values on the operand stack at once, filled in by StackDepth
+        self.max_stack = 0
+        # whether its RET finds a value on the stack, only checked by StackDepth
+        self.returns_value = returns_value
 
     def serialize(self) -> bytes:
         result = bytearray()
         result += self.function_id.to_bytes(2, "little")
-        result += self.name_idx.to_bytes(2, "little")
+        result += self.name_idx.to_bytes(4, "little")
         result += self.param_count.to_bytes(2, "little")
         result += self.local_count.to_bytes(2, "little")
+        result += self.max_stack.to_bytes(2, "little")
         result += len(self.bytecode).to_bytes(4, "little")
         result += self.bytecode
         return result
 
 
 class IrModule:
+    code_mode = MODE_STACK
+    jump_op = OP_JMP
+
     def __init__(self):
         self.const_table = []
         self.const_index_map = {}
         self.functions = []
-        self.loop_start_indices = []
-        self.loop_break_patches = []
         self.extern_lib_blocks: dict[str, dict[str, int | list[int]]] = {}
+        self.extern_call_patches: list[tuple[bytearray, int, str, str]] = []
+        # parameters of every entry of the native function table
+        self.extern_param_counts: list[int] = []
         self.main_function_index = 0
+        # bytes per jump target in the function being compiled, four once it
+        # needs wide jumps
+        self.jump_width = 2
+        self.needs_wide = False
+        # whether a return of the function being compiled leaves a value
+        self.returns_value = False
+        # frame slots of the function being compiled, its locals and the scratch
+        # slot that holds the object of a field increment used as a value
+        self.local_count = 0
+        self.scratch_slot = None
 
     def get_const_index(self, value) -> int:
         if value not in self.const_index_map:
@@ -132,15 +243,143 @@ class IrModule:
             self.const_table.append(value)
         return self.const_index_map[value]
 
-    def compile_expr(self, expr, code: bytearray):
+    @staticmethod
+    def expr_type(expr) -> int:
         if expr.kind == HirNodeTag.ConstInt:
-            code.append(OP_LIC)
-            idx = self.get_const_index(expr.val)
+            return TypeRegistry.IntType
+        if expr.kind == HirNodeTag.VarRef:
+            return expr.symbol.type
+        if expr.kind == HirNodeTag.Cast:
+            return expr.to_type
+        return expr.type_id
+
+    @staticmethod
+    def is_int_local(expr) -> bool:
+        return expr.kind == HirNodeTag.VarRef and expr.symbol.type == TypeRegistry.IntType
+
+    def is_short_const(self, value) -> bool:
+        return self.get_const_index(value) <= SHORT_OPERAND_MAX
+
+    def emit_jump(self, code: bytearray, op: int) -> int:
+        """
+        emit a jump whose target is patched later
+        :return: offset of its target operand
+        """
+        if self.jump_width == 4:
+            code.append(OP_WIDE)
+        code.append(op)
+        patch = len(code)
+        code += bytes(self.jump_width)
+        return patch
+
+    def compile_const(self, op: int, value, code: bytearray):
+        idx = self.get_const_index(value)
+        if idx > SHORT_OPERAND_MAX:
+            code.append(OP_WIDE)
+            code.append(op)
+            code += idx.to_bytes(4, "little")
+        else:
+            code.append(op)
             code += idx.to_bytes(2, "little")
+
+    def compile_condition(self, condition, code: bytearray, jump_if: bool) -> list[int]:
+        """
+        compile a condition that jumps when it evaluates to jump_if and falls through
+        otherwise. int comparisons become a compare-and-branch superinstruction, a
+        leading not flips the jump instead of emitting OP_BNOT, and && and || jump as
+        soon as their left operand decides the result, without evaluating the right one.
+        :return: offsets of the jump target operands, patched by the caller
+        """
+        cond = condition
+        while cond.kind == HirNodeTag.UnOp and cond.op_tag == OpTag.Not:
+            cond = cond.expr
+            jump_if = not jump_if
+        if cond.kind == HirNodeTag.BinOp and cond.op_tag in (OpTag.AND, OpTag.OR):
+            # the value of the left operand that decides the result on its own
+            decides = cond.op_tag == OpTag.OR
+            if jump_if == decides:
+                return (self.compile_condition(cond.lhs, code, jump_if)
+                        + self.compile_condition(cond.rhs, code, jump_if))
+            skip = self.compile_condition(cond.lhs, code, decides)
+            patches = self.compile_condition(cond.rhs, code, jump_if)
+            self.patch_jumps(code, skip, len(code))
+            return patches
+        if (cond.kind == HirNodeTag.BinOp and cond.op_tag in compare_jump_opcodes
+                and self.expr_type(cond.lhs) == TypeRegistry.IntType
+                and self.expr_type(cond.rhs) == TypeRegistry.IntType and self.jump_width == 2):
+            # the superinstructions jump when the comparison is false, they have no wide form
+            op_tag = negated_compares[cond.op_tag] if jump_if else cond.op_tag
+            stack_op, local_const_op = compare_jump_opcodes[op_tag]
+            if (self.is_int_local(cond.lhs) and cond.rhs.kind == HirNodeTag.ConstInt
+                    and self.is_short_const(cond.rhs.val)):
+                code.append(local_const_op)
+                code += cond.lhs.symbol.local_offset.to_bytes(2, "little")
+                code += self.get_const_index(cond.rhs.val).to_bytes(2, "little")
+            else:
+                self.compile_expr(cond.lhs, code)
+                self.compile_expr(cond.rhs, code)
+                code.append(stack_op)
+            patch = len(code)
+            code += b"\x00\x00"
+            return [patch]
+        self.compile_expr(cond, code)
+        return [self.emit_jump(code, OP_JT if jump_if else OP_JF)]
+
+    def patch_jumps(self, code: bytearray, patches: list[int], target: int):
+        if target > SHORT_OPERAND_MAX and self.jump_width == 2:
+            # the function is laid out again with wide jumps, see generate_function_code
+            self.needs_wide = True
+            return
+        for patch in patches:
+            code[patch:patch + self.jump_width] = target.to_bytes(self.jump_width, "little")
+
+    def compile_switch_dispatch(self, switch_cases: list, code: bytearray, table_op: int, lookup_op: int,
+                                *operands: int) -> tuple[list[list[int]], list[int]]:
+        """
+        emit the jump of a switch statement on an int. dense labels get a table
+        with an entry for every value from the lowest label to the highest, sparse
+        ones a sorted list of (label, target) pairs the vm binary searches. the
+        labels are constant indices, the value comes after the given operands.
+        all operands are wide when the jumps are, or when a label does not fit.
+        :return: offsets of the jump target operands of every case, and of the default
+        """
+        cases = sorted((label.val, i) for (i, (labels, _)) in enumerate(switch_cases) for label in labels)
+        branch_patches = [[] for _ in switch_cases]
+        default_patches = []
+        if not all(self.is_short_const(value) for (value, _) in cases):
+            self.needs_wide = True
+        width = 4 if self.needs_wide else self.jump_width
+        if width == 4:
+            code.append(OP_WIDE)
+        span = cases[-1][0] - cases[0][0] + 1 if cases else 0
+        if cases and span <= min(SWITCH_TABLE_DENSITY * len(cases), 0xFFFF):
+            code.append(table_op)
+            for operand in (*operands, self.get_const_index(cases[0][0]), span):
+                code += operand.to_bytes(width, "little")
+            default_patches.append(len(code))
+            code += bytes(width)
+            branches = dict(cases)
+            for value in range(cases[0][0], cases[-1][0] + 1):
+                patches = branch_patches[branches[value]] if value in branches else default_patches
+                patches.append(len(code))
+                code += bytes(width)
+        else:
+            code.append(lookup_op)
+            for operand in (*operands, len(cases)):
+                code += operand.to_bytes(width, "little")
+            default_patches.append(len(code))
+            code += bytes(width)
+            for (value, branch) in cases:
+                code += self.get_const_index(value).to_bytes(width, "little")
+                branch_patches[branch].append(len(code))
+                code += bytes(width)
+        return branch_patches, default_patches
+
+    def compile_expr(self, expr, code: bytearray):
+        if expr.kind == HirNodeTag.ConstInt:
+            self.compile_const(OP_LIC, expr.val, code)
         elif expr.kind == HirNodeTag.ConstStr:
-            code.append(OP_LSC)
-            idx = self.get_const_index(expr.val)
-            code += idx.to_bytes(2, "little")
+            self.compile_const(OP_LSC, expr.val, code)
         elif expr.kind == HirNodeTag.ConstBool:
             code.append(OP_LBT if expr.val == True else OP_LBF)
         elif expr.kind == HirNodeTag.VarRef:
@@ -152,45 +391,34 @@ class IrModule:
         elif expr.kind == HirNodeTag.Cast:
             self.compile_expr(expr.expr, code)
             code.append(cast_table[(expr.from_type, expr.to_type)])
+        elif (expr.kind == HirNodeTag.BinOp and expr.type_id == TypeRegistry.IntType
+              and self.is_int_local(expr.lhs) and expr.rhs.kind == HirNodeTag.ConstInt
+              and expr.op_tag in local_const_arith_opcodes and self.is_short_const(expr.rhs.val)):
+            code.append(local_const_arith_opcodes[expr.op_tag])
+            code += expr.lhs.symbol.local_offset.to_bytes(2, "little")
+            code += self.get_const_index(expr.rhs.val).to_bytes(2, "little")
+        elif (expr.kind == HirNodeTag.BinOp and expr.type_id == TypeRegistry.IntType
+              and self.is_int_local(expr.lhs) and self.is_int_local(expr.rhs)
+              and expr.op_tag in local_local_arith_opcodes):
+            code.append(local_local_arith_opcodes[expr.op_tag])
+            code += expr.lhs.symbol.local_offset.to_bytes(2, "little")
+            code += expr.rhs.symbol.local_offset.to_bytes(2, "little")
+        elif expr.kind == HirNodeTag.BinOp and expr.op_tag in (OpTag.AND, OpTag.OR):
+            # the right operand only runs when the left one does not decide the result
+            decides = expr.op_tag == OpTag.OR
+            short = self.compile_condition(expr.lhs, code, decides)
+            self.compile_expr(expr.rhs, code)
+            end_patch = self.emit_jump(code, OP_JMP)
+            self.patch_jumps(code, short, len(code))
+            code.append(OP_LBT if decides else OP_LBF)
+            self.patch_jumps(code, [end_patch], len(code))
         elif expr.kind == HirNodeTag.BinOp:
             self.compile_expr(expr.lhs, code)
             self.compile_expr(expr.rhs, code)
             code.append(optag_to_opcode[expr.op_tag])
         elif expr.kind == HirNodeTag.UnOp:
-            op_map = {
-                OpTag.PreIncrement: (OP_IINC, OP_IFIELD_INC),
-                OpTag.PreDecrement: (OP_IDEC, OP_IFIELD_DEC),
-                OpTag.PostIncrement: (OP_IINC, OP_IFIELD_INC),
-                OpTag.PostDecrement: (OP_IDEC, OP_IFIELD_DEC),
-            }
-
-            if expr.op_tag in op_map:
-                var_op, field_op = op_map[expr.op_tag]
-
-                if expr.expr.kind == HirNodeTag.VarRef:
-                    offset = expr.expr.symbol.local_offset.to_bytes(2, "little")
-                    if expr.op_tag in (OpTag.PostIncrement, OpTag.PostDecrement):
-                        code.append(OP_LOAD)
-                        code += offset
-                        code.append(var_op)
-                        code += offset
-                    else:
-                        code.append(var_op)
-                        code += offset
-                        code.append(OP_LOAD)
-                        code += offset
-                else:
-                    index = expr.expr.field_index.to_bytes(2, "little")
-                    if expr.op_tag in (OpTag.PostIncrement, OpTag.PostDecrement):
-                        code.append(OP_LOAD_FIELD)
-                        code += index
-                        code.append(field_op)
-                        code += index
-                    else:
-                        code.append(field_op)
-                        code += index
-                        code.append(OP_LOAD_FIELD)
-                        code += index
+            if expr.op_tag in inc_dec_opcodes:
+                self.compile_inc_dec(expr, code, True)
             else:
                 self.compile_expr(expr.expr, code)
                 code.append(optag_to_opcode[expr.op_tag])
@@ -205,12 +433,19 @@ class IrModule:
                 self.compile_expr(arg, code)
             if expr.function_symbol.linkage == Linkage.External:
                 code.append(OP_VOID_CALL_EXTERN if is_void_call else OP_CALL_EXTERN)
-                code += self.get_const_index(f"{expr.function_symbol.lib_prefix}_{expr.function_symbol.name}").to_bytes(
-                    2,
-                    "little")
+                # operand is the index into the runtime's native function table, patched by link_externs
+                self.extern_call_patches.append(
+                    (code, len(code), expr.function_symbol.lib_prefix, expr.function_symbol.name))
+                code += b"\x00\x00"
             else:
                 code.append(OP_VOID_CALL if is_void_call else OP_CALL)
                 code += expr.function_symbol.function_id.to_bytes(2, "little")
+        elif expr.kind == HirNodeTag.InlinedCall:
+            for store in expr.stores:
+                self.compile_expr(store.value, code)
+                code.append(OP_STORE)
+                code += store.symbol.local_offset.to_bytes(2, "little")
+            self.compile_expr(expr.value, code)
         elif expr.kind == HirNodeTag.CreateStruct:
             code.append(OP_ALLOCA_STRUCT)
             code += expr.num_fields.to_bytes(2, "little")
@@ -219,11 +454,12 @@ class IrModule:
                 code.append(OP_SET_FIELD)
                 code += field.field_index.to_bytes(2, "little")
         elif expr.kind == HirNodeTag.ArrayLiteral:
-            code.append(OP_ALLOCA_ARRAY)
+            alloca_op, set_op = array_literal_opcodes[expr.repr]
+            code.append(alloca_op)
             code += len(expr.elements).to_bytes(2, "little")
             for i, ele in enumerate(expr.elements):
                 self.compile_expr(ele, code)
-                code.append(OP_ARRAY_SET)
+                code.append(set_op)
                 code += i.to_bytes(2, "little")
         elif expr.kind == HirNodeTag.FieldAccess:
             self.compile_expr(expr.obj, code)
@@ -232,134 +468,224 @@ class IrModule:
         elif expr.kind == HirNodeTag.IndexedAccess:
             self.compile_expr(expr.container, code)
             self.compile_expr(expr.index, code)
-            code.append(OP_ARRAY_GET)
+            code.append(array_access_opcodes[expr.repr][0])
         elif expr.kind == HirNodeTag.StoreIndexed:
             self.compile_expr(expr.obj.container, code)
             self.compile_expr(expr.obj.index, code)
             self.compile_expr(expr.value, code)
-            code.append(OP_ARRAY_STORE)
+            code.append(array_access_opcodes[expr.obj.repr][1])
         else:
             raise ValueError(f"Unsupported expression kind: {expr.kind}")
 
-    def generate_bytecode_from_block(self, block: HirBlock, code: bytearray):
-        for node in block.nodes:
-            if node.kind == HirNodeTag.Return:
-                if node.expr:
-                    self.compile_expr(node.expr, code)
-                code.append(OP_RET)
-
-            elif node.kind == HirNodeTag.StoreLocal:
-                self.compile_expr(node.value, code)
-                code.append(OP_STORE)
-                code += node.symbol.local_offset.to_bytes(2, "little")
-
-            elif node.kind == HirNodeTag.Log:
-                self.compile_expr(node.expr, code)
-                code.append(OP_LOG)
-
-            elif node.kind == HirNodeTag.Continue:
-                code.append(OP_JMP)
-                code += self.loop_start_indices[-1].to_bytes(2, "little")
-
-            elif node.kind == HirNodeTag.Break:
-                code.append(OP_JMP)
-                self.loop_break_patches[-1].append(len(code))
-                code += b"\x00\x00"
-
-            elif node.kind == HirNodeTag.Branch:
-                self.compile_expr(node.condition, code)
-                code.append(OP_JF)
-                jmp_patch = len(code)
-                code += b"\x00\x00"
-
-                self.generate_bytecode_from_block(node.then_block, code)
-
-                if node.else_block:
-                    code.append(OP_JMP)
-                    merge_patch = len(code)
-                    code += b"\x00\x00"
-                    code[jmp_patch:jmp_patch + 2] = len(code).to_bytes(2, "little")
-
-                    self.generate_bytecode_from_block(node.else_block, code)
-                    code[merge_patch:merge_patch + 2] = len(code).to_bytes(2, "little")
-                else:
-                    code[jmp_patch:jmp_patch + 2] = len(code).to_bytes(2, "little")
-            elif node.kind == HirNodeTag.MultiBranch:
-                merge_patches = []
-                for (condition, branch) in node.branches:
-                    self.compile_expr(condition, code)
-                    code.append(OP_JF)
-                    cond_path_index = len(code)
-                    code += b"\x00\x00"
-                    self.generate_bytecode_from_block(branch, code)
-                    code.append(OP_JMP)
-                    merge_patches.append(len(code))
-                    code += b"\x00\x00"
-                    code[cond_path_index:cond_path_index + 2] = len(code).to_bytes(2, "little")
-
-                if node.else_block:
-                    self.generate_bytecode_from_block(node.else_block, code)
-
-                for patch_idx in merge_patches:
-                    code[patch_idx:patch_idx + 2] = len(code).to_bytes(2, "little")
-
-            elif node.kind == HirNodeTag.LoopBlock:
-                self.loop_start_indices.append(len(code))
-                self.loop_break_patches.append([])
-                self.generate_bytecode_from_block(node, code)
-                code.append(OP_JMP)
-                code += self.loop_start_indices[-1].to_bytes(2, "little")
-
-                break_patches = self.loop_break_patches.pop()
-                loop_end_idx = len(code)
-                for patch_idx in break_patches:
-                    code[patch_idx:patch_idx + 2] = loop_end_idx.to_bytes(2, "little")
-
-                self.loop_start_indices.pop()
-
-            elif node.kind in (HirNodeTag.Block, HirNodeTag.FunctionBlock):
-                self.generate_bytecode_from_block(node, code)
-
+    def generate_statement(self, node, code: bytearray):
+        if node.kind == HirNodeTag.StoreLocal:
+            self.compile_expr(node.value, code)
+            code.append(OP_STORE)
+            code += node.symbol.local_offset.to_bytes(2, "little")
+        elif node.kind == HirNodeTag.Log:
+            self.compile_expr(node.expr, code)
+            code.append(OP_LOG)
+        elif node.kind == HirNodeTag.UnOp and node.op_tag in inc_dec_opcodes:
+            self.compile_inc_dec(node, code, False)
+        else:
+            self.compile_expr(node, code)
+            if self.leaves_value(node):
+                # every statement leaves the stack as it found it
+                code.append(OP_POP)
+
+    @staticmethod
+    def leaves_value(expr) -> bool:
+        """
+        whether the code of an expression statement pushes a value nothing reads
+        """
+        if expr.kind in (HirNodeTag.StoreField, HirNodeTag.StoreIndexed):
+            # stores push nothing, a field store is still typed as its field
+            return False
+        return expr.type_id != TypeRegistry.VoidType
+
+    def compile_inc_dec(self, expr, code: bytearray, value: bool):
+        """
+        update a local or a field in place, and push the value before the update for
+        the post forms or after it for the pre forms when value is set. a field's
+        object is evaluated once, both instructions that pop it get it from the
+        scratch slot.
+        """
+        var_op, field_op = inc_dec_opcodes[expr.op_tag]
+        target = expr.expr
+        if target.kind == HirNodeTag.VarRef:
+            (load_op, update_op, operand) = (OP_LOAD, var_op, target.symbol.local_offset)
+        else:
+            (load_op, update_op, operand) = (OP_LOAD_FIELD, field_op, target.field_index)
+            self.compile_expr(target.obj, code)
+        ops = [update_op]
+        if value and expr.op_tag in (OpTag.PostIncrement, OpTag.PostDecrement):
+            ops = [load_op, update_op]
+        elif value:
+            ops = [update_op, load_op]
+        for (i, op) in enumerate(ops):
+            if target.kind != HirNodeTag.VarRef and len(ops) > 1:
+                # keep the object for the second instruction, nothing else runs
+                # in between so one slot serves every field in the function
+                slot = self.get_scratch_slot()
+                code.append(OP_TEE if i == 0 else OP_LOAD)
+                code += slot.to_bytes(2, "little")
+            code.append(op)
+            code += operand.to_bytes(2, "little")
+
+    def get_scratch_slot(self) -> int:
+        if self.scratch_slot is None:
+            self.scratch_slot = self.local_count
+            self.local_count += 1
+        return self.scratch_slot
+
+    def generate_return(self, ret, code: bytearray):
+        if ret is not None and self.is_tail_call(ret):
+            for arg in ret.expr.args:
+                self.compile_expr(arg, code)
+            code.append(OP_TAIL_CALL)
+            code += ret.expr.function_symbol.function_id.to_bytes(2, "little")
+            return
+        if ret is not None and ret.expr:
+            self.compile_expr(ret.expr, code)
+            self.returns_value = True
+        code.append(OP_RET)
+
+    def generate_switch(self, term, code: bytearray) -> tuple[list[list[int]], list[int]]:
+        self.compile_expr(term.expr, code)
+        return self.compile_switch_dispatch(term.cases, code, OP_TABLESWITCH, OP_LOOKUPSWITCH)
+
+    def generate_terminator(self, term, following, code: bytearray, patches: list):
+        """
+        emit the jump that ends a block, following is the block laid out right
+        after it, which a jump or either side of a condition falls through to
+        """
+        if isinstance(term, Jump):
+            if term.target is not following:
+                patches.append((self.emit_jump(code, self.jump_op), term.target))
+        elif isinstance(term, CondJump):
+            if term.if_false is following and term.if_true is not following:
+                patches += [(patch, term.if_true) for patch in self.compile_condition(term.condition, code, True)]
             else:
-                self.compile_expr(node, code)
+                patches += [(patch, term.if_false) for patch in self.compile_condition(term.condition, code, False)]
+                self.generate_terminator(Jump(term.if_true), following, code, patches)
+        elif isinstance(term, SwitchJump):
+            branch_patches, default_patches = self.generate_switch(term, code)
+            patches += [(patch, term.default) for patch in default_patches]
+            for ((_, target), case_patches) in zip(term.cases, branch_patches):
+                patches += [(patch, target) for patch in case_patches]
+        else:
+            self.generate_return(term.node, code)
+
+    def generate_function_code(self, func: FunctionBlock) -> bytearray:
+        """
+        lay out the blocks of the function's control-flow graph in source order,
+        a jump to the block that comes next is left out. a function with a jump
+        target past 64K, or with switch labels among constants past the first
+        65536, is laid out again with wide jumps.
+        """
+        graph = ControlFlowGraph(func)
+        self.jump_width = 2
+        self.needs_wide = False
+        self.returns_value = False
+        code = self.layout_blocks(graph)
+        if self.needs_wide:
+            self.widen_jumps(func)
+            code = self.layout_blocks(graph)
+        return code
+
+    def widen_jumps(self, func: FunctionBlock):
+        # jumps, switches and the constant loads past 65535 get an OP_WIDE prefix
+        self.jump_width = 4
+
+    def layout_blocks(self, graph: ControlFlowGraph) -> bytearray:
+        code = bytearray()
+        starts = {}
+        # (jump target operand, block it jumps to)
+        patches = []
+        for (i, block) in enumerate(graph.blocks):
+            starts[block] = len(code)
+            for node in block.nodes:
+                self.generate_statement(node, code)
+            following = graph.blocks[i + 1] if i + 1 < len(graph.blocks) else None
+            self.generate_terminator(block.terminator, following, code, patches)
+        for (patch, block) in patches:
+            self.patch_jumps(code, [patch], starts[block])
+        return code
+
+    @staticmethod
+    def is_tail_call(ret) -> bool:
+        """
+        whether a return statement returns the result of a call to an internal
+        function unchanged, so the callee can take over the returning frame
+        """
+        expr = ret.expr
+        return (expr is not None and expr.kind == HirNodeTag.Call
+                and expr.function_symbol.linkage == Linkage.Internal)
 
     def add_function(self, func: FunctionBlock):
         name_idx = self.get_const_index(func.name)
         self.main_function_index = func.function_id if func.name == "main" else self.main_function_index
-        code = bytearray()
-        self.generate_bytecode_from_block(func, code)
-        self.functions.append(FunctionIR(func.function_id, name_idx, func.local_count, len(func.symbol.params), code))
+        self.local_count = func.local_count
+        self.scratch_slot = None
+        code = self.generate_function_code(func)
+        self.functions.append(FunctionIR(func.function_id, name_idx, self.local_count, len(func.symbol.params), code,
+                                         self.returns_value))
 
     def build(self, block):
+        extern_blocks = []
         for node in block.nodes:
             if node.kind == HirNodeTag.ExternLibBlock:
-                extern_block = {
-                    "name": self.get_const_index(node.name),
-                    "indices": []
-                }
-                for symbol in node.symbols:
-                    extern_block["indices"].append(
-                        self.get_const_index(f"{node.name}_{symbol}")
-                    )
-                self.extern_lib_blocks[node.name] = extern_block
+                extern_blocks.append(node)
             else:
                 self.add_function(node)
+        self.link_externs(extern_blocks)
+
+    def link_externs(self, extern_blocks):
+        """
+        lay out the native function table written to the Libraries section and patch every
+        extern call operand with its index. only functions that are actually called are listed,
+        so the runtime resolves exactly those once at load time.
+        :return:None
+        """
+        called = {(prefix, name) for (_, _, prefix, name) in self.extern_call_patches}
+        table_index = {}
+        for node in extern_blocks:
+            extern_block = {
+                "name": self.get_const_index(node.name),
+                "indices": []
+            }
+            for symbol in node.symbols:
+                if (node.name, symbol) not in called:
+                    continue
+                table_index[(node.name, symbol)] = len(table_index)
+                self.extern_param_counts.append(len(node.symbols[symbol].params))
+                extern_block["indices"].append(
+                    self.get_const_index(f"{node.name}_{symbol}")
+                )
+            if extern_block["indices"]:
+                self.extern_lib_blocks[node.name] = extern_block
+
+        for (code, offset, prefix, name) in self.extern_call_patches:
+            code[offset:offset + 2] = table_index[(prefix, name)].to_bytes(2, "little")
+        self.extern_call_patches.clear()
 
     def emit(self) -> bytes:
         result = bytearray()
 
         result += b"PEXB"
-        result += bytes(12)
+        result.append(self.code_mode)
+        result += bytes(11)
 
-        result += len(self.const_table).to_bytes(2, "little")
+        result += len(self.const_table).to_bytes(4, "little")
         for c in self.const_table:
             if isinstance(c, int):
                 result.append(0x01)
-                result += c.to_bytes(4, "little")
+                # folded expressions can produce negative constants
+                result += c.to_bytes(4, "little", signed=c < 0)
             elif isinstance(c, str):
                 result.append(0x02)
                 s_bytes = c.encode("utf-8")
-                result += len(s_bytes).to_bytes(2, "little")
+                result += len(s_bytes).to_bytes(4, "little")
                 result += s_bytes
             else:
                 raise ValueError(f"Unsupported constant type: {type(c)}")
@@ -372,9 +698,9 @@ class IrModule:
         result += len(self.extern_lib_blocks).to_bytes(2, "little")
         for key in self.extern_lib_blocks:
             block = self.extern_lib_blocks[key]
+            result += block["name"].to_bytes(4, "little")
             result += len(block["indices"]).to_bytes(2, "little")
-            result += block["name"].to_bytes(2, "little")
             for idx in block["indices"]:
-                result += idx.to_bytes(2, "little")
+                result += idx.to_bytes(4, "little")
 
         return result
@@ -0,0 +1,304 @@
+# loop-invariant code motion over the folded hir
+
+from enum import Enum
+
+from constfold import child_attrs, short_circuit_ops
+from hir import Branch, HirBlock, HirNodeTag, StoreLocal, UnOp, VarRef
+from inliner import clone_expr
+from ir import IrModule
+from pico_ast import OpTag
+from pico_types import TypeRegistry
+from symtab import Symbol, SymbolKind
+
+# expressions worth a local of their own, a VarRef or constant is already as cheap as one
+hoistable = (HirNodeTag.BinOp, HirNodeTag.UnOp, HirNodeTag.Cast, HirNodeTag.BoolCast, HirNodeTag.FieldAccess,
+             HirNodeTag.IndexedAccess)
+
+# nodes that change locals or memory, or whose value is new on every evaluation
+impure = (HirNodeTag.Call, HirNodeTag.InlinedCall, HirNodeTag.StoreLocal, HirNodeTag.StoreField,
+          HirNodeTag.StoreIndexed, HirNodeTag.CreateStruct, HirNodeTag.ArrayLiteral)
+
+# statements after which the rest of an iteration may not run, or that make a trap observable
+unsafe_stmts = (HirNodeTag.Break, HirNodeTag.Continue, HirNodeTag.Return, HirNodeTag.Log, HirNodeTag.Call,
+                HirNodeTag.InlinedCall)
+
+# attributes that are not part of what an expression computes, a field access is
+# identified by its field_index rather than its target token
+ignored_attrs = ("token", "parent", "type_id", "target")
+
+# statements a loop iteration always runs all of once it starts them
+straight_stmts = (HirNodeTag.StoreLocal, HirNodeTag.StoreField, HirNodeTag.StoreIndexed, HirNodeTag.UnOp)
+
+
+def walk(node):
+    """
+    every node below node, node included
+    """
+    if isinstance(node, (list, tuple)):
+        for child in node:
+            yield from walk(child)
+        return
+    yield node
+    for attr in child_attrs:
+        child = getattr(node, attr, None)
+        if child is not None:
+            yield from walk(child)
+
+
+def is_step(node) -> bool:
+    return node.kind == HirNodeTag.UnOp and node.op_tag != OpTag.Not
+
+
+def can_trap(expr) -> bool:
+    """
+    whether evaluating expr can stop the vm: a field load through a missing
+    object, an out of bounds index, or a division the vm cannot do
+    """
+    for node in walk(expr):
+        if node.kind in (HirNodeTag.FieldAccess, HirNodeTag.IndexedAccess):
+            return True
+        if (node.kind == HirNodeTag.BinOp and node.op_tag in (OpTag.DIV, OpTag.MOD)
+                and not (node.rhs.kind == HirNodeTag.ConstInt and node.rhs.val not in (0, -1))):
+            return True
+    return False
+
+
+def expr_key(node):
+    """
+    a hashable key, equal for two expressions that compute the same value
+    """
+    if isinstance(node, (list, tuple)):
+        return tuple(expr_key(child) for child in node)
+    key = []
+    for attr, value in sorted(vars(node).items()):
+        if attr in ignored_attrs:
+            continue
+        if attr in child_attrs and value is not None:
+            key.append((attr, expr_key(value)))
+        elif value is None or isinstance(value, (bool, int, str, Enum)):
+            key.append((attr, value))
+        else:
+            key.append((attr, id(value)))
+    return tuple(key)
+
+
+def straight_prefix(nodes) -> list:
+    """
+    the statements at the start of nodes that run one after another without
+    branching, logging, calling or leaving, nested plain blocks included
+    """
+    prefix = []
+    for node in nodes:
+        if node.kind == HirNodeTag.Block:
+            inner = straight_prefix(node.nodes)
+            prefix += inner
+            if len(inner) < len(node.nodes):
+                break
+        elif node.kind in straight_stmts and not any(child.kind in unsafe_stmts for child in walk(node)):
+            prefix.append(node)
+        else:
+            break
+    return prefix
+
+
+def exit_test(loop):
+    """
+    the condition of the `if(!cond) break;` that while and for loops start with
+    :return: the branch, None when the loop does not start with one
+    """
+    if not loop.nodes:
+        return None
+    first = loop.nodes[0]
+    if (first.kind == HirNodeTag.Branch and first.else_block is None and len(first.then_block.nodes) == 1
+            and first.then_block.nodes[0].kind == HirNodeTag.Break):
+        return first
+    return None
+
+
+class LoopEffects:
+    """
+    everything a loop writes: locals, struct fields by index, array elements, and
+    whether it calls anything, in which case any memory may change
+    """
+
+    def __init__(self, loop):
+        self.symbols = set()
+        self.fields = set()
+        self.arrays = False
+        self.calls = False
+        for node in walk(loop.nodes):
+            if node.kind == HirNodeTag.StoreLocal:
+                self.symbols.add(node.symbol)
+            elif is_step(node) and node.expr.kind == HirNodeTag.VarRef:
+                self.symbols.add(node.expr.symbol)
+            elif is_step(node):
+                self.fields.add(node.expr.field_index)
+            elif node.kind == HirNodeTag.StoreField:
+                self.fields.add(node.field_index)
+            elif node.kind == HirNodeTag.StoreIndexed:
+                self.arrays = True
+            elif node.kind == HirNodeTag.Call:
+                self.calls = True
+
+    def invariant(self, expr) -> bool:
+        for node in walk(expr):
+            if node.kind in impure or is_step(node):
+                return False
+            if node.kind == HirNodeTag.VarRef and node.symbol in self.symbols:
+                return False
+            if node.kind == HirNodeTag.FieldAccess and (self.calls or node.field_index in self.fields):
+                return False
+            if node.kind == HirNodeTag.IndexedAccess and (self.calls or self.arrays):
+                return False
+        return True
+
+
+class Licm:
+    """
+    runs after constfold. an expression inside a loop whose locals and memory the
+    loop never writes, and that has no side effects, is computed once into a new
+    local before the loop and read from there. expressions that can trap are only
+    moved when the first iteration evaluates them anyway before any log, call or
+    exit: those in the loop's exit test, and those in the straight statements
+    that follow it. the latter are guarded by the exit test, so a loop that never
+    runs never traps. outer loops are handled first, so an expression leaves
+    every loop it is invariant in.
+    """
+
+    def __init__(self, block):
+        self.block = block
+        self.function_block = None
+        # (function name, loop line, hoisted, guarded) for every loop that lost something
+        self.hoists = []
+
+    def run(self):
+        for node in self.block.nodes:
+            if node.kind == HirNodeTag.FunctionBlock:
+                self.function_block = node
+                self._visit_block(node)
+
+    def _visit_block(self, block):
+        nodes = []
+        for node in block.nodes:
+            if node.kind == HirNodeTag.LoopBlock:
+                nodes += self._hoist(node, block)
+                self._visit_block(node)
+            elif node.kind in (HirNodeTag.Block, HirNodeTag.FunctionBlock):
+                self._visit_block(node)
+            elif node.kind == HirNodeTag.Branch:
+                self._visit_block(node.then_block)
+                if node.else_block:
+                    self._visit_block(node.else_block)
+            elif node.kind in (HirNodeTag.MultiBranch, HirNodeTag.Switch):
+                for (_, branch) in node.branches:
+                    self._visit_block(branch)
+                if node.else_block:
+                    self._visit_block(node.else_block)
+            nodes.append(node)
+        block.nodes = nodes
+
+    def _hoist(self, loop, parent) -> list:
+        """
+        move the invariant expressions of loop into new locals
+        :return: the nodes computing them, to be placed before the loop
+        """
+        effects = LoopEffects(loop)
+        self.temps = {}
+        self.hoisted = []
+        self.guarded = []
+        test = exit_test(loop)
+        if test and any(node.kind in unsafe_stmts or node.kind in impure or is_step(node)
+                        for node in walk(test.condition)):
+            # a test that logs, calls or writes can neither be run again as a guard
+            # nor run after a trap that used to follow it, only the non-trapping
+            # code moves
+            straight = []
+            test = None
+        elif test:
+            # the test runs first on every iteration, the first one included
+            test.condition = self._replace(test.condition, effects, self.hoisted)
+            straight = straight_prefix(loop.nodes[1:])
+        else:
+            straight = straight_prefix(loop.nodes)
+        for node in straight:
+            self._replace_in(node, effects, self.hoisted if test is None else self.guarded)
+        for node in loop.nodes:
+            self._replace_in(node, effects, None)
+        if not self.hoisted and not self.guarded:
+            return []
+
+        stores = list(self.hoisted)
+        if self.guarded:
+            guard = HirBlock(HirNodeTag.Block, f"{loop.name}_hoist", loop.token, parent.block_tag,
+                             loop.scope_depth, parent)
+            guard.nodes = self.guarded
+            # the loop body only runs when its exit test does not break
+            condition = UnOp(test.token, OpTag.Not, clone_expr(test.condition, {}))
+            condition.type_id = TypeRegistry.BoolType
+            stores.append(Branch(loop.token, condition, guard, None, f"{loop.name}_hoist_merge"))
+        self.hoists.append((self.function_block.name, loop.token.loc.line, len(self.hoisted) + len(self.guarded),
+                            len(self.guarded)))
+        return stores
+
+    def _replace_in(self, node, effects, stores):
+        """
+        replace the invariant expressions below a statement or expression, stores
+        is where trapping ones go, None when they have to stay
+        """
+        if isinstance(node, (list, tuple)):
+            return type(node)(self._replace(child, effects, stores) for child in node)
+        if node.kind in (HirNodeTag.Block, HirNodeTag.LoopBlock):
+            for child in node.nodes:
+                self._replace_in(child, effects, stores)
+            return node
+        for attr in child_attrs:
+            child = getattr(node, attr, None)
+            if child is None:
+                continue
+            if node.kind == HirNodeTag.StoreIndexed and attr == "obj":
+                # the element written, only its container and index are reads
+                child.container = self._replace(child.container, effects, stores)
+                child.index = self._replace(child.index, effects, stores)
+            elif is_step(node) and child.kind == HirNodeTag.FieldAccess:
+                child.obj = self._replace(child.obj, effects, stores)
+            elif node.kind == HirNodeTag.BinOp and node.op_tag in short_circuit_ops and attr == "rhs":
+                # the right operand of && and || does not always run, it keeps what can trap
+                node.rhs = self._replace(child, effects, None)
+            elif isinstance(child, (list, tuple)) or child.kind in (HirNodeTag.Block, HirNodeTag.LoopBlock):
+                setattr(node, attr, self._replace_in(child, effects, stores))
+            else:
+                setattr(node, attr, self._replace(child, effects, stores))
+        return node
+
+    def _replace(self, expr, effects, stores):
+        if isinstance(expr, (list, tuple)) or expr.kind in (HirNodeTag.Block, HirNodeTag.LoopBlock):
+            return self._replace_in(expr, effects, stores)
+        if expr.kind in hoistable and not is_step(expr) and effects.invariant(expr):
+            if not can_trap(expr):
+                return self._temp(expr, self.hoisted)
+            if stores is not None:
+                return self._temp(expr, stores)
+        return self._replace_in(expr, effects, stores)
+
+    def _temp(self, expr, stores):
+        key = expr_key(expr)
+        symbol = self.temps.get(key)
+        if symbol is None:
+            fb = self.function_block
+            type_id = IrModule.expr_type(expr)
+            symbol = Symbol(f"licm.{fb.local_count}", SymbolKind.Variable, type_id, fb.scope_depth)
+            symbol.local_offset = fb.local_count
+            fb.local_count += 1
+            store = StoreLocal(symbol.name, expr.token, symbol, expr)
+            store.type_id = type_id
+            stores.append(store)
+            self.temps[key] = symbol
+        ref = VarRef(expr.token, symbol.name, symbol)
+        ref.type_id = symbol.type
+        return ref
+
+    def report(self, out):
+        total = sum(hoisted for (_, _, hoisted, _) in self.hoists)
+        out.write(f"licm: {total} expressions hoisted out of {len(self.hoists)} loops\n")
+        for (function, line, hoisted, guarded) in self.hoists:
+            out.write(f"  {function}, loop at line {line}: {hoisted} hoisted, {guarded} behind the exit test\n")
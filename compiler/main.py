@@ -1,33 +1,78 @@
+import sys
+from typing import Annotated
+
 import typer
 
 from error_printer import ErrorPrinter
 from hirgen import HirGen
 from ir import IrModule
 from parser import Parser
+from passes import MAX_OPT_LEVEL, PassManager, pass_names
 from pico_error import PicoError
+from regir import RegIrModule
 from sema import Sema
+from stackdepth import StackDepth
 
 
 # TODO: array literals
 # TODO: emit type descriptors in bytecode.
 # TODO: refactor the increment and decrement operators
-# TODO: switch statements.
 # TODO: Ternary expressions
 # TODO: introduce nil type.
 # TODO: unsigned integers,remaining signed integers(long,byte,char,byte).
-def main(filename: str):
+def main(filename: str,
+         opt_level: Annotated[int, typer.Option("-O", help=f"optimization level from 0 to {MAX_OPT_LEVEL}: -O1 folds "
+                                                          "constants, shares frame slots and runs the peephole "
+                                                          "optimizer, -O2 also inlines, replaces structs by locals "
+                                                          "and moves loop-invariant code")] = 0,
+         peephole: Annotated[bool, typer.Option(help="run the peephole optimizer over the emitted bytecode")] = False,
+         inline: Annotated[bool, typer.Option(help="inline calls to small non-recursive functions")] = False,
+         scalar_replace: Annotated[bool, typer.Option(help="keep the fields of struct literals that never leave "
+                                                           "their function in locals")] = False,
+         constfold: Annotated[bool, typer.Option(help="fold constant expressions and propagate constant "
+                                                      "variables")] = False,
+         licm: Annotated[bool, typer.Option(help="move loop-invariant expressions out of loops")] = False,
+         reuse_slots: Annotated[bool, typer.Option(help="let variables whose lifetimes do not overlap share a local "
+                                                        "slot")] = False,
+         opt_report: Annotated[bool, typer.Option(help="print what the optimizer passes removed")] = False,
+         time_passes: Annotated[bool, typer.Option(help="print how long each phase and pass took")] = False,
+         dump_after: Annotated[list[str] | None, typer.Option(help="print the program after the named pass, or "
+                                                                   "after every pass for all, may be repeated")] = None,
+         verify_stack: Annotated[bool, typer.Option(help="check that every statement of the emitted stack code "
+                                                         "leaves the operand stack balanced, for debugging the "
+                                                         "code generator")] = False,
+         dump_cfg: Annotated[bool, typer.Option(help="print the control-flow graph of every function, with its "
+                                                     "locals in ssa form")] = False,
+         register: Annotated[bool, typer.Option(help="emit the register instruction set instead of stack code, "
+                                                     "the peephole optimizer only applies to stack code")] = False):
+    unknown = [name for name in dump_after or [] if name not in pass_names and name != "all"]
     if not filename.endswith(".pic"):
         print("invalid file extension, pico source files should have .pic as extension")
+    elif not 0 <= opt_level <= MAX_OPT_LEVEL:
+        print(f"invalid optimization level {opt_level}, levels go from 0 to {MAX_OPT_LEVEL}")
+    elif unknown:
+        print(f"unknown pass {unknown[0]}, the passes are {', '.join(pass_names)}")
     else:
         with open(filename) as f:
             source = f.read()
+        enabled = [name for (name, on) in (("peephole", peephole), ("inline", inline),
+                                           ("scalar-replace", scalar_replace), ("constfold", constfold),
+                                           ("licm", licm), ("reuse-slots", reuse_slots)) if on]
+        manager = PassManager(opt_level, enabled, sys.stdout, opt_report, dump_after or [])
         try:
-            program = Parser.parse(filename, source)
-            block = HirGen(program).generate()
-            Sema(block).analyze()
-            module = IrModule()
-            module.build(block)
-            binary = module.emit()
+            program = manager.timed("parse", Parser.parse, filename, source)
+            block = manager.timed("hirgen", HirGen(program).generate)
+            manager.timed("sema", Sema(block).analyze)
+            manager.run_hir(block)
+            if dump_cfg:
+                manager.dump_hir(block, sys.stdout)
+            module = RegIrModule() if register else IrModule()
+            manager.timed("codegen", module.build, block)
+            manager.run_bytecode(module)
+            manager.timed("stack-depth", StackDepth(module, verify_stack).run)
+            binary = manager.timed("emit", module.emit)
+            if time_passes:
+                manager.report_timings(sys.stdout)
 
             # print("Global Constant Table:", module.const_table)
             # print("Binary:", list(binary))
@@ -12,7 +12,7 @@ from pico_ast import (
     Assignment, BinOp, Log, VarDecl, ExprStmt, IfStmt, LoopStmt, Continue, Break, Call, StrLiteral, ExternLibBlock,
     BoolLiteral, StaticAccess, StructDecl, StructField, StructLiteral, FieldValue, FieldAccess, Cast, WhileLoopStmt,
     UnOp, CompoundAssignment, ForLoopStmt,
-    ArrayType, ArrayLiteral, TypeDecl, IndexedAccess
+    ArrayType, ArrayLiteral, TypeDecl, IndexedAccess, SwitchStmt, SwitchCase
 )
 from pico_error import PicoSyntaxError
 from tokenizer import Tokenizer, TokenTag
@@ -219,6 +219,8 @@ class Parser:
             return self._parse_variable_decl()
         elif self._check(TokenTag.KW_IF):
             return self._parse_if_stmt()
+        elif self._check(TokenTag.KW_SWITCH):
+            return self._parse_switch_stmt()
         elif self._check(TokenTag.KW_LOOP):
             return self._parse_loop_stmt()
         elif self._check(TokenTag.KW_WHILE):
@@ -289,6 +291,43 @@ class Parser:
             else_stmt = self._parse_stmt()
         return IfStmt(main_token, condition, then_stmt, elsif_stmts=elsif_stmts, else_stmt=else_stmt)
 
+    def _parse_switch_stmt(self):
+        """
+        switch(expr){ case 1, 2: stmts case 3: stmts default: stmts }
+        a case runs its statements and leaves the switch, there is no fallthrough
+        """
+        main_token = self._expect_token(TokenTag.KW_SWITCH)
+        self._expect_token(TokenTag.LPAREN)
+        subject = self._parse_expr(0)
+        self._expect_token(TokenTag.RPAREN)
+        self._expect_token(TokenTag.LBRACE)
+        cases = []
+        default_stmt = None
+        while not self._check(TokenTag.RBRACE):
+            if self._check(TokenTag.KW_DEFAULT) and default_stmt is None:
+                default_token = self._next_token()
+                self._expect_token(TokenTag.COLON)
+                default_stmt = Block(default_token, self._parse_case_body())
+                continue
+            case_token = self._expect_token(TokenTag.KW_CASE)
+            labels = []
+            while True:
+                label = self._expect_token(TokenTag.INT_LIT)
+                labels.append(IntLiteral(int(label.value), label))
+                if not self._check(TokenTag.COMMA):
+                    break
+                self._advance()
+            self._expect_token(TokenTag.COLON)
+            cases.append(SwitchCase(case_token, labels, Block(case_token, self._parse_case_body())))
+        self._advance()
+        return SwitchStmt(main_token, subject, cases, default_stmt)
+
+    def _parse_case_body(self):
+        stmts = []
+        while not (self._check(TokenTag.KW_CASE) or self._check(TokenTag.KW_DEFAULT) or self._check(TokenTag.RBRACE)):
+            stmts.append(self._parse_stmt())
+        return stmts
+
     def _parse_continue(self):
         main = self._next_token()
         self._expect_token(TokenTag.SEMICOLON)
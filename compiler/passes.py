@@ -0,0 +1,149 @@
+# the optimizer passes, the -O level each one runs at and the order they run in
+
+import time
+
+from cfg import ControlFlowGraph
+from constfold import ConstFold
+from hir import HirNodeTag
+from inliner import Inliner
+from ir import MODE_STACK
+from licm import Licm
+from peephole import Peephole
+from scalar import ScalarReplacer
+from slots import SlotAllocator
+
+# what a pass runs on: the analyzed hir, or the module after the backend emitted it
+HIR = "hir"
+BYTECODE = "bytecode"
+
+
+def run_inliner(block):
+    inliner = Inliner(block)
+    inliner.run()
+    return inliner
+
+
+def run_scalar_replacer(block):
+    replacer = ScalarReplacer(block)
+    replacer.run()
+    return replacer
+
+
+def run_constfold(block):
+    ConstFold(block).run()
+
+
+def run_licm(block):
+    motion = Licm(block)
+    motion.run()
+    return motion
+
+
+def run_slot_allocator(block):
+    allocator = SlotAllocator(block)
+    allocator.run()
+    return allocator
+
+
+def run_peephole(module):
+    optimizer = Peephole()
+    for function in module.functions:
+        optimizer.optimize(function)
+    return optimizer
+
+
+class Pass:
+    """
+    an optimizer pass. run takes the hir block or the module, depending on stage,
+    and returns the pass object whose report --opt-report prints, None for a pass
+    without one. level is the lowest -O level that runs the pass.
+    """
+
+    def __init__(self, name: str, level: int, stage: str, run, stack_only: bool = False):
+        self.name = name
+        self.level = level
+        self.stage = stage
+        self.run = run
+        # passes that only understand the stack instruction set
+        self.stack_only = stack_only
+
+
+# in the order they run. -O1 runs the passes that only rewrite what is already
+# there, -O2 adds the ones that move code around or create new locals
+passes = [
+    Pass("inline", 2, HIR, run_inliner),
+    Pass("scalar-replace", 2, HIR, run_scalar_replacer),
+    Pass("constfold", 1, HIR, run_constfold),
+    Pass("licm", 2, HIR, run_licm),
+    Pass("reuse-slots", 1, HIR, run_slot_allocator),
+    Pass("peephole", 1, BYTECODE, run_peephole, stack_only=True),
+]
+pass_names = [p.name for p in passes]
+
+MAX_OPT_LEVEL = 2
+
+
+class PassManager:
+    """
+    runs the passes the -O level selects, plus those enabled by name, in the
+    order of passes. every pass is timed, and the program can be dumped after
+    any of them: the hir as the control-flow graph of every function, the
+    bytecode as the bytes of every function. the compiler's own phases are
+    timed through timed so the timings cover the whole compilation.
+    """
+
+    def __init__(self, level: int, enabled=(), out=None, report: bool = False, dump_after=()):
+        self.selected = [p for p in passes if p.level <= level or p.name in enabled]
+        self.out = out
+        self.report = report
+        self.dump_after = set(dump_after)
+        # (phase or pass name, seconds)
+        self.timings = []
+
+    def timed(self, name: str, run, *args):
+        start = time.perf_counter()
+        result = run(*args)
+        self.timings.append((name, time.perf_counter() - start))
+        return result
+
+    def run_hir(self, block):
+        for p in self.selected:
+            if p.stage == HIR:
+                self._run(p, block)
+
+    def run_bytecode(self, module):
+        for p in self.selected:
+            if p.stage == BYTECODE and not (p.stack_only and module.code_mode != MODE_STACK):
+                self._run(p, module)
+
+    def _run(self, p: Pass, target):
+        result = self.timed(p.name, p.run, target)
+        if self.report and result is not None:
+            result.report(self.out)
+        if p.name in self.dump_after or "all" in self.dump_after:
+            self.out.write(f"; after {p.name}\n")
+            if p.stage == HIR:
+                self.dump_hir(target, self.out)
+            else:
+                self.dump_bytecode(target, self.out)
+
+    @staticmethod
+    def dump_hir(block, out):
+        for node in block.nodes:
+            if node.kind == HirNodeTag.FunctionBlock:
+                ControlFlowGraph(node, ssa=True).dump(out)
+
+    @staticmethod
+    def dump_bytecode(module, out):
+        for function in module.functions:
+            name = module.const_table[function.name_idx]
+            out.write(f"fn {name}: {len(function.bytecode)} bytes, {function.local_count} locals\n")
+            for offset in range(0, len(function.bytecode), 16):
+                row = function.bytecode[offset:offset + 16]
+                out.write(f"  {offset:04x}  {row.hex(' ')}\n")
+
+    def report_timings(self, out):
+        total = sum(seconds for (_, seconds) in self.timings)
+        out.write(f"time: {total * 1000:.2f} ms\n")
+        for (name, seconds) in self.timings:
+            out.write(f"  {name}: {seconds * 1000:.2f} ms\n")
@@ -0,0 +1,316 @@
+# peephole optimizer over the bytecode of each function
+
+from ir import (OP_ALLOCA_ARRAY, OP_ALLOCA_BARRAY, OP_ALLOCA_IARRAY, OP_ALLOCA_STRUCT, OP_ARRAY_SET,
+                OP_BARRAY_SET, OP_BNOT, OP_CALL, OP_CALL_EXTERN, OP_IADD_LC, OP_IADD_LL, OP_IARRAY_SET,
+                OP_IBAND_LC, OP_IDEC, OP_IFIELD_DEC, OP_IFIELD_INC, OP_IINC, OP_ILOAD, OP_ISTORE, OP_ISUB_LC,
+                OP_ISUB_LL, OP_JF, OP_JF_IEQ, OP_JF_IEQ_LC, OP_JF_IGE, OP_JF_IGE_LC, OP_JF_IGT, OP_JF_IGT_LC,
+                OP_JF_ILE, OP_JF_ILE_LC, OP_JF_ILT, OP_JF_ILT_LC, OP_JF_INE, OP_JF_INE_LC, OP_JMP, OP_JT,
+                OP_LIC, OP_LOAD, OP_LOAD_FIELD, OP_LOOKUPSWITCH, OP_LSC, OP_RET, OP_SET_FIELD, OP_STORE,
+                OP_STORE_FIELD, OP_TABLESWITCH, OP_TAIL_CALL, OP_TEE, OP_VOID_CALL, OP_VOID_CALL_EXTERN,
+                OP_WIDE, FunctionIR)
+
+# number of two byte operands, opcodes not listed have none
+operand_counts = {
+    OP_LIC: 1, OP_LSC: 1, OP_STORE: 1, OP_ISTORE: 1, OP_ILOAD: 1, OP_LOAD: 1, OP_IINC: 1, OP_IDEC: 1,
+    OP_TEE: 1, OP_JF: 1, OP_JT: 1, OP_JMP: 1, OP_CALL: 1, OP_VOID_CALL: 1, OP_CALL_EXTERN: 1,
+    OP_VOID_CALL_EXTERN: 1, OP_TAIL_CALL: 1, OP_ALLOCA_STRUCT: 1, OP_SET_FIELD: 1, OP_LOAD_FIELD: 1, OP_IFIELD_INC: 1,
+    OP_IFIELD_DEC: 1, OP_STORE_FIELD: 1, OP_ALLOCA_ARRAY: 1, OP_ARRAY_SET: 1, OP_ALLOCA_IARRAY: 1,
+    OP_IARRAY_SET: 1, OP_ALLOCA_BARRAY: 1, OP_BARRAY_SET: 1,
+    OP_JF_ILT: 1, OP_JF_ILE: 1, OP_JF_IGT: 1, OP_JF_IGE: 1, OP_JF_IEQ: 1, OP_JF_INE: 1,
+    OP_JF_ILT_LC: 3, OP_JF_ILE_LC: 3, OP_JF_IGT_LC: 3, OP_JF_IGE_LC: 3, OP_JF_IEQ_LC: 3, OP_JF_INE_LC: 3,
+    OP_IADD_LC: 2, OP_ISUB_LC: 2, OP_IBAND_LC: 2, OP_IADD_LL: 2, OP_ISUB_LL: 2,
+}
+
+# conditional jump -> the jump taken in exactly the other case
+negated_jumps = {
+    OP_JF: OP_JT, OP_JT: OP_JF,
+    OP_JF_ILT: OP_JF_IGE, OP_JF_IGE: OP_JF_ILT, OP_JF_ILE: OP_JF_IGT, OP_JF_IGT: OP_JF_ILE,
+    OP_JF_IEQ: OP_JF_INE, OP_JF_INE: OP_JF_IEQ,
+    OP_JF_ILT_LC: OP_JF_IGE_LC, OP_JF_IGE_LC: OP_JF_ILT_LC, OP_JF_ILE_LC: OP_JF_IGT_LC,
+    OP_JF_IGT_LC: OP_JF_ILE_LC, OP_JF_IEQ_LC: OP_JF_INE_LC, OP_JF_INE_LC: OP_JF_IEQ_LC,
+}
+
+# the target is always the last operand of a jump
+jump_opcodes = set(negated_jumps) | {OP_JMP}
+
+# jump through a table of targets, their operand count depends on the number of cases
+switch_opcodes = {OP_TABLESWITCH, OP_LOOKUPSWITCH}
+
+# control never falls through these
+block_enders = {OP_JMP, OP_RET, OP_TAIL_CALL} | switch_opcodes
+
+# jumps on a boolean popped from the stack
+bool_jumps = {OP_JF: OP_JT, OP_JT: OP_JF}
+
+
+class Instr:
+    def __init__(self, op: int, operands: list[int] | None = None):
+        self.op = op
+        # for jumps, the target operand is kept in target instead
+        self.operands = operands or []
+        self.target = None
+        # for switches, the default target followed by the case targets
+        self.table = None
+        # prefixed by OP_WIDE, every operand is four bytes
+        self.wide = False
+
+    def size(self) -> int:
+        width = 4 if self.wide else 2
+        if self.table is not None:
+            return 1 + self.wide + width * (len(self.operands) + len(self.table))
+        return 1 + self.wide + width * operand_counts.get(self.op, 0)
+
+    def targets(self) -> list:
+        if self.table is not None:
+            return self.table
+        return [self.target] if self.target is not None else []
+
+
+class PeepholeStats:
+    def __init__(self):
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.instrs_before = 0
+        self.instrs_after = 0
+        # rewrite name -> number of times it fired
+        self.rewrites = {}
+
+    def count(self, rewrite: str):
+        self.rewrites[rewrite] = self.rewrites.get(rewrite, 0) + 1
+
+    def add(self, other: "PeepholeStats"):
+        self.bytes_before += other.bytes_before
+        self.bytes_after += other.bytes_after
+        self.instrs_before += other.instrs_before
+        self.instrs_after += other.instrs_after
+        for name, n in other.rewrites.items():
+            self.rewrites[name] = self.rewrites.get(name, 0) + n
+
+
+def read_operand(code: bytes, at: int, width: int) -> int:
+    return int.from_bytes(code[at:at + width], "little")
+
+
+def decode_switch(code: bytes, pc: int, width: int) -> tuple[list[int], list[int]]:
+    """
+    :return: the operands of the switch at pc that are not jump targets, and its targets
+    """
+    def read(i):
+        return read_operand(code, pc + 1 + width * i, width)
+
+    if code[pc] == OP_TABLESWITCH:
+        count = read(1)
+        return [read(0), count], [read(2 + i) for i in range(count + 1)]
+    count = read(0)
+    keys = [read(2 + 2 * i) for i in range(count)]
+    return [count] + keys, [read(1)] + [read(3 + 2 * i) for i in range(count)]
+
+
+def encode_switch(instr: Instr, offsets: dict) -> bytearray:
+    targets = [offsets[target] for target in instr.table]
+    if instr.op == OP_TABLESWITCH:
+        words = instr.operands + targets
+    else:
+        # count, default, then the sorted (key, target) pairs
+        words = [instr.operands[0], targets[0]]
+        for (key, target) in zip(instr.operands[1:], targets[1:]):
+            words += [key, target]
+    code = bytearray()
+    for word in words:
+        code += word.to_bytes(4 if instr.wide else 2, "little")
+    return code
+
+
+def decode(code: bytes) -> list[Instr]:
+    """
+    split a function's bytecode into instructions. jump operands are resolved to the
+    target instruction, a jump to the end of the code targets a trailing sentinel.
+    """
+    instrs = []
+    by_offset = {}
+    pc = 0
+    while pc < len(code):
+        start = pc
+        wide = code[pc] == OP_WIDE
+        pc += wide
+        op = code[pc]
+        instr = Instr(op)
+        instr.wide = wide
+        width = 4 if wide else 2
+        if op in switch_opcodes:
+            instr.operands, instr.table = decode_switch(code, pc, width)
+        for i in range(operand_counts.get(op, 0)):
+            instr.operands.append(read_operand(code, pc + 1 + width * i, width))
+        by_offset[start] = instr
+        instrs.append(instr)
+        pc = start + instr.size()
+    end = Instr(None)
+    by_offset[pc] = end
+    instrs.append(end)
+    for instr in instrs:
+        if instr.op in jump_opcodes:
+            instr.target = by_offset[instr.operands.pop()]
+        elif instr.table is not None:
+            instr.table = [by_offset[target] for target in instr.table]
+    return instrs
+
+
+def encode(instrs: list[Instr]) -> bytearray:
+    offsets = {}
+    pc = 0
+    for instr in instrs:
+        offsets[instr] = pc
+        if instr.op is not None:
+            pc += instr.size()
+    code = bytearray()
+    for instr in instrs:
+        if instr.op is None:
+            continue
+        if instr.wide:
+            code.append(OP_WIDE)
+        code.append(instr.op)
+        if instr.table is not None:
+            code += encode_switch(instr, offsets)
+            continue
+        width = 4 if instr.wide else 2
+        for operand in instr.operands:
+            code += operand.to_bytes(width, "little")
+        if instr.op in jump_opcodes:
+            code += offsets[instr.target].to_bytes(width, "little")
+    return code
+
+
+class Peephole:
+    """
+    rewrites the emitted bytecode of a function until nothing changes:
+    - STORE x; LOAD x becomes TEE x
+    - jumps to a JMP go straight to its target, switch table entries included, a
+      JMP to RET becomes RET
+    - a JMP to the next instruction is dropped
+    - BNOT; JF/JT becomes JT/JF
+    - a conditional jump over a JMP becomes the negated jump to the JMP's target
+    - code after a JMP or RET that no jump reaches is dropped
+    a pattern only applies when no jump lands in the middle of it. jumps are kept
+    as instruction references while rewriting and re-patched when encoding.
+    must run after IrModule.build, once extern call operands are linked.
+    """
+
+    def __init__(self):
+        self.stats = PeepholeStats()
+
+    def optimize(self, func: FunctionIR) -> PeepholeStats:
+        stats = PeepholeStats()
+        instrs = decode(func.bytecode)
+        stats.bytes_before = len(func.bytecode)
+        stats.instrs_before = len(instrs) - 1
+
+        while self._rewrite(instrs, stats):
+            pass
+
+        func.bytecode = encode(instrs)
+        stats.bytes_after = len(func.bytecode)
+        stats.instrs_after = len(instrs) - 1
+        self.stats.add(stats)
+        return stats
+
+    def _rewrite(self, instrs: list[Instr], stats: PeepholeStats) -> bool:
+        changed = False
+        for instr in instrs:
+            if instr.table is not None:
+                table = [self._thread(target) for target in instr.table]
+                if any(final is not target for (final, target) in zip(table, instr.table)):
+                    instr.table = table
+                    stats.count("jump threading")
+                    changed = True
+                continue
+            if instr.target is None:
+                continue
+            final = self._thread(instr.target)
+            if final is not instr.target:
+                instr.target = final
+                stats.count("jump threading")
+                changed = True
+            if instr.op == OP_JMP and instr.target.op == OP_RET:
+                instr.op = OP_RET
+                instr.target = None
+                instr.wide = False
+                stats.count("jump to return")
+                changed = True
+
+        targets = {target for instr in instrs for target in instr.targets()}
+        i = 0
+        while i < len(instrs) - 1:
+            instr, nxt = instrs[i], instrs[i + 1]
+            if instr.op == OP_JMP and instr.target is nxt:
+                self._remove(instrs, i, targets)
+                stats.count("jump to next")
+                changed = True
+                continue
+            if (instr.op == OP_STORE and nxt.op == OP_LOAD and instr.operands == nxt.operands
+                    and nxt not in targets):
+                instr.op = OP_TEE
+                self._remove(instrs, i + 1, targets)
+                stats.count("store/load to tee")
+                changed = True
+                continue
+            if instr.op == OP_BNOT and nxt.op in bool_jumps and nxt not in targets:
+                nxt.op = bool_jumps[nxt.op]
+                self._remove(instrs, i, targets)
+                stats.count("negated branch")
+                changed = True
+                continue
+            if (instr.op in negated_jumps and nxt.op == OP_JMP and instr.target is instrs[i + 2]
+                    and nxt not in targets):
+                # a conditional jump over a JMP becomes the negated jump to its target
+                instr.op = negated_jumps[instr.op]
+                instr.target = nxt.target
+                self._remove(instrs, i + 1, targets)
+                stats.count("branch over jump")
+                changed = True
+                continue
+            if instr.op in block_enders:
+                # everything up to the next jump target is unreachable
+                j = i + 1
+                while instrs[j].op is not None and instrs[j] not in targets:
+                    j += 1
+                if j > i + 1:
+                    del instrs[i + 1:j]
+                    stats.count("unreachable code")
+                    changed = True
+            i += 1
+        return changed
+
+    @staticmethod
+    def _thread(target: Instr) -> Instr:
+        seen = set()
+        while target.op == OP_JMP and target not in seen:
+            seen.add(target)
+            target = target.target
+        return target
+
+    @staticmethod
+    def _remove(instrs: list[Instr], index: int, targets: set):
+        """
+        drop an instruction, jumps that targeted it land on the one after it
+        :return:None
+        """
+        removed = instrs.pop(index)
+        if removed not in targets:
+            return
+        successor = instrs[index]
+        for instr in instrs:
+            if instr.target is removed:
+                instr.target = successor
+            if instr.table is not None:
+                instr.table = [successor if target is removed else target for target in instr.table]
+        targets.discard(removed)
+        targets.add(successor)
+
+    def report(self, out):
+        s = self.stats
+        out.write(f"peephole: {s.bytes_before} -> {s.bytes_after} bytes "
+                  f"({s.bytes_before - s.bytes_after} removed), "
+                  f"{s.instrs_before} -> {s.instrs_after} instructions "
+                  f"({s.instrs_before - s.instrs_after} removed)\n")
+        for name, n in sorted(s.rewrites.items()):
+            out.write(f"  {name}: {n}\n")
@@ -63,6 +63,8 @@ class NodeTag(str, Enum):
     IndexedAccess = "IndexedAccess"
 
     If = "If"
+    Switch = "Switch"
+    SwitchCase = "SwitchCase"
     LoopStmt = "LoopStmt"
     WhileLoopStmt = "WhileLoopStmt"
     ForLoopStmt = "ForLoopStmt"
@@ -195,6 +197,16 @@ class IfStmt(Node):
                          else_stmt=else_stmt)
 
 
+class SwitchStmt(Stmt):
+    def __init__(self, token, subject, cases, default_stmt=None):
+        super().__init__(NodeTag.Switch, token=token, subject=subject, cases=cases, default_stmt=default_stmt)
+
+
+class SwitchCase(Node):
+    def __init__(self, token, labels, body):
+        super().__init__(NodeTag.SwitchCase, token=token, labels=labels, body=body)
+
+
 class Log(Stmt):
     def __init__(self, token, expr=None):
         super().__init__(NodeTag.Log, token=token, expr=expr)
@@ -15,6 +15,13 @@ class TypeKind:
     Array = "Array"
 
 
+class ArrayRepr:
+    # runtime layout of an array object
+    Boxed = "Boxed"  # pico_value elements, at most 255
+    PackedInt = "PackedInt"  # raw int32 elements
+    PackedBool = "PackedBool"  # one byte per bool
+
+
 class TypeObject:
     def __init__(self, kind, *, ret_type=0, params=None, fields=None, id=0, elem_type=0):
         self.kind = kind
@@ -164,6 +171,14 @@ class TypeRegistry:
     def get_element_type(self, type_id):
         return self.types[type_id].elem_type
 
+    def get_array_repr(self, type_id):
+        elem_type = self.types[type_id].elem_type
+        if elem_type == TypeRegistry.IntType:
+            return ArrayRepr.PackedInt
+        if elem_type == TypeRegistry.BoolType:
+            return ArrayRepr.PackedBool
+        return ArrayRepr.Boxed
+
     def get_type(self, type_id):
         return self.types[type_id]
 
@@ -0,0 +1,499 @@
+# register-based backend: three-address code over frame slots
+
+from constfold import child_attrs
+from hir import FunctionBlock, HirNodeTag
+from ir import MODE_REGISTER, SHORT_OPERAND_MAX, FunctionIR, IrModule, negated_compares
+from pico_ast import OpTag
+from pico_error import PicoError
+from pico_types import ArrayRepr, TypeRegistry
+from symtab import Linkage
+
+# see include/opcodes.h
+OP_R_MOV = 0xB0
+OP_R_LOADK = 0xB1
+OP_R_LOADT = 0xB2
+OP_R_LOADF = 0xB3
+OP_R_INC = 0xB4
+OP_R_DEC = 0xB5
+OP_R_NOT = 0xB6
+OP_R_I2B = 0xB7
+OP_R_B2I = 0xB8
+OP_R_LOG = 0xB9
+OP_R_JMP = 0xBA
+OP_R_JF = 0xBB
+OP_R_JT = 0xBC
+OP_R_AND = 0xBD
+OP_R_OR = 0xBE
+
+OP_R_IADD = 0xC0
+OP_R_ISUB = 0xC1
+OP_R_IMUL = 0xC2
+OP_R_IDIV = 0xC3
+OP_R_IREM = 0xC4
+OP_R_IBAND = 0xC5
+OP_R_IBOR = 0xC6
+OP_R_IBXOR = 0xC7
+OP_R_ISHL = 0xC8
+OP_R_ISHR = 0xC9
+OP_R_IEQ = 0xCA
+OP_R_INE = 0xCB
+OP_R_ILT = 0xCC
+OP_R_ILE = 0xCD
+OP_R_IGT = 0xCE
+OP_R_IGE = 0xCF
+
+OP_R_IADDK = 0xD0
+OP_R_ISUBK = 0xD1
+OP_R_IMULK = 0xD2
+OP_R_IDIVK = 0xD3
+OP_R_IREMK = 0xD4
+OP_R_IBANDK = 0xD5
+OP_R_IBORK = 0xD6
+OP_R_IBXORK = 0xD7
+OP_R_ISHLK = 0xD8
+OP_R_ISHRK = 0xD9
+
+OP_R_JF_ILT = 0xDA
+OP_R_JF_ILE = 0xDB
+OP_R_JF_IGT = 0xDC
+OP_R_JF_IGE = 0xDD
+OP_R_JF_IEQ = 0xDE
+OP_R_JF_INE = 0xDF
+OP_R_JF_ILTK = 0xE0
+OP_R_JF_ILEK = 0xE1
+OP_R_JF_IGTK = 0xE2
+OP_R_JF_IGEK = 0xE3
+OP_R_JF_IEQK = 0xE4
+OP_R_JF_INEK = 0xE5
+
+OP_R_CALL = 0xE6
+OP_R_CALL_EXTERN = 0xE7
+OP_R_VOID_CALL_EXTERN = 0xE8
+OP_R_RET = 0xE9
+OP_R_RET_VOID = 0xEA
+
+OP_R_NEW_STRUCT = 0xEB
+OP_R_GET_FIELD = 0xEC
+OP_R_SET_FIELD = 0xED
+OP_R_FIELD_INC = 0xEE
+OP_R_FIELD_DEC = 0xEF
+
+OP_R_NEW_ARRAY = 0xF0
+OP_R_ARRAY_INIT = 0xF1
+OP_R_ARRAY_GET = 0xF2
+OP_R_ARRAY_SET = 0xF3
+OP_R_NEW_IARRAY = 0xF4
+OP_R_IARRAY_INIT = 0xF5
+OP_R_IARRAY_GET = 0xF6
+OP_R_IARRAY_SET = 0xF7
+OP_R_NEW_BARRAY = 0xF8
+OP_R_BARRAY_INIT = 0xF9
+OP_R_BARRAY_GET = 0xFA
+OP_R_BARRAY_SET = 0xFB
+
+OP_R_TAIL_CALL = 0xFC
+OP_R_TABLESWITCH = 0xFD
+OP_R_LOOKUPSWITCH = 0xFE
+
+# int arithmetic -> (register operands, register and constant)
+reg_arith_opcodes = {
+    OpTag.ADD: (OP_R_IADD, OP_R_IADDK),
+    OpTag.SUB: (OP_R_ISUB, OP_R_ISUBK),
+    OpTag.MUL: (OP_R_IMUL, OP_R_IMULK),
+    OpTag.DIV: (OP_R_IDIV, OP_R_IDIVK),
+    OpTag.MOD: (OP_R_IREM, OP_R_IREMK),
+    OpTag.BAND: (OP_R_IBAND, OP_R_IBANDK),
+    OpTag.BOR: (OP_R_IBOR, OP_R_IBORK),
+    OpTag.BXOR: (OP_R_IBXOR, OP_R_IBXORK),
+    OpTag.SHL: (OP_R_ISHL, OP_R_ISHLK),
+    OpTag.SHR: (OP_R_ISHR, OP_R_ISHRK),
+}
+# arithmetic whose constant operand may come first, it still gets the constant form
+commutative_ops = (OpTag.ADD, OpTag.MUL, OpTag.BAND, OpTag.BOR, OpTag.BXOR)
+reg_binop_opcodes = {
+    OpTag.EQ: OP_R_IEQ,
+    OpTag.NEQ: OP_R_INE,
+    OpTag.LT: OP_R_ILT,
+    OpTag.LTE: OP_R_ILE,
+    OpTag.GT: OP_R_IGT,
+    OpTag.GTE: OP_R_IGE,
+}
+# int comparison -> compare-and-branch (register operands, register and constant)
+# that jumps when the comparison is false
+reg_compare_jump_opcodes = {
+    OpTag.LT: (OP_R_JF_ILT, OP_R_JF_ILTK),
+    OpTag.LTE: (OP_R_JF_ILE, OP_R_JF_ILEK),
+    OpTag.GT: (OP_R_JF_IGT, OP_R_JF_IGTK),
+    OpTag.GTE: (OP_R_JF_IGE, OP_R_JF_IGEK),
+    OpTag.EQ: (OP_R_JF_IEQ, OP_R_JF_IEQK),
+    OpTag.NEQ: (OP_R_JF_INE, OP_R_JF_INEK),
+}
+# longs share the int representation in the vm, see OP_I2L
+reg_cast_table = {(3, 4): OP_R_MOV, (4, 3): OP_R_MOV, (2, 3): OP_R_B2I}
+
+# array representation chosen by sema -> (new, init element, get, set)
+reg_array_opcodes = {
+    ArrayRepr.Boxed: (OP_R_NEW_ARRAY, OP_R_ARRAY_INIT, OP_R_ARRAY_GET, OP_R_ARRAY_SET),
+    ArrayRepr.PackedInt: (OP_R_NEW_IARRAY, OP_R_IARRAY_INIT, OP_R_IARRAY_GET, OP_R_IARRAY_SET),
+    ArrayRepr.PackedBool: (OP_R_NEW_BARRAY, OP_R_BARRAY_INIT, OP_R_BARRAY_GET, OP_R_BARRAY_SET),
+}
+
+# increment/decrement -> (local, field) opcode
+reg_step_opcodes = {
+    OpTag.PreIncrement: (OP_R_INC, OP_R_FIELD_INC),
+    OpTag.PreDecrement: (OP_R_DEC, OP_R_FIELD_DEC),
+    OpTag.PostIncrement: (OP_R_INC, OP_R_FIELD_INC),
+    OpTag.PostDecrement: (OP_R_DEC, OP_R_FIELD_DEC),
+}
+post_steps = (OpTag.PostIncrement, OpTag.PostDecrement)
+
+
+def is_local_step(node) -> bool:
+    return node.kind == HirNodeTag.UnOp and node.op_tag in reg_step_opcodes and node.expr.kind == HirNodeTag.VarRef
+
+
+def writes_locals(node) -> bool:
+    """
+    whether evaluating an expression increments or decrements a local,
+    the only expressions that write a local
+    """
+    if isinstance(node, (list, tuple)):
+        return any(writes_locals(child) for child in node)
+    if is_local_step(node):
+        return True
+    return any(writes_locals(child) for attr in child_attrs
+               if (child := getattr(node, attr, None)) is not None)
+
+
+class RegIrModule(IrModule):
+    """
+    emits the register instruction set from the same hir as IrModule. every
+    frame slot is a register: the declared locals keep their local_offset and
+    the temporaries an expression needs are allocated above them, released
+    again at the end of each statement. a local is used in place, so
+    `a = b + c` is one OP_R_IADD instead of four stack instructions.
+    calls pass their arguments in consecutive registers starting at a base
+    above every live temporary, the callee's frame starts at that base and its
+    return value comes back in the base register.
+    """
+    code_mode = MODE_REGISTER
+    jump_op = OP_R_JMP
+
+    def __init__(self):
+        super().__init__()
+        # first free register and the frame size of the function being compiled
+        self.next_reg = 0
+        self.reg_count = 0
+        self.function_block = None
+
+    def alloc_reg(self) -> int:
+        reg = self.next_reg
+        self.next_reg += 1
+        self.reg_count = max(self.reg_count, self.next_reg)
+        return reg
+
+    def target(self, dst: int | None) -> int:
+        return dst if dst is not None else self.alloc_reg()
+
+    def emit_op(self, code: bytearray, op: int, *operands: int):
+        code.append(op)
+        for operand in operands:
+            if operand > SHORT_OPERAND_MAX:
+                self.too_large("more than 65536 constants or registers")
+            code += operand.to_bytes(2, "little")
+
+    def widen_jumps(self, func: FunctionBlock):
+        self.too_large("jumps past 64K of code or switch labels past the first 65536 constants")
+
+    def too_large(self, reason: str):
+        # register instructions have no wide form
+        raise PicoError(f"function {self.function_block.name} needs {reason}, which register code cannot "
+                        f"address, compile it without --register", self.function_block.token)
+
+    def compile_operands(self, exprs: list, code: bytearray) -> list[int]:
+        """
+        compile expressions evaluated left to right into registers. a local read
+        in place is copied first when a later operand increments a local, so it
+        keeps the value it had when it was evaluated.
+        """
+        regs = []
+        for i, expr in enumerate(exprs):
+            if expr.kind == HirNodeTag.VarRef and writes_locals(exprs[i + 1:]):
+                regs.append(self.compile_expr(expr, code, self.alloc_reg()))
+            else:
+                regs.append(self.compile_expr(expr, code))
+        return regs
+
+    def compile_condition(self, condition, code: bytearray, jump_if: bool) -> list[int]:
+        """
+        compile a condition that jumps when it evaluates to jump_if and falls
+        through otherwise. int comparisons become a compare-and-branch on their
+        operand registers, && and || skip their right operand like in stack code.
+        :return: offsets of the jump target operands, patched by the caller
+        """
+        mark = self.next_reg
+        cond = condition
+        while cond.kind == HirNodeTag.UnOp and cond.op_tag == OpTag.Not:
+            cond = cond.expr
+            jump_if = not jump_if
+        if cond.kind == HirNodeTag.BinOp and cond.op_tag in (OpTag.AND, OpTag.OR):
+            decides = cond.op_tag == OpTag.OR
+            if jump_if == decides:
+                return (self.compile_condition(cond.lhs, code, jump_if)
+                        + self.compile_condition(cond.rhs, code, jump_if))
+            skip = self.compile_condition(cond.lhs, code, decides)
+            patches = self.compile_condition(cond.rhs, code, jump_if)
+            self.patch_jumps(code, skip, len(code))
+            return patches
+        if (cond.kind == HirNodeTag.BinOp and cond.op_tag in reg_compare_jump_opcodes
+                and self.expr_type(cond.lhs) == TypeRegistry.IntType
+                and self.expr_type(cond.rhs) == TypeRegistry.IntType):
+            op_tag = negated_compares[cond.op_tag] if jump_if else cond.op_tag
+            reg_op, const_op = reg_compare_jump_opcodes[op_tag]
+            if cond.rhs.kind == HirNodeTag.ConstInt:
+                lhs = self.compile_expr(cond.lhs, code)
+                self.emit_op(code, const_op, lhs, self.get_const_index(cond.rhs.val))
+            else:
+                lhs, rhs = self.compile_operands([cond.lhs, cond.rhs], code)
+                self.emit_op(code, reg_op, lhs, rhs)
+        else:
+            self.emit_op(code, OP_R_JT if jump_if else OP_R_JF, self.compile_expr(cond, code))
+        self.next_reg = mark
+        patch = len(code)
+        code += b"\x00\x00"
+        return [patch]
+
+    def compile_expr(self, expr, code: bytearray, dst: int | None = None) -> int | None:
+        """
+        compile an expression into dst, or into whatever register is cheapest
+        when dst is None: a local is returned as is, anything else gets a new
+        temporary. only the last instruction writes dst, so dst may be read by
+        the expression itself.
+        :return: the register holding the value, None for void expressions
+        """
+        kind = expr.kind
+        mark = self.next_reg
+        if kind in (HirNodeTag.ConstInt, HirNodeTag.ConstStr):
+            reg = self.target(dst)
+            self.emit_op(code, OP_R_LOADK, reg, self.get_const_index(expr.val))
+            return reg
+        elif kind == HirNodeTag.ConstBool:
+            reg = self.target(dst)
+            self.emit_op(code, OP_R_LOADT if expr.val else OP_R_LOADF, reg)
+            return reg
+        elif kind == HirNodeTag.VarRef:
+            slot = expr.symbol.local_offset
+            if dst is None or dst == slot:
+                return slot
+            self.emit_op(code, OP_R_MOV, dst, slot)
+            return dst
+        elif kind in (HirNodeTag.BoolCast, HirNodeTag.Cast):
+            src = self.compile_expr(expr.expr, code)
+            op = OP_R_I2B if kind == HirNodeTag.BoolCast else reg_cast_table[(expr.from_type, expr.to_type)]
+            self.next_reg = mark
+            reg = self.target(dst)
+            self.emit_op(code, op, reg, src)
+            return reg
+        elif kind == HirNodeTag.BinOp and expr.op_tag in (OpTag.AND, OpTag.OR):
+            # each path writes reg last, after the left operand has been read
+            decides = expr.op_tag == OpTag.OR
+            reg = self.target(dst)
+            short = self.compile_condition(expr.lhs, code, decides)
+            self.compile_expr(expr.rhs, code, reg)
+            self.next_reg = max(mark, reg + 1)
+            code.append(OP_R_JMP)
+            end_patch = len(code)
+            code += b"\x00\x00"
+            self.patch_jumps(code, short, len(code))
+            self.emit_op(code, OP_R_LOADT if decides else OP_R_LOADF, reg)
+            self.patch_jumps(code, [end_patch], len(code))
+            return reg
+        elif kind == HirNodeTag.BinOp:
+            operand, const = expr.lhs, expr.rhs
+            if (const.kind != HirNodeTag.ConstInt and operand.kind == HirNodeTag.ConstInt
+                    and expr.op_tag in commutative_ops):
+                operand, const = const, operand
+            if (expr.type_id == TypeRegistry.IntType and expr.op_tag in reg_arith_opcodes
+                    and const.kind == HirNodeTag.ConstInt):
+                lhs = self.compile_expr(operand, code)
+                self.next_reg = mark
+                reg = self.target(dst)
+                self.emit_op(code, reg_arith_opcodes[expr.op_tag][1], reg, lhs, self.get_const_index(const.val))
+                return reg
+            lhs, rhs = self.compile_operands([expr.lhs, expr.rhs], code)
+            if expr.op_tag in reg_arith_opcodes:
+                op = reg_arith_opcodes[expr.op_tag][0]
+            else:
+                op = reg_binop_opcodes[expr.op_tag]
+            self.next_reg = mark
+            reg = self.target(dst)
+            self.emit_op(code, op, reg, lhs, rhs)
+            return reg
+        elif kind == HirNodeTag.UnOp:
+            if expr.op_tag not in reg_step_opcodes:
+                src = self.compile_expr(expr.expr, code)
+                self.next_reg = mark
+                reg = self.target(dst)
+                self.emit_op(code, OP_R_NOT, reg, src)
+                return reg
+            return self.compile_step(expr, code, dst)
+        elif kind == HirNodeTag.StoreField:
+            value, obj = self.compile_operands([expr.value, expr.obj], code)
+            self.emit_op(code, OP_R_SET_FIELD, obj, expr.field_index, value)
+            return None
+        elif kind == HirNodeTag.Call:
+            return self.compile_call(expr, code, dst)
+        elif kind == HirNodeTag.InlinedCall:
+            for store in expr.stores:
+                self.compile_expr(store.value, code, store.symbol.local_offset)
+                self.next_reg = mark
+            return self.compile_expr(expr.value, code, dst)
+        elif kind == HirNodeTag.CreateStruct:
+            # built in a temporary, the field values may read dst
+            reg = self.alloc_reg()
+            self.emit_op(code, OP_R_NEW_STRUCT, reg, expr.num_fields)
+            for field in expr.values:
+                self.emit_op(code, OP_R_SET_FIELD, reg, field.field_index, self.compile_expr(field.value, code))
+                self.next_reg = reg + 1
+            return self.move_to(reg, dst, code)
+        elif kind == HirNodeTag.ArrayLiteral:
+            new_op, init_op, _, _ = reg_array_opcodes[expr.repr]
+            reg = self.alloc_reg()
+            self.emit_op(code, new_op, reg, len(expr.elements))
+            for i, ele in enumerate(expr.elements):
+                self.emit_op(code, init_op, reg, i, self.compile_expr(ele, code))
+                self.next_reg = reg + 1
+            return self.move_to(reg, dst, code)
+        elif kind == HirNodeTag.FieldAccess:
+            obj = self.compile_expr(expr.obj, code)
+            self.next_reg = mark
+            reg = self.target(dst)
+            self.emit_op(code, OP_R_GET_FIELD, reg, obj, expr.field_index)
+            return reg
+        elif kind == HirNodeTag.IndexedAccess:
+            container, index = self.compile_operands([expr.container, expr.index], code)
+            self.next_reg = mark
+            reg = self.target(dst)
+            self.emit_op(code, reg_array_opcodes[expr.repr][2], reg, container, index)
+            return reg
+        elif kind == HirNodeTag.StoreIndexed:
+            container, index, value = self.compile_operands(
+                [expr.obj.container, expr.obj.index, expr.value], code)
+            self.emit_op(code, reg_array_opcodes[expr.obj.repr][3], container, index, value)
+            return None
+        else:
+            raise ValueError(f"Unsupported expression kind: {expr.kind}")
+
+    def move_to(self, reg: int, dst: int | None, code: bytearray) -> int:
+        if dst is None or dst == reg:
+            return reg
+        self.emit_op(code, OP_R_MOV, dst, reg)
+        return dst
+
+    def compile_step(self, expr, code: bytearray, dst: int | None) -> int | None:
+        """
+        increment or decrement of a local or an int field. the new value of a
+        pre step is read after the update, a post step copies the old one first.
+        """
+        local_op, field_op = reg_step_opcodes[expr.op_tag]
+        post = expr.op_tag in post_steps
+        if expr.expr.kind == HirNodeTag.VarRef:
+            slot = expr.expr.symbol.local_offset
+            if not post:
+                self.emit_op(code, local_op, slot)
+                return self.move_to(slot, dst, code)
+            reg = self.alloc_reg() if dst is None or dst == slot else dst
+            self.emit_op(code, OP_R_MOV, reg, slot)
+            self.emit_op(code, local_op, slot)
+            return self.move_to(reg, dst, code)
+        field = expr.expr
+        obj = self.compile_expr(field.obj, code)
+        reg = self.alloc_reg()
+        if post:
+            self.emit_op(code, OP_R_GET_FIELD, reg, obj, field.field_index)
+            self.emit_op(code, field_op, obj, field.field_index)
+        else:
+            self.emit_op(code, field_op, obj, field.field_index)
+            self.emit_op(code, OP_R_GET_FIELD, reg, obj, field.field_index)
+        return self.move_to(reg, dst, code)
+
+    def compile_args(self, expr, code: bytearray) -> int:
+        """
+        compile the arguments of a call into consecutive registers
+        :return: the first of them
+        """
+        base = self.next_reg
+        for i, arg in enumerate(expr.args):
+            # the temporaries of earlier arguments are dead once they are in place
+            self.next_reg = base + i
+            self.compile_expr(arg, code, self.alloc_reg())
+        return base
+
+    def compile_call(self, expr, code: bytearray, dst: int | None) -> int | None:
+        base = self.compile_args(expr, code)
+        is_void_call = expr.type_id == TypeRegistry.VoidType
+        if expr.function_symbol.linkage == Linkage.External:
+            code.append(OP_R_VOID_CALL_EXTERN if is_void_call else OP_R_CALL_EXTERN)
+            # operand is the index into the runtime's native function table, patched by link_externs
+            self.extern_call_patches.append(
+                (code, len(code), expr.function_symbol.lib_prefix, expr.function_symbol.name))
+            code += b"\x00\x00"
+            code += base.to_bytes(2, "little")
+        else:
+            self.emit_op(code, OP_R_CALL, expr.function_symbol.function_id, base)
+        self.next_reg = base
+        if is_void_call:
+            return None
+        # the result comes back in the base register
+        return self.move_to(self.alloc_reg(), dst, code)
+
+    def compile_stmt_expr(self, node, code: bytearray):
+        # a step whose value is unused needs no copy of the old value
+        if node.kind == HirNodeTag.UnOp and node.op_tag in reg_step_opcodes:
+            local_op, field_op = reg_step_opcodes[node.op_tag]
+            if node.expr.kind == HirNodeTag.VarRef:
+                self.emit_op(code, local_op, node.expr.symbol.local_offset)
+            else:
+                obj = self.compile_expr(node.expr.obj, code)
+                self.emit_op(code, field_op, obj, node.expr.field_index)
+            return
+        self.compile_expr(node, code)
+
+    def generate_statement(self, node, code: bytearray):
+        mark = self.next_reg
+        if node.kind == HirNodeTag.StoreLocal:
+            self.compile_expr(node.value, code, node.symbol.local_offset)
+        elif node.kind == HirNodeTag.Log:
+            self.emit_op(code, OP_R_LOG, self.compile_expr(node.expr, code))
+        else:
+            self.compile_stmt_expr(node, code)
+        # temporaries never outlive their statement
+        self.next_reg = mark
+
+    def generate_return(self, ret, code: bytearray):
+        mark = self.next_reg
+        if ret is not None and self.is_tail_call(ret):
+            base = self.compile_args(ret.expr, code)
+            self.emit_op(code, OP_R_TAIL_CALL, ret.expr.function_symbol.function_id, base)
+        elif ret is not None and ret.expr:
+            self.emit_op(code, OP_R_RET, self.compile_expr(ret.expr, code))
+        else:
+            code.append(OP_R_RET_VOID)
+        self.next_reg = mark
+
+    def generate_switch(self, term, code: bytearray) -> tuple[list[list[int]], list[int]]:
+        mark = self.next_reg
+        value = self.compile_expr(term.expr, code)
+        patches = self.compile_switch_dispatch(term.cases, code, OP_R_TABLESWITCH, OP_R_LOOKUPSWITCH, value)
+        self.next_reg = mark
+        return patches
+
+    def add_function(self, func: FunctionBlock):
+        name_idx = self.get_const_index(func.name)
+        self.main_function_index = func.function_id if func.name == "main" else self.main_function_index
+        self.function_block = func
+        self.next_reg = func.local_count
+        self.reg_count = func.local_count
+        code = self.generate_function_code(func)
+        # the frame holds the locals and the most temporaries any statement needed
+        self.functions.append(FunctionIR(func.function_id, name_idx, self.reg_count, len(func.symbol.params), code))
@@ -0,0 +1,162 @@
+# scalar replacement of struct literals that never escape their function
+
+from constfold import child_attrs
+from hir import HirNodeTag, StoreLocal, VarRef
+from licm import walk
+from pico_types import TypeKind, TypeRegistry
+from symtab import Symbol, SymbolKind
+
+# nodes whose nodes are statements
+statement_blocks = (HirNodeTag.Block, HirNodeTag.FunctionBlock, HirNodeTag.LoopBlock)
+
+
+def struct_literal(value):
+    """
+    the struct literal a local is assigned, also when it is what an inlined call returns
+    :return: the CreateStruct, None for any other value
+    """
+    while value.kind == HirNodeTag.InlinedCall:
+        value = value.value
+    return value if value.kind == HirNodeTag.CreateStruct else None
+
+
+class ScalarReplacer:
+    """
+    runs between sema and constfold. a local that is only ever assigned one struct
+    literal that sets every field, either directly or as the result of an inlined
+    call, and that is only used to read or assign its fields never lets the struct
+    escape the function: it is not passed to a call, returned, logged, compared, or
+    stored into a local, object or array. such a struct is not allocated at all.
+    every field gets a local of its own, the first one the struct's own slot, and
+    field reads and writes become reads and writes of those locals. constfold then
+    propagates the fields that are never written again. a struct that is a field of
+    a replaced struct becomes a local itself, so the pass repeats until no
+    candidates are left.
+    """
+
+    def __init__(self, block):
+        self.block = block
+        self.type_registry = TypeRegistry.get_instance()
+        self.function_block = None
+        # struct symbol -> {field_index: field symbol} for the current round
+        self.replaced = {}
+        # (function name, variable, line, reason), reason is None for a replaced struct
+        self.decisions = []
+        # the struct locals with a decision, a kept one is not reported again next round
+        self.decided = set()
+
+    def run(self):
+        for node in self.block.nodes:
+            if node.kind == HirNodeTag.FunctionBlock:
+                self.function_block = node
+                while self._find_candidates(node):
+                    self._rewrite(node)
+
+    def _find_candidates(self, func) -> bool:
+        # struct local -> every StoreLocal writing it
+        stores = {}
+        # the VarRefs that only reach a field, as the object of a field load or of a
+        # field assignment statement
+        field_refs = set()
+        for node in walk(func):
+            if node.kind in statement_blocks:
+                for stmt in node.nodes:
+                    if stmt.kind == HirNodeTag.StoreField and stmt.obj.kind == HirNodeTag.VarRef:
+                        field_refs.add(id(stmt.obj))
+            elif node.kind == HirNodeTag.FieldAccess and node.obj.kind == HirNodeTag.VarRef:
+                field_refs.add(id(node.obj))
+            elif node.kind == HirNodeTag.StoreLocal and self._is_struct(node.symbol):
+                stores.setdefault(node.symbol, []).append(node)
+        escaped = set(node.symbol for node in walk(func)
+                      if node.kind == HirNodeTag.VarRef and id(node) not in field_refs)
+
+        self.replaced = {}
+        for symbol, writes in stores.items():
+            literal = struct_literal(writes[0].value)
+            if literal is None or symbol in self.decided:
+                continue
+            if symbol in escaped:
+                reason = "escapes"
+            elif len(writes) > 1:
+                reason = "assigned more than once"
+            elif sorted(field.field_index for field in literal.values) != list(range(literal.num_fields)):
+                reason = "not every field set"
+            else:
+                reason = None
+                self.replaced[symbol] = self._field_symbols(symbol, literal)
+            self.decided.add(symbol)
+            self.decisions.append((func.name, symbol.name, writes[0].token.loc.line, reason))
+        return bool(self.replaced)
+
+    def _is_struct(self, symbol) -> bool:
+        return (symbol.kind == SymbolKind.Variable
+                and self.type_registry.get_type(symbol.type).kind == TypeKind.Struct)
+
+    def _field_symbols(self, symbol, literal) -> dict:
+        fb = self.function_block
+        types = {field.field_index: field.type for field in self.type_registry.get_fields(symbol.type)}
+        fields = {}
+        for field in sorted(literal.values, key=lambda field: field.field_index):
+            field_symbol = Symbol(f"{symbol.name}.{field.name.value}", SymbolKind.Variable,
+                                  types[field.field_index], symbol.scope_depth)
+            if fields:
+                field_symbol.local_offset = fb.local_count
+                fb.local_count += 1
+            else:
+                field_symbol.local_offset = symbol.local_offset
+            fields[field.field_index] = field_symbol
+        return fields
+
+    def _rewrite(self, node):
+        """
+        rewrite the uses of the replaced structs below node, children first
+        :return: the node that replaces node, a list of stores for a struct literal
+        """
+        if isinstance(node, list):
+            nodes = []
+            for child in node:
+                child = self._rewrite(child)
+                nodes += child if isinstance(child, list) else [child]
+            return nodes
+        if isinstance(node, tuple):
+            return tuple(self._rewrite(child) for child in node)
+        for attr in child_attrs:
+            child = getattr(node, attr, None)
+            if child is not None:
+                setattr(node, attr, self._rewrite(child))
+
+        if node.kind == HirNodeTag.StoreLocal and node.symbol in self.replaced:
+            fields = self.replaced[node.symbol]
+            # an inlined call's arguments are stored first, the field values keep
+            # their order in the literal
+            stores = []
+            value = node.value
+            while value.kind == HirNodeTag.InlinedCall:
+                stores += value.stores
+                value = value.value
+            return stores + [self._store(node.token, fields[field.field_index], field.value)
+                             for field in value.values]
+        if node.kind == HirNodeTag.StoreField and self._replaced_ref(node.obj):
+            return self._store(node.token, self.replaced[node.obj.symbol][node.field_index], node.value)
+        if node.kind == HirNodeTag.FieldAccess and self._replaced_ref(node.obj):
+            field_symbol = self.replaced[node.obj.symbol][node.field_index]
+            ref = VarRef(node.token, field_symbol.name, field_symbol)
+            ref.type_id = node.type_id
+            return ref
+        return node
+
+    def _replaced_ref(self, obj) -> bool:
+        return obj.kind == HirNodeTag.VarRef and obj.symbol in self.replaced
+
+    @staticmethod
+    def _store(token, symbol, value):
+        store = StoreLocal(symbol.name, token, symbol, value)
+        store.type_id = symbol.type
+        return store
+
+    def report(self, out):
+        replaced = sum(1 for decision in self.decisions if decision[3] is None)
+        out.write(f"scalar: {replaced} of {len(self.decisions)} struct literals replaced by locals\n")
+        for (function, variable, line, reason) in self.decisions:
+            status = "replaced" if reason is None else f"kept, {reason}"
+            out.write(f"  {variable} in {function} at line {line}: {status}\n")
@@ -3,7 +3,7 @@
 from hir import Cast, HirNodeTag, BoolCast
 from pico_ast import OpTag, NodeTag, NamedType
 from pico_error import PicoError
-from pico_types import TypeRegistry, TypeKind
+from pico_types import TypeRegistry, TypeKind, ArrayRepr
 from symtab import Symbol, SymbolKind
 
 
@@ -44,6 +44,8 @@ class Sema:
             self._analyze_branch(node)
         elif kind == HirNodeTag.MultiBranch:
             self._analyze_multibranch(node)
+        elif kind == HirNodeTag.Switch:
+            self._analyze_switch(node)
         elif kind == HirNodeTag.StoreLocal:
             self._analyze_storelocal(node)
         elif kind == HirNodeTag.Break or kind == HirNodeTag.Continue:
@@ -68,6 +70,21 @@ class Sema:
             self._analyze_stmt(node.else_block)
         node.branches = new_branches
 
+    def _analyze_switch(self, node):
+        if self._analyze_expr(node.expr) != TypeRegistry.IntType:
+            raise PicoError(
+                f"switch value should be of type {self.type_registry.get_type(TypeRegistry.IntType).kind}",
+                node.expr.token)
+        seen = set()
+        for (labels, block) in node.branches:
+            for label in labels:
+                if label.val in seen:
+                    raise PicoError(f"duplicate case {label.val}", label.token)
+                seen.add(label.val)
+            self._analyze_stmt(block)
+        if node.else_block:
+            self._analyze_stmt(node.else_block)
+
     def _analyze_branch(self, node):
         cond_type = self._analyze_expr(node.condition)
         if cond_type not in [TypeRegistry.BoolType, TypeRegistry.IntType, TypeRegistry.LongType]:
@@ -221,6 +238,11 @@ class Sema:
 
             node.element_type = first_type
             array_type = self.type_registry.add_array_type(first_type)
+            node.repr = self.type_registry.get_array_repr(array_type)
+            max_len = 0xFF if node.repr == ArrayRepr.Boxed else 0xFFFF
+            if len(node.elements) > max_len:
+                raise PicoError(f"array literal has {len(node.elements)} elements, at most {max_len} are supported",
+                                node.token)
             return array_type
         elif kind == HirNodeTag.IndexedAccess:
             container_type = self._analyze_expr(node.container)
@@ -229,6 +251,7 @@ class Sema:
                 raise PicoError(f"index must be of integer type got {self.type_registry.get_type(index_type).kind}",
                                 node.token)
             node.type_id = self.type_registry.get_element_type(container_type)
+            node.repr = self.type_registry.get_array_repr(container_type)
             return node.type_id
         elif kind == HirNodeTag.StoreIndexed:
             container_type = self._analyze_expr(node.obj)
@@ -0,0 +1,119 @@
+# local slot reuse from variable lifetimes
+
+import heapq
+
+from hir import HirNodeTag
+from licm import walk
+from symtab import SymbolKind
+
+# statements that hold other statements rather than being evaluated as a whole
+block_kinds = (HirNodeTag.Block, HirNodeTag.FunctionBlock, HirNodeTag.LoopBlock)
+
+
+class SlotAllocator:
+    """
+    runs last, after every pass that adds locals. each statement gets a position
+    in source order and a variable lives from the first statement that mentions
+    it to the last one. a variable that is declared before a loop and used inside
+    it lives until the end of the loop, since the next iteration may read it
+    again. variables declared inside a loop start over with their `let` on every
+    iteration and need no such extension. variables whose lifetimes do not
+    overlap share a slot, so a function's local_count drops to the most variables
+    alive at any one statement. parameters keep their slots, the caller puts the
+    arguments there.
+
+    everything a statement mentions is alive for the whole statement, the
+    register backend reads a local operand where it is used rather than when it
+    is evaluated, so a variable whose last use is a statement never hands its
+    slot to a variable that statement declares.
+    """
+
+    def __init__(self, block):
+        self.block = block
+        # (function name, local_count before, local_count after)
+        self.functions = []
+
+    def run(self):
+        for node in self.block.nodes:
+            if node.kind == HirNodeTag.FunctionBlock:
+                self._allocate(node)
+
+    def _allocate(self, func):
+        self.position = 0
+        # symbol -> [first position, last position]
+        self.lifetimes = {}
+        # symbols mentioned by each loop that is being walked
+        self.open_loops = []
+        self._visit(func)
+
+        param_count = len(func.symbol.params)
+        # (end of lifetime, slot) of the variables holding a slot
+        taken = []
+        free = []
+        slot_count = param_count
+        for symbol, (start, end) in sorted(self.lifetimes.items(),
+                                           key=lambda item: (item[1][0], item[0].local_offset)):
+            while taken and taken[0][0] < start:
+                heapq.heappush(free, heapq.heappop(taken)[1])
+            if free:
+                slot = heapq.heappop(free)
+            else:
+                slot = slot_count
+                slot_count += 1
+            symbol.local_offset = slot
+            heapq.heappush(taken, (end, slot))
+        self.functions.append((func.name, func.local_count, slot_count))
+        func.local_count = slot_count
+
+    def _visit(self, node):
+        if node.kind in block_kinds:
+            if node.kind == HirNodeTag.LoopBlock:
+                self.open_loops.append((self.position + 1, set()))
+            for child in node.nodes:
+                self._visit(child)
+            if node.kind == HirNodeTag.LoopBlock:
+                start, mentioned = self.open_loops.pop()
+                for symbol in mentioned:
+                    lifetime = self.lifetimes[symbol]
+                    if lifetime[0] < start:
+                        lifetime[1] = max(lifetime[1], self.position)
+        elif node.kind == HirNodeTag.Branch:
+            self._statement(node.condition)
+            self._visit(node.then_block)
+            if node.else_block:
+                self._visit(node.else_block)
+        elif node.kind == HirNodeTag.MultiBranch:
+            for (condition, branch) in node.branches:
+                self._statement(condition)
+                self._visit(branch)
+            if node.else_block:
+                self._visit(node.else_block)
+        elif node.kind == HirNodeTag.Switch:
+            self._statement(node.expr)
+            for (_, branch) in node.branches:
+                self._visit(branch)
+            if node.else_block:
+                self._visit(node.else_block)
+        else:
+            self._statement(node)
+
+    def _statement(self, node):
+        self.position += 1
+        for child in walk(node):
+            if child.kind not in (HirNodeTag.VarRef, HirNodeTag.StoreLocal):
+                continue
+            symbol = child.symbol
+            if symbol.kind != SymbolKind.Variable:
+                continue
+            lifetime = self.lifetimes.setdefault(symbol, [self.position, self.position])
+            lifetime[1] = self.position
+            for (_, mentioned) in self.open_loops:
+                mentioned.add(symbol)
+
+    def report(self, out):
+        before = sum(count for (_, count, _) in self.functions)
+        after = sum(count for (_, _, count) in self.functions)
+        out.write(f"slots: {before} locals packed into {after} slots\n")
+        for (function, count, slots) in self.functions:
+            if slots < count:
+                out.write(f"  {function}: {count} -> {slots}\n")
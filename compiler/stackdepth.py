@@ -0,0 +1,129 @@
+# maximum operand stack depth of every function, recorded in its Function record
+
+from ir import (OP_ALLOCA_ARRAY, OP_ALLOCA_BARRAY, OP_ALLOCA_IARRAY, OP_ALLOCA_STRUCT, OP_ARRAY_GET, OP_ARRAY_SET,
+                OP_ARRAY_STORE, OP_B2I, OP_B2L, OP_BARRAY_GET, OP_BARRAY_SET, OP_BARRAY_STORE, OP_BNOT, OP_CALL,
+                OP_CALL_EXTERN, OP_I2B, OP_I2L, OP_IADD, OP_IADD_LC, OP_IADD_LL, OP_IAND, OP_IARRAY_GET,
+                OP_IARRAY_SET, OP_IARRAY_STORE, OP_IBAND, OP_IBAND_LC, OP_IBOR, OP_IBXOR, OP_IDEC, OP_IDIV, OP_IEQ,
+                OP_IFIELD_DEC, OP_IFIELD_INC, OP_IGE, OP_IGT, OP_IINC, OP_ILE, OP_ILOAD, OP_ILT, OP_IMUL, OP_INE,
+                OP_IOR, OP_IREM, OP_ISHL, OP_ISHR, OP_ISTORE, OP_ISUB, OP_ISUB_LC, OP_ISUB_LL, OP_JF, OP_JF_IEQ,
+                OP_JF_IEQ_LC, OP_JF_IGE, OP_JF_IGE_LC, OP_JF_IGT, OP_JF_IGT_LC, OP_JF_ILE, OP_JF_ILE_LC, OP_JF_ILT,
+                OP_JF_ILT_LC, OP_JF_INE, OP_JF_INE_LC, OP_JMP, OP_JT, OP_L2B, OP_L2I, OP_LBF, OP_LBT, OP_LIC,
+                OP_LOAD, OP_LOAD_FIELD, OP_LOG, OP_LOOKUPSWITCH, OP_LSC, OP_POP, OP_RET, OP_SET_FIELD, OP_STORE,
+                OP_STORE_FIELD, OP_TABLESWITCH, OP_TAIL_CALL, OP_TEE, OP_VOID_CALL, OP_VOID_CALL_EXTERN, MODE_STACK)
+from peephole import block_enders, decode
+
+# opcode -> (values popped, values pushed). calls pop their arguments, which
+# depends on the callee, see StackDepth.effect
+stack_effects = {
+    OP_LIC: (0, 1), OP_LSC: (0, 1), OP_LBT: (0, 1), OP_LBF: (0, 1), OP_LOAD: (0, 1), OP_ILOAD: (0, 1),
+    OP_STORE: (1, 0), OP_ISTORE: (1, 0), OP_TEE: (1, 1), OP_POP: (1, 0), OP_IINC: (0, 0), OP_IDEC: (0, 0),
+    OP_IADD: (2, 1), OP_ISUB: (2, 1), OP_IMUL: (2, 1), OP_IDIV: (2, 1), OP_IREM: (2, 1), OP_IAND: (2, 1),
+    OP_IOR: (2, 1), OP_IBAND: (2, 1), OP_IBOR: (2, 1), OP_IBXOR: (2, 1), OP_ISHL: (2, 1), OP_ISHR: (2, 1),
+    OP_IEQ: (2, 1), OP_INE: (2, 1), OP_ILT: (2, 1), OP_ILE: (2, 1), OP_IGT: (2, 1), OP_IGE: (2, 1),
+    OP_BNOT: (1, 1), OP_B2I: (1, 1), OP_B2L: (1, 1), OP_L2B: (1, 1), OP_L2I: (1, 1), OP_I2L: (1, 1),
+    OP_I2B: (1, 1),
+    OP_JF: (1, 0), OP_JT: (1, 0), OP_JMP: (0, 0), OP_TABLESWITCH: (1, 0), OP_LOOKUPSWITCH: (1, 0),
+    OP_RET: (0, 0),
+    OP_ALLOCA_STRUCT: (0, 1), OP_SET_FIELD: (2, 1), OP_LOAD_FIELD: (1, 1), OP_IFIELD_INC: (1, 0),
+    OP_IFIELD_DEC: (1, 0), OP_STORE_FIELD: (2, 0),
+    OP_ALLOCA_ARRAY: (0, 1), OP_ARRAY_SET: (2, 1), OP_ARRAY_GET: (2, 1), OP_ARRAY_STORE: (3, 0),
+    OP_ALLOCA_IARRAY: (0, 1), OP_IARRAY_SET: (2, 1), OP_IARRAY_GET: (2, 1), OP_IARRAY_STORE: (3, 0),
+    OP_ALLOCA_BARRAY: (0, 1), OP_BARRAY_SET: (2, 1), OP_BARRAY_GET: (2, 1), OP_BARRAY_STORE: (3, 0),
+    OP_LOG: (1, 0),
+    OP_JF_ILT: (2, 0), OP_JF_ILE: (2, 0), OP_JF_IGT: (2, 0), OP_JF_IGE: (2, 0), OP_JF_IEQ: (2, 0),
+    OP_JF_INE: (2, 0),
+    OP_JF_ILT_LC: (0, 0), OP_JF_ILE_LC: (0, 0), OP_JF_IGT_LC: (0, 0), OP_JF_IGE_LC: (0, 0),
+    OP_JF_IEQ_LC: (0, 0), OP_JF_INE_LC: (0, 0),
+    OP_IADD_LC: (0, 1), OP_ISUB_LC: (0, 1), OP_IBAND_LC: (0, 1), OP_IADD_LL: (0, 1), OP_ISUB_LL: (0, 1),
+}
+
+# call opcode -> values pushed, the arguments popped are the callee's parameters
+internal_calls = {OP_CALL: 1, OP_VOID_CALL: 0, OP_TAIL_CALL: 0}
+extern_calls = {OP_CALL_EXTERN: 1, OP_VOID_CALL_EXTERN: 0}
+
+
+class StackDepth:
+    """
+    walks every path through the final bytecode of each function, after the
+    peephole pass, and records the most values its operand stack ever holds in
+    FunctionIR.max_stack. the vm reserves that much above the locals with a
+    single check when it enters the function, so pushes never check for
+    overflow. a callee's frame starts at its arguments, so the caller's depth
+    covers them and the callee's own check covers the rest.
+
+    register code keeps every value in a frame slot and records 0.
+
+    with verify, the walk also checks what the code generator promises: every
+    statement leaves the stack as it found it, so each instruction is reached
+    with the same depth on every path, a RET finds only the return value and a
+    tail call only its arguments. a violation is a bug in the code generator
+    and raises ValueError.
+    """
+
+    def __init__(self, module, verify: bool = False):
+        self.module = module
+        self.verify = verify
+        self.param_counts = {f.function_id: f.param_count for f in module.functions}
+
+    def run(self):
+        if self.module.code_mode != MODE_STACK:
+            return
+        for function in self.module.functions:
+            function.max_stack = self.max_depth(function)
+
+    def effect(self, instr) -> tuple[int, int]:
+        if instr.op in internal_calls:
+            return self.param_counts[instr.operands[0]], internal_calls[instr.op]
+        if instr.op in extern_calls:
+            return self.module.extern_param_counts[instr.operands[0]], extern_calls[instr.op]
+        return stack_effects[instr.op]
+
+    def max_depth(self, function) -> int:
+        instrs = decode(function.bytecode)
+        index = {instr: i for (i, instr) in enumerate(instrs)}
+        # depth on entry to each instruction reached so far
+        depths = {0: 0}
+        work = [0]
+        deepest = 0
+        while work:
+            i = work.pop()
+            instr = instrs[i]
+            if instr.op is None:
+                continue
+            (pops, pushes) = self.effect(instr)
+            depth = depths[i]
+            if depth < pops:
+                raise ValueError(f"{self.name(function)}: instruction {i} pops {pops} values "
+                                 f"from a stack of {depth}")
+            depth += pushes - pops
+            deepest = max(deepest, depth)
+            if self.verify:
+                self.check_exit(function, i, instr, depth)
+            successors = [index[target] for target in instr.targets()]
+            if instr.op not in block_enders:
+                successors.append(i + 1)
+            for successor in successors:
+                if successor not in depths:
+                    depths[successor] = depth
+                    work.append(successor)
+                elif self.verify and depths[successor] != depth:
+                    raise ValueError(f"{self.name(function)}: instruction {successor} is reached with "
+                                     f"{depths[successor]} and with {depth} values on the stack")
+        return deepest
+
+    def check_exit(self, function, i: int, instr, depth: int):
+        """
+        :param depth: values left after instr, the return value is still counted for a RET
+        """
+        if instr.op == OP_RET:
+            expected = 1 if function.returns_value else 0
+        elif instr.op == OP_TAIL_CALL:
+            expected = 0
+        else:
+            return
+        if depth != expected:
+            raise ValueError(f"{self.name(function)}: instruction {i} leaves the function with {depth} "
+                             f"values on the stack instead of {expected}")
+
+    def name(self, function) -> str:
+        return self.module.const_table[function.name_idx]
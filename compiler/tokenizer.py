@@ -80,6 +80,9 @@ class TokenTag(str, Enum):
     KW_AS = "KW_AS"
     KW_FOR = "KW_FOR"
     KW_TYPE = "KW_TYPE"
+    KW_SWITCH = "KW_SWITCH"
+    KW_CASE = "KW_CASE"
+    KW_DEFAULT = "KW_DEFAULT"
 
 
 @dataclass
@@ -121,6 +124,9 @@ class Tokenizer:
         "as": TokenTag.KW_AS,
         "for": TokenTag.KW_FOR,
         "type": TokenTag.KW_TYPE,
+        "switch": TokenTag.KW_SWITCH,
+        "case": TokenTag.KW_CASE,
+        "default": TokenTag.KW_DEFAULT,
     }
 
     def __init__(self, source: str, filename: str):
@@ -248,7 +254,8 @@ class Tokenizer:
             case "-":
                 self._advance()
                 if self._current().isdigit():
-                    start = self.pos
+                    # the literal keeps its sign
+                    start = self.pos - 1
                     self._advance()
                     while self._current().isdigit():
                         self._advance()
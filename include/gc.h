@@ -2,8 +2,62 @@
 
 #include <stddef.h>
 #include <stdint.h>
+#include <stdio.h>
 
 typedef struct pico_env pico_env;
+struct pico_object;
+
+// default heap settings, see pico_gc_config_default.
+#ifndef PICO_GC_INITIAL_SIZE
+#define PICO_GC_INITIAL_SIZE (1024 * 1024)
+#endif
+
+// size of each nursery half, 0 disables the young generation and every object
+// is allocated in the old semi-spaces.
+#ifndef PICO_GC_NURSERY_SIZE
+#define PICO_GC_NURSERY_SIZE (256 * 1024)
+#endif
+
+// number of minor collections an object has to survive before it is promoted
+#ifndef PICO_GC_TENURE_AGE
+#define PICO_GC_TENURE_AGE 2
+#endif
+
+// a collection that leaves the old space fuller than this grows the heap,
+// one that leaves it emptier than the shrink ratio counts as idle.
+#define PICO_GC_GROW_RATIO 0.5
+#define PICO_GC_SHRINK_RATIO 0.125
+
+typedef struct pico_gc_config {
+    // bytes per old semi-space
+    size_t initial_size;
+    // upper bound for the old semi-spaces, 0 means unbounded
+    size_t max_size;
+    size_t nursery_size;
+    double growth_factor;
+    // idle major collections before the heap shrinks, 0 never shrinks
+    uint32_t shrink_after;
+} pico_gc_config;
+
+typedef struct pico_gc_collection_stats {
+    uint64_t count;
+    // bytes of live objects copied by the collections
+    uint64_t bytes_copied;
+    uint64_t pause_total_ns;
+    uint64_t pause_max_ns;
+} pico_gc_collection_stats;
+
+typedef struct pico_gc_stats {
+    uint64_t allocations;
+    uint64_t bytes_allocated;
+    pico_gc_collection_stats minor;
+    pico_gc_collection_stats major;
+    // part of minor.bytes_copied that went to the old generation
+    uint64_t bytes_promoted;
+    uint64_t heap_grows;
+    uint64_t heap_shrinks;
+    size_t peak_heap_size;
+} pico_gc_stats;
 
 typedef struct gc_semi_space {
     size_t size;
@@ -13,16 +67,45 @@ typedef struct gc_semi_space {
 } gc_semi_space;
 
 typedef struct pico_gc {
+    // old generation
     gc_semi_space from_space;
     gc_semi_space to_space;
-    size_t total_objects;
+    // young generation: objects are bump allocated in the nursery and minor
+    // collections copy the survivors to the survivor space, then swap the two.
+    gc_semi_space nursery;
+    gc_semi_space survivor;
+    // old objects that may point into the nursery (stb_ds array)
+    struct pico_object **remembered;
+    uint8_t tenure_age;
+    pico_gc_config config;
+    // major collections in a row that left the heap mostly empty
+    uint32_t idle_collections;
+    // set when the last major collection left the heap too full
+    bool grow_pending;
+    // set when the last minor collection kept objects in the survivor space
+    // that were old enough to be promoted, because the old space was full
+    bool promotion_failed;
+    // set while a collection runs, read by the profiler's signal handler
+    volatile bool collecting;
+    pico_gc_stats stats;
     size_t heap_size;
 } pico_gc;
 
+static inline bool pico_gc_is_young(const pico_gc *gc, const void *ptr) {
+    return (const uint8_t *)ptr >= gc->nursery.space_start &&
+           (const uint8_t *)ptr < gc->nursery.space_end;
+}
+
 gc_semi_space gc_semi_space_new(size_t size);
-pico_gc *pico_gc_new(size_t heap_size);
-bool pico_gc_extend_spaces(pico_gc *gc, pico_env *env);
+pico_gc_config pico_gc_config_default(void);
+pico_gc *pico_gc_new(const pico_gc_config *config);
+bool pico_gc_resize_spaces(pico_gc *gc, pico_env *env, size_t new_size);
 void pico_gc_destroy(pico_gc *gc);
-uint8_t *pico_gc_alloc(pico_gc *gc, uint32_t num_fields);
+uint8_t *pico_gc_alloc(pico_gc *gc, size_t size);
+uint8_t *pico_gc_alloc_slow(pico_gc *gc, pico_env *env, size_t size);
+void pico_gc_remember(pico_gc *gc, struct pico_object *obj);
 void pico_gc_collect(pico_gc *gc, pico_env *env);
+void pico_gc_collect_minor(pico_gc *gc, pico_env *env);
 void flip_spaces(pico_gc *gc);
+void pico_gc_print_stats(const pico_gc *gc, FILE *out);
+void pico_gc_write_stats_json(const pico_gc *gc, FILE *out);
@@ -0,0 +1,37 @@
+#pragma once
+
+#include <stdint.h>
+#include <stdio.h>
+
+/*
+ * Dynamic opcode, opcode pair and triple counts, compiled in with
+ * -DPICO_OPCODE_STATS (make pico-stats). A pair is two opcodes dispatched one
+ * after the other, so the counts show which sequences are worth fusing into
+ * superinstructions. The default build records nothing.
+ */
+#ifdef PICO_OPCODE_STATS
+
+extern uint64_t pico_opcode_counts[256];
+extern uint64_t pico_opcode_pairs[256][256];
+// the last two dispatched opcodes, the older one in the high byte
+extern uint16_t pico_opcode_prev;
+
+void pico_opcode_stats_record_triple(uint32_t key);
+
+static inline void pico_opcode_stats_record(uint8_t op) {
+    pico_opcode_counts[op]++;
+    pico_opcode_pairs[pico_opcode_prev & 0xFF][op]++;
+    pico_opcode_stats_record_triple(((uint32_t)pico_opcode_prev << 8) | op);
+    pico_opcode_prev = (uint16_t)(pico_opcode_prev << 8) | op;
+}
+
+#define PICO_RECORD_OPCODE(op) pico_opcode_stats_record(op)
+
+#else
+
+#define PICO_RECORD_OPCODE(op) ((void)0)
+
+#endif
+
+// writes the most frequent opcodes and pairs, a no-op without PICO_OPCODE_STATS
+void pico_opcode_stats_write(FILE *out, uint32_t top);
@@ -1,5 +1,10 @@
 #pragma once
 
+// prefix: the operands of the next instruction are four bytes wide. only
+// constant loads, jumps and switches have a wide form, the compiler emits it
+// for constant indices and jump targets that do not fit in two bytes.
+#define OP_WIDE 0x01
+
 #define OP_LIC 0x05
 #define OP_LSC 0x06
 #define OP_LBT 0x07
@@ -10,6 +15,8 @@
 #define OP_LOAD 0x0C
 #define OP_IINC 0x0D
 #define OP_IDEC 0x0E
+#define OP_TEE 0x0F
+#define OP_POP 0x10
 
 #define OP_IADD 0x20
 #define OP_ISUB 0x21
@@ -40,12 +47,19 @@
 #define OP_I2B 0x5E
 
 #define OP_JF 0x60
+#define OP_JT 0x61
 #define OP_JMP 0x62
+// pop an int and jump through a table indexed by it, or binary search a sorted
+// table of labels. their length depends on the number of cases.
+#define OP_TABLESWITCH 0x63
+#define OP_LOOKUPSWITCH 0x64
 #define OP_RET 0x66
 #define OP_CALL 0x68
 #define OP_VOID_CALL 0x69
 #define OP_CALL_EXTERN 0x6A
 #define OP_VOID_CALL_EXTERN 0x6B
+// reuses the current frame for a call in return position
+#define OP_TAIL_CALL 0x6C
 
 #define OP_ALLOCA_STRUCT 0x70
 #define OP_SET_FIELD 0x71
@@ -59,4 +73,130 @@
 #define OP_ARRAY_SET 0x7B
 #define OP_ARRAY_GET 0x7C
 
+// packed int32/bool arrays
+#define OP_ALLOCA_IARRAY 0x7D
+#define OP_IARRAY_SET 0x7E
+#define OP_IARRAY_GET 0x7F
+#define OP_IARRAY_STORE 0x80
+#define OP_ALLOCA_BARRAY 0x81
+#define OP_BARRAY_SET 0x82
+#define OP_BARRAY_GET 0x83
+#define OP_BARRAY_STORE 0x84
+
 #define OP_LOG 0x85
+
+// superinstructions, picked from opcode pair counts of the benchmarks
+// (make pico-stats). LC operands are a local and a constant index, LL two
+// locals. the compare-and-branch forms jump when the comparison is false.
+#define OP_JF_ILT 0x90
+#define OP_JF_ILE 0x91
+#define OP_JF_IGT 0x92
+#define OP_JF_IGE 0x93
+#define OP_JF_IEQ 0x94
+#define OP_JF_INE 0x95
+#define OP_JF_ILT_LC 0x98
+#define OP_JF_ILE_LC 0x99
+#define OP_JF_IGT_LC 0x9A
+#define OP_JF_IGE_LC 0x9B
+#define OP_JF_IEQ_LC 0x9C
+#define OP_JF_INE_LC 0x9D
+#define OP_IADD_LC 0xA0
+#define OP_ISUB_LC 0xA1
+#define OP_IBAND_LC 0xA2
+#define OP_IADD_LL 0xA4
+#define OP_ISUB_LL 0xA5
+
+// register instruction set, used when the bytecode header selects
+// PICO_MODE_REGISTER. operands are frame slots (registers) unless noted: the
+// declared locals come first and the compiler's temporaries follow them. K
+// forms take a constant index as their last source operand.
+#define OP_R_MOV 0xB0
+#define OP_R_LOADK 0xB1
+#define OP_R_LOADT 0xB2
+#define OP_R_LOADF 0xB3
+#define OP_R_INC 0xB4
+#define OP_R_DEC 0xB5
+#define OP_R_NOT 0xB6
+#define OP_R_I2B 0xB7
+#define OP_R_B2I 0xB8
+#define OP_R_LOG 0xB9
+#define OP_R_JMP 0xBA
+#define OP_R_JF 0xBB
+#define OP_R_JT 0xBC
+#define OP_R_AND 0xBD
+#define OP_R_OR 0xBE
+
+#define OP_R_IADD 0xC0
+#define OP_R_ISUB 0xC1
+#define OP_R_IMUL 0xC2
+#define OP_R_IDIV 0xC3
+#define OP_R_IREM 0xC4
+#define OP_R_IBAND 0xC5
+#define OP_R_IBOR 0xC6
+#define OP_R_IBXOR 0xC7
+#define OP_R_ISHL 0xC8
+#define OP_R_ISHR 0xC9
+#define OP_R_IEQ 0xCA
+#define OP_R_INE 0xCB
+#define OP_R_ILT 0xCC
+#define OP_R_ILE 0xCD
+#define OP_R_IGT 0xCE
+#define OP_R_IGE 0xCF
+
+#define OP_R_IADDK 0xD0
+#define OP_R_ISUBK 0xD1
+#define OP_R_IMULK 0xD2
+#define OP_R_IDIVK 0xD3
+#define OP_R_IREMK 0xD4
+#define OP_R_IBANDK 0xD5
+#define OP_R_IBORK 0xD6
+#define OP_R_IBXORK 0xD7
+#define OP_R_ISHLK 0xD8
+#define OP_R_ISHRK 0xD9
+
+// compare-and-branch, jump when the comparison is false
+#define OP_R_JF_ILT 0xDA
+#define OP_R_JF_ILE 0xDB
+#define OP_R_JF_IGT 0xDC
+#define OP_R_JF_IGE 0xDD
+#define OP_R_JF_IEQ 0xDE
+#define OP_R_JF_INE 0xDF
+#define OP_R_JF_ILTK 0xE0
+#define OP_R_JF_ILEK 0xE1
+#define OP_R_JF_IGTK 0xE2
+#define OP_R_JF_IGEK 0xE3
+#define OP_R_JF_IEQK 0xE4
+#define OP_R_JF_INEK 0xE5
+
+// the arguments are the registers from base up, the callee's frame starts
+// there and its return value is left in the base register.
+#define OP_R_CALL 0xE6
+#define OP_R_CALL_EXTERN 0xE7
+#define OP_R_VOID_CALL_EXTERN 0xE8
+#define OP_R_RET 0xE9
+#define OP_R_RET_VOID 0xEA
+
+#define OP_R_NEW_STRUCT 0xEB
+#define OP_R_GET_FIELD 0xEC
+#define OP_R_SET_FIELD 0xED
+#define OP_R_FIELD_INC 0xEE
+#define OP_R_FIELD_DEC 0xEF
+
+// INIT takes an immediate element index and is only used for array literals
+#define OP_R_NEW_ARRAY 0xF0
+#define OP_R_ARRAY_INIT 0xF1
+#define OP_R_ARRAY_GET 0xF2
+#define OP_R_ARRAY_SET 0xF3
+#define OP_R_NEW_IARRAY 0xF4
+#define OP_R_IARRAY_INIT 0xF5
+#define OP_R_IARRAY_GET 0xF6
+#define OP_R_IARRAY_SET 0xF7
+#define OP_R_NEW_BARRAY 0xF8
+#define OP_R_BARRAY_INIT 0xF9
+#define OP_R_BARRAY_GET 0xFA
+#define OP_R_BARRAY_SET 0xFB
+
+#define OP_R_TAIL_CALL 0xFC
+// switch on the int in a register, laid out like OP_TABLESWITCH/OP_LOOKUPSWITCH
+#define OP_R_TABLESWITCH 0xFD
+#define OP_R_LOOKUPSWITCH 0xFE
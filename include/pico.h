@@ -58,19 +58,17 @@
 
 #define PICO_MAX_FRAMES 512
 #define PICO_MAX_STACK_SIZE 2048
-#define PICO_FRAME_NEW(func, base, stack_ptr, parent_frame)                    \
+/*
+ * A frame's locals live in a window of the vm value stack: bp points at the
+ * first parameter and sp at the first operand slot above the locals, so a call
+ * only has to move bp/sp and the arguments are used in place.
+ */
+#define PICO_FRAME_NEW(func, base, parent_frame, ret_value)                    \
     (pico_frame) {                                                             \
-        .function = (func), .bp = (base), .sp = (stack_ptr), .ip = 0,          \
-        .locals = calloc((func)->local_count, sizeof(pico_value)),             \
-        .parent = parent_frame                                                 \
+        .function = (func), .bp = (base), .sp = (base) + (func)->local_count,  \
+        .ip = 0, .parent = parent_frame, .returns_value = (ret_value)          \
     }
 
-#define PICO_FRAME_DEINIT(frame)                                               \
-    do {                                                                       \
-        free((frame).locals);                                                  \
-        (frame).locals = NULL;                                                 \
-    } while (0)
-
 #define PICO_EXPORT __attribute__((visibility("default")))
 
 typedef int32_t pint;
@@ -104,11 +102,60 @@ typedef struct pico_value {
     };
 } pico_value;
 
+typedef enum pico_object_kind {
+    // struct or array of pico_values
+    PICO_OBJ_FIELDS,
+    // packed arrays keep raw elements after the header and have no fields
+    PICO_OBJ_INT_ARRAY,
+    PICO_OBJ_BOOL_ARRAY,
+} pico_object_kind_t;
+
 typedef struct pico_object {
+    // to-space copy of this object, only set while a collection is running
+    struct pico_object *forward;
     pbyte num_fields;
+    // minor collections survived, see PICO_GC_TENURE_AGE
+    pbyte age;
+    // set while the object is in the gc remembered set
+    pbool remembered;
+    // pico_object_kind_t
+    pbyte kind;
+    // element count of packed arrays
+    puint length;
     pico_value fields[];
 } pico_object;
 
+#define PICO_OBJECT_SIZE(num_fields)                                           \
+    (sizeof(pico_object) + (num_fields) * sizeof(pico_value))
+// payload is rounded up so the next object stays 8 byte aligned
+#define PICO_PACKED_ARRAY_SIZE(elem_size, length)                              \
+    (sizeof(pico_object) + (((size_t)(length) * (elem_size) + 7) & ~(size_t)7))
+
+#define PICO_ARRAY_INTS(obj) ((pint *)(obj)->fields)
+#define PICO_ARRAY_BOOLS(obj) ((pbool *)(obj)->fields)
+
+static inline size_t pico_object_size(const pico_object *obj) {
+    switch (obj->kind) {
+    case PICO_OBJ_INT_ARRAY:
+        return PICO_PACKED_ARRAY_SIZE(sizeof(pint), obj->length);
+    case PICO_OBJ_BOOL_ARRAY:
+        return PICO_PACKED_ARRAY_SIZE(sizeof(pbool), obj->length);
+    default:
+        return PICO_OBJECT_SIZE(obj->num_fields);
+    }
+}
+
+// must run before every store of a value into an object field: an old object
+// that starts pointing into the nursery is recorded as a minor gc root.
+#define PICO_GC_WRITE_BARRIER(gc, obj, value)                                  \
+    do {                                                                       \
+        if ((value).kind == PICO_OBJECT && !(obj)->remembered &&               \
+            pico_gc_is_young((gc), (value).objref) &&                          \
+            !pico_gc_is_young((gc), (obj))) {                                  \
+            pico_gc_remember((gc), (obj));                                     \
+        }                                                                      \
+    } while (0)
+
 static pico_value pico_true = (pico_value){.kind = PICO_BOOL, .boolean = true};
 static pico_value pico_false =
     (pico_value){.kind = PICO_BOOL, .boolean = false};
@@ -121,12 +168,28 @@ typedef struct pico_function {
     pbyte *code;
     puint local_count;
     puint param_count;
+    // most operand stack values above the locals, computed by the compiler
+    puint max_stack;
     pulong code_len;
 } pico_function;
 
+// a native function named in the Libraries section of a bytecode file
+typedef struct pico_native_ref {
+    puint lib_name_id;
+    puint name_id;
+} pico_native_ref;
+
+// instruction set of a bytecode file, byte 4 of the header
+typedef enum pico_code_mode {
+    PICO_MODE_STACK = 0,
+    PICO_MODE_REGISTER = 1,
+} pico_code_mode;
+
 typedef struct bytecode_unit {
+    pico_code_mode mode;
     pico_value *constants;
     pico_function *functions;
+    pico_native_ref *natives;
     puint main_function_index;
 } bytecode_unit;
 
@@ -134,9 +197,10 @@ typedef struct pico_frame {
     pico_function *function;
     pico_value *bp;
     pico_value *sp;
-    pico_value *locals;
     pulong ip;
     struct pico_frame *parent;
+    // set for OP_CALL, the caller expects the return value on its stack
+    bool returns_value;
 } pico_frame;
 
 typedef enum pico_vm_state {
@@ -152,7 +216,10 @@ typedef struct pico_vm {
     pico_value stack[PICO_MAX_STACK_SIZE];
     pico_value *constants;
     pico_function *functions;
+    // resolved at load time, indexed by the OP_CALL_EXTERN operand
+    struct native_fn_entry **natives;
     puint main_function_index;
+    pico_code_mode mode;
 #ifdef DEBUG_BUILD
     pico_vm_state state;
 #endif
@@ -190,15 +257,17 @@ typedef struct native_fn_entry {
 
 bytecode_unit load_bytecode(const char *filename);
 void print_bytecode_unit(bytecode_unit *unit);
+const char *pico_opcode_name(pbyte op);
 
-void pico_env_init(pico_env *env);
+void pico_env_init(pico_env *env, const pico_gc_config *gc_config);
 void pico_env_deinit(pico_env *env);
 
 void pico_vm_init(pico_vm *vm, bytecode_unit *unit);
 void pico_vm_run(pico_env *env);
 void pico_vm_shutdown(pico_vm *vm);
 
-void pico_load_libraries(pico_env *env, char *lib_name);
+void pico_load_libraries(pico_env *env, const char *lib_name);
+void pico_link_natives(pico_env *env, bytecode_unit *unit);
 void pico_deinit_libraries(void **lib_handles);
 
 /**
@@ -233,36 +302,37 @@ pico_register_native_void_function(pico_env *env, const char *name,
                     entry);
 }
 
-static inline pico_object *pico_env_alloc_object(pico_env *env,
-                                                 puint num_fields) {
-
-    pico_object *obj = (pico_object *)pico_gc_alloc(env->gc, num_fields);
+static inline pico_object *pico_env_alloc(pico_env *env, size_t size) {
+    pico_object *obj = (pico_object *)pico_gc_alloc(env->gc, size);
     if (!obj) {
-        pico_gc_collect(env->gc, env);
-        flip_spaces(env->gc);
-        obj = (pico_object *)pico_gc_alloc(env->gc, num_fields);
+        obj = (pico_object *)pico_gc_alloc_slow(env->gc, env, size);
         if (!obj) {
-            if (!pico_gc_extend_spaces(env->gc, env)) {
-                fprintf(
-                    stderr,
-                    "PicoGC: failed to allocate object (%u fields) even after "
+            fprintf(stderr,
+                    "PicoGC: failed to allocate object (%zu bytes) even after "
                     "GC and heap extension (heap=%zu bytes).\n",
-                    num_fields, env->gc->heap_size);
-                pico_env_deinit(env);
-                exit(EXIT_FAILURE);
-            }
-            obj = (pico_object *)pico_gc_alloc(env->gc, num_fields);
-            if (!obj) {
-                fprintf(
-                    stderr,
-                    "PicoGC: failed to allocate object (%u fields) even after "
-                    "GC and heap extension (heap=%zu bytes).\n",
-                    num_fields, env->gc->heap_size);
-                pico_env_deinit(env);
-                exit(EXIT_FAILURE);
-            }
+                    size, env->gc->heap_size);
+            pico_env_deinit(env);
+            exit(EXIT_FAILURE);
         }
     }
     return obj;
 }
+
+static inline pico_object *pico_env_alloc_object(pico_env *env,
+                                                 puint num_fields) {
+    pico_object *obj = pico_env_alloc(env, PICO_OBJECT_SIZE(num_fields));
+    obj->num_fields = num_fields;
+    return obj;
+}
+
+static inline pico_object *pico_env_alloc_packed_array(pico_env *env,
+                                                       pico_object_kind_t kind,
+                                                       puint length) {
+    size_t elem_size = kind == PICO_OBJ_INT_ARRAY ? sizeof(pint) : sizeof(pbool);
+    pico_object *obj =
+        pico_env_alloc(env, PICO_PACKED_ARRAY_SIZE(elem_size, length));
+    obj->kind = kind;
+    obj->length = length;
+    return obj;
+}
 /**--------------------------------------------- */
@@ -0,0 +1,24 @@
+#pragma once
+
+#include <stddef.h>
+#include <stdint.h>
+
+typedef struct pico_env pico_env;
+
+#ifndef PICO_PROFILER_DEFAULT_HZ
+#define PICO_PROFILER_DEFAULT_HZ 997
+#endif
+
+// deepest stack recorded per sample, deeper stacks keep their innermost frames
+#ifndef PICO_PROFILER_MAX_DEPTH
+#define PICO_PROFILER_MAX_DEPTH 128
+#endif
+
+// size of the sample buffer in 32-bit words, samples that do not fit are
+// counted as dropped.
+#ifndef PICO_PROFILER_BUFFER_WORDS
+#define PICO_PROFILER_BUFFER_WORDS (1u << 22)
+#endif
+
+bool pico_profiler_start(pico_env *env, const char *path, uint32_t hz);
+void pico_profiler_stop(pico_env *env);
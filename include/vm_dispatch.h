@@ -0,0 +1,134 @@
+#pragma once
+
+// shared by the stack and the register interpreter loops, only included by
+// runtime/vm.c and runtime/regvm.c.
+
+#include "opcode_stats.h"
+#include "pico.h"
+
+/*
+ * Dispatch strategy.
+ *
+ * With GCC/Clang the interpreter uses threaded dispatch: every handler ends by
+ * jumping straight to the next handler through a per-opcode table of label
+ * addresses (labels-as-values), so there is no shared switch and no bounds
+ * check per instruction. Define PICO_SWITCH_DISPATCH to fall back to the
+ * portable switch loop (the debugger build always uses it).
+ */
+#if (defined(__GNUC__) || defined(__clang__)) &&                               \
+    !defined(PICO_SWITCH_DISPATCH) && !defined(DEBUG_BUILD)
+#define PICO_THREADED_DISPATCH
+#endif
+
+#ifdef PICO_THREADED_DISPATCH
+#define VM_CASE(op) op_##op
+#define VM_DEFAULT op_unknown
+#define VM_DISPATCH()                                                          \
+    do {                                                                       \
+        PICO_RECORD_OPCODE(*ip);                                               \
+        goto *dispatch_table[*ip++];                                           \
+    } while (0)
+#else
+#define VM_CASE(op) case op
+#define VM_DEFAULT default
+#define VM_DISPATCH() goto dispatch
+#endif
+
+// ip, code and locals are cached in locals of the interpreter loop.
+#define READ_OPCODE() (*ip++)
+#define READ_TWO_BYTES() (ip += 2, (puint)(ip[-2] | (ip[-1] << 8)))
+#define READ_CONSTANT() (constants[READ_TWO_BYTES()])
+
+#define SAVE_IP() (frame->ip = ip - code)
+#define LOAD_FRAME()                                                           \
+    do {                                                                       \
+        code = frame->function->code;                                          \
+        ip = code + frame->ip;                                                 \
+        locals = frame->bp;                                                    \
+    } while (0)
+
+#define CHECK_ARRAY_INDEX(index, length)                                       \
+    do {                                                                       \
+        if ((index) < 0 || (puint)(index) >= (length)) {                      \
+            printf("Index %d out of bounds for length %u\n", (index),        \
+                   (puint)(length));                                           \
+            pico_env_deinit(env);                                              \
+            exit(EXIT_FAILURE);                                                \
+        }                                                                      \
+    } while (0)
+
+// a frame starting at base needs its locals and the deepest operand stack the
+// compiler found, checked once on entry so that pushes never have to. frames
+// is the number of call frames the call pushes, 0 for a tail call that reuses
+// the caller's.
+#define CHECK_FRAME_FITS(function, base, frames)                               \
+    do {                                                                       \
+        if ((base) + (function)->local_count + (function)->max_stack >         \
+                vm->stack + PICO_MAX_STACK_SIZE ||                             \
+            vm->fc + (frames) > PICO_MAX_FRAMES) {                             \
+            printf("Stack overflow calling %s\n",                             \
+                   vm->constants[(function)->name_id].s_value);                \
+            pico_env_deinit(env);                                              \
+            exit(EXIT_FAILURE);                                                \
+        }                                                                      \
+    } while (0)
+
+// the i-th two byte operand from ptr on
+#define OPERAND_AT(ptr, i) ((puint)((ptr)[2 * (i)] | ((ptr)[2 * (i) + 1] << 8)))
+
+// the operands of an instruction after OP_WIDE are four bytes wide
+#define READ_FOUR_BYTES()                                                      \
+    (ip += 4, (puint)(ip[-4] | (ip[-3] << 8) | (ip[-2] << 16) |                \
+                      ((puint)ip[-1] << 24)))
+#define WIDE_OPERAND_AT(ptr, i)                                                \
+    ((puint)((ptr)[4 * (i)] | ((ptr)[4 * (i) + 1] << 8) |                      \
+             ((ptr)[4 * (i) + 2] << 16) | ((puint)(ptr)[4 * (i) + 3] << 24)))
+
+// jump through the table of a TABLESWITCH once its value has been read: the
+// lowest label (a constant index), the entry count, the default target and one
+// target per value from the lowest label up. read and operand_at read operands
+// of the instruction's width.
+#define SWITCH_TABLE(value, read, operand_at)                                  \
+    do {                                                                       \
+        const pint low = constants[read()].i_value;                            \
+        const puint count = read();                                            \
+        /* unsigned, so a value below low is out of range as well */           \
+        const puint entry = (puint)(value) - (puint)low;                       \
+        ip = code + operand_at(ip, entry < count ? entry + 1 : 0);             \
+    } while (0)
+
+// binary search the (label, target) pairs of a LOOKUPSWITCH, sorted by label,
+// once its value has been read. the operands are the pair count, the default
+// target and the pairs, labels are constant indices.
+#define SWITCH_LOOKUP(value, read, operand_at, width)                          \
+    do {                                                                       \
+        const pint key = (value);                                              \
+        puint lo = 0;                                                          \
+        puint hi = read();                                                     \
+        const pbyte *pairs = ip + (width);                                     \
+        puint target = operand_at(ip, 0);                                      \
+        while (lo < hi) {                                                      \
+            const puint mid = lo + (hi - lo) / 2;                              \
+            const pint label = constants[operand_at(pairs, 2 * mid)].i_value;  \
+            if (label == key) {                                                \
+                target = operand_at(pairs, 2 * mid + 1);                       \
+                break;                                                         \
+            }                                                                  \
+            if (label < key) {                                                 \
+                lo = mid + 1;                                                  \
+            } else {                                                           \
+                hi = mid;                                                      \
+            }                                                                  \
+        }                                                                      \
+        ip = code + target;                                                    \
+    } while (0)
+
+#define TABLE_SWITCH(value) SWITCH_TABLE(value, READ_TWO_BYTES, OPERAND_AT)
+#define LOOKUP_SWITCH(value)                                                   \
+    SWITCH_LOOKUP(value, READ_TWO_BYTES, OPERAND_AT, 2)
+#define WIDE_TABLE_SWITCH(value)                                               \
+    SWITCH_TABLE(value, READ_FOUR_BYTES, WIDE_OPERAND_AT)
+#define WIDE_LOOKUP_SWITCH(value)                                              \
+    SWITCH_LOOKUP(value, READ_FOUR_BYTES, WIDE_OPERAND_AT, 4)
+
+void pico_run_register_frame(pico_env *env, pico_vm *vm, pico_frame *frame);
@@ -16,8 +16,12 @@ void print_operand_two(pbyte *code, pulong *pc) {
     printf("%d", code[*pc + 1] | (code[*pc + 2] << 8));
 }
 
-void print_constant_operand(pbyte *code, pulong *pc) {
-    puint index = code[*pc + 1] | (code[*pc + 2] << 8);
+void print_two_operands(pbyte *code, pulong *pc) {
+    printf("%d %d", code[*pc + 1] | (code[*pc + 2] << 8),
+           code[*pc + 3] | (code[*pc + 4] << 8));
+}
+
+static void print_constant(puint index) {
     pico_value *value = &constants[index];
     switch (value->kind) {
     case PICO_INT: {
@@ -35,7 +39,110 @@ void print_constant_operand(pbyte *code, pulong *pc) {
     }
 }
 
+void print_constant_operand(pbyte *code, pulong *pc) {
+    print_constant(code[*pc + 1] | (code[*pc + 2] << 8));
+}
+
+// local, constant
+void print_local_constant_operands(pbyte *code, pulong *pc) {
+    printf("%d ", code[*pc + 1] | (code[*pc + 2] << 8));
+    print_constant(code[*pc + 3] | (code[*pc + 4] << 8));
+}
+
+// local, constant, jump target
+void print_local_constant_jump_operands(pbyte *code, pulong *pc) {
+    print_local_constant_operands(code, pc);
+    printf(" %d", code[*pc + 5] | (code[*pc + 6] << 8));
+}
+
+void print_three_operands(pbyte *code, pulong *pc) {
+    print_two_operands(code, pc);
+    printf(" %d", code[*pc + 5] | (code[*pc + 6] << 8));
+}
+
+// register, register, constant
+void print_two_registers_constant_operands(pbyte *code, pulong *pc) {
+    print_two_operands(code, pc);
+    printf(" ");
+    print_constant(code[*pc + 5] | (code[*pc + 6] << 8));
+}
+
+static puint operand_at(pbyte *code, pulong offset) {
+    return code[offset] | (code[offset + 1] << 8);
+}
+
+// an operand after OP_WIDE
+static puint wide_operand_at(pbyte *code, pulong offset) {
+    return code[offset] | (code[offset + 1] << 8) | (code[offset + 2] << 16) |
+           ((puint)code[offset + 3] << 24);
+}
+
+static puint operand_of_width(pbyte *code, pulong offset, int width) {
+    return width == 4 ? wide_operand_at(code, offset)
+                      : operand_at(code, offset);
+}
+
+// lowest label, entry count, default target, one target per value from the lowest label up
+static void print_table_switch(pbyte *code, pulong at, int width) {
+    puint count = operand_of_width(code, at + width, width);
+    print_constant(operand_of_width(code, at, width));
+    printf(" default %d", operand_of_width(code, at + 2 * width, width));
+    for (puint i = 0; i < count; i++) {
+        printf(" %d", operand_of_width(code, at + (3 + i) * width, width));
+    }
+}
+
+// pair count, default target, (label, target) pairs
+static void print_lookup_switch(pbyte *code, pulong at, int width) {
+    puint count = operand_of_width(code, at, width);
+    printf("default %d", operand_of_width(code, at + width, width));
+    for (puint i = 0; i < count; i++) {
+        printf(" ");
+        print_constant(operand_of_width(code, at + (2 + 2 * i) * width, width));
+        printf(":%d", operand_of_width(code, at + (3 + 2 * i) * width, width));
+    }
+}
+
+void print_table_switch_operands(pbyte *code, pulong *pc) {
+    print_table_switch(code, *pc + 1, 2);
+}
+
+void print_lookup_switch_operands(pbyte *code, pulong *pc) {
+    print_lookup_switch(code, *pc + 1, 2);
+}
+
+// register, then the table
+void print_register_table_switch_operands(pbyte *code, pulong *pc) {
+    printf("%d ", operand_at(code, *pc + 1));
+    print_table_switch(code, *pc + 3, 2);
+}
+
+void print_register_lookup_switch_operands(pbyte *code, pulong *pc) {
+    printf("%d ", operand_at(code, *pc + 1));
+    print_lookup_switch(code, *pc + 3, 2);
+}
+
+// the operands of the instruction at pc, which follows an OP_WIDE
+static void print_wide_operands(pbyte *code, pulong pc) {
+    switch (code[pc]) {
+    case OP_LIC:
+    case OP_LSC:
+        print_constant(wide_operand_at(code, pc + 1));
+        break;
+    case OP_TABLESWITCH:
+        print_table_switch(code, pc + 1, 4);
+        break;
+    case OP_LOOKUPSWITCH:
+        print_lookup_switch(code, pc + 1, 4);
+        break;
+    default:
+        printf("%u", wide_operand_at(code, pc + 1));
+        break;
+    }
+}
+
 static const opcode_info opcode_table[] = {
+    {OP_WIDE, "Wide", 0, nullptr},
     {OP_LIC, "LoadConstInt", 2, print_constant_operand},
     {OP_LSC, "LoadConstString", 2, print_constant_operand},
     {OP_LBT, "LoadBoolTrue", 0, nullptr},
@@ -46,6 +153,8 @@ static const opcode_info opcode_table[] = {
     {OP_LOAD, "Load", 2, print_operand_two},
     {OP_IINC, "IInc", 2, print_operand_two},
     {OP_IDEC, "IDec", 2, print_operand_two},
+    {OP_TEE, "Tee", 2, print_operand_two},
+    {OP_POP, "Pop", 0, nullptr},
 
     {OP_IADD, "IAdd", 0, nullptr},
     {OP_ISUB, "ISub", 0, nullptr},
@@ -76,12 +185,16 @@ static const opcode_info opcode_table[] = {
     {OP_I2B, "IntToBool", 0, nullptr},
 
     {OP_JF, "Jf", 2, print_operand_two},
+    {OP_JT, "Jt", 2, print_operand_two},
     {OP_JMP, "Jmp", 2, print_operand_two},
+    {OP_TABLESWITCH, "TableSwitch", 6, print_table_switch_operands},
+    {OP_LOOKUPSWITCH, "LookupSwitch", 4, print_lookup_switch_operands},
     {OP_RET, "Ret", 0, nullptr},
     {OP_CALL, "Call", 2, print_operand_two},
     {OP_VOID_CALL, "VoidCall", 2, print_operand_two},
     {OP_VOID_CALL_EXTERN, "VoidCallExtern", 2, print_operand_two},
     {OP_CALL_EXTERN, "CallExtern", 2, print_operand_two},
+    {OP_TAIL_CALL, "TailCall", 2, print_operand_two},
 
     {OP_ALLOCA_STRUCT, "AllocaStruct", 2, print_operand_two},
     {OP_SET_FIELD, "SetField", 2, print_operand_two},
@@ -94,9 +207,114 @@ static const opcode_info opcode_table[] = {
     {OP_ARRAY_STORE, "ArrayStore", 0, nullptr},
     {OP_ARRAY_SET, "ArraySet", 2, print_operand_two},
     {OP_ARRAY_GET, "ArrayGet", 0, nullptr},
+    {OP_ALLOCA_IARRAY, "AllocaIArray", 2, print_operand_two},
+    {OP_IARRAY_SET, "IArraySet", 2, print_operand_two},
+    {OP_IARRAY_GET, "IArrayGet", 0, nullptr},
+    {OP_IARRAY_STORE, "IArrayStore", 0, nullptr},
+    {OP_ALLOCA_BARRAY, "AllocaBArray", 2, print_operand_two},
+    {OP_BARRAY_SET, "BArraySet", 2, print_operand_two},
+    {OP_BARRAY_GET, "BArrayGet", 0, nullptr},
+    {OP_BARRAY_STORE, "BArrayStore", 0, nullptr},
 
     {OP_LOG, "Log", 0, nullptr},
 
+    {OP_JF_ILT, "JfILt", 2, print_operand_two},
+    {OP_JF_ILE, "JfILe", 2, print_operand_two},
+    {OP_JF_IGT, "JfIGt", 2, print_operand_two},
+    {OP_JF_IGE, "JfIGe", 2, print_operand_two},
+    {OP_JF_IEQ, "JfIEq", 2, print_operand_two},
+    {OP_JF_INE, "JfINe", 2, print_operand_two},
+    {OP_JF_ILT_LC, "JfILtLC", 6, print_local_constant_jump_operands},
+    {OP_JF_ILE_LC, "JfILeLC", 6, print_local_constant_jump_operands},
+    {OP_JF_IGT_LC, "JfIGtLC", 6, print_local_constant_jump_operands},
+    {OP_JF_IGE_LC, "JfIGeLC", 6, print_local_constant_jump_operands},
+    {OP_JF_IEQ_LC, "JfIEqLC", 6, print_local_constant_jump_operands},
+    {OP_JF_INE_LC, "JfINeLC", 6, print_local_constant_jump_operands},
+    {OP_IADD_LC, "IAddLC", 4, print_local_constant_operands},
+    {OP_ISUB_LC, "ISubLC", 4, print_local_constant_operands},
+    {OP_IBAND_LC, "IBandLC", 4, print_local_constant_operands},
+    {OP_IADD_LL, "IAddLL", 4, print_two_operands},
+    {OP_ISUB_LL, "ISubLL", 4, print_two_operands},
+
+    {OP_R_MOV, "RMov", 4, print_two_operands},
+    {OP_R_LOADK, "RLoadK", 4, print_local_constant_operands},
+    {OP_R_LOADT, "RLoadTrue", 2, print_operand_two},
+    {OP_R_LOADF, "RLoadFalse", 2, print_operand_two},
+    {OP_R_INC, "RInc", 2, print_operand_two},
+    {OP_R_DEC, "RDec", 2, print_operand_two},
+    {OP_R_NOT, "RNot", 4, print_two_operands},
+    {OP_R_I2B, "RIntToBool", 4, print_two_operands},
+    {OP_R_B2I, "RBoolToInt", 4, print_two_operands},
+    {OP_R_LOG, "RLog", 2, print_operand_two},
+    {OP_R_JMP, "RJmp", 2, print_operand_two},
+    {OP_R_JF, "RJf", 4, print_two_operands},
+    {OP_R_JT, "RJt", 4, print_two_operands},
+    {OP_R_AND, "RAnd", 6, print_three_operands},
+    {OP_R_OR, "ROr", 6, print_three_operands},
+    {OP_R_IADD, "RIAdd", 6, print_three_operands},
+    {OP_R_ISUB, "RISub", 6, print_three_operands},
+    {OP_R_IMUL, "RIMul", 6, print_three_operands},
+    {OP_R_IDIV, "RIDiv", 6, print_three_operands},
+    {OP_R_IREM, "RIRem", 6, print_three_operands},
+    {OP_R_IBAND, "RIBand", 6, print_three_operands},
+    {OP_R_IBOR, "RIBor", 6, print_three_operands},
+    {OP_R_IBXOR, "RIBxor", 6, print_three_operands},
+    {OP_R_ISHL, "RIShl", 6, print_three_operands},
+    {OP_R_ISHR, "RIShr", 6, print_three_operands},
+    {OP_R_IEQ, "RIEq", 6, print_three_operands},
+    {OP_R_INE, "RINe", 6, print_three_operands},
+    {OP_R_ILT, "RILt", 6, print_three_operands},
+    {OP_R_ILE, "RILe", 6, print_three_operands},
+    {OP_R_IGT, "RIGt", 6, print_three_operands},
+    {OP_R_IGE, "RIGe", 6, print_three_operands},
+    {OP_R_IADDK, "RIAddK", 6, print_two_registers_constant_operands},
+    {OP_R_ISUBK, "RISubK", 6, print_two_registers_constant_operands},
+    {OP_R_IMULK, "RIMulK", 6, print_two_registers_constant_operands},
+    {OP_R_IDIVK, "RIDivK", 6, print_two_registers_constant_operands},
+    {OP_R_IREMK, "RIRemK", 6, print_two_registers_constant_operands},
+    {OP_R_IBANDK, "RIBandK", 6, print_two_registers_constant_operands},
+    {OP_R_IBORK, "RIBorK", 6, print_two_registers_constant_operands},
+    {OP_R_IBXORK, "RIBxorK", 6, print_two_registers_constant_operands},
+    {OP_R_ISHLK, "RIShlK", 6, print_two_registers_constant_operands},
+    {OP_R_ISHRK, "RIShrK", 6, print_two_registers_constant_operands},
+    {OP_R_JF_ILT, "RJfILt", 6, print_three_operands},
+    {OP_R_JF_ILE, "RJfILe", 6, print_three_operands},
+    {OP_R_JF_IGT, "RJfIGt", 6, print_three_operands},
+    {OP_R_JF_IGE, "RJfIGe", 6, print_three_operands},
+    {OP_R_JF_IEQ, "RJfIEq", 6, print_three_operands},
+    {OP_R_JF_INE, "RJfINe", 6, print_three_operands},
+    {OP_R_JF_ILTK, "RJfILtK", 6, print_local_constant_jump_operands},
+    {OP_R_JF_ILEK, "RJfILeK", 6, print_local_constant_jump_operands},
+    {OP_R_JF_IGTK, "RJfIGtK", 6, print_local_constant_jump_operands},
+    {OP_R_JF_IGEK, "RJfIGeK", 6, print_local_constant_jump_operands},
+    {OP_R_JF_IEQK, "RJfIEqK", 6, print_local_constant_jump_operands},
+    {OP_R_JF_INEK, "RJfINeK", 6, print_local_constant_jump_operands},
+    {OP_R_CALL, "RCall", 4, print_two_operands},
+    {OP_R_CALL_EXTERN, "RCallExtern", 4, print_two_operands},
+    {OP_R_VOID_CALL_EXTERN, "RVoidCallExtern", 4, print_two_operands},
+    {OP_R_RET, "RRet", 2, print_operand_two},
+    {OP_R_RET_VOID, "RRetVoid", 0, nullptr},
+    {OP_R_NEW_STRUCT, "RNewStruct", 4, print_two_operands},
+    {OP_R_GET_FIELD, "RGetField", 6, print_three_operands},
+    {OP_R_SET_FIELD, "RSetField", 6, print_three_operands},
+    {OP_R_FIELD_INC, "RFieldInc", 4, print_two_operands},
+    {OP_R_FIELD_DEC, "RFieldDec", 4, print_two_operands},
+    {OP_R_NEW_ARRAY, "RNewArray", 4, print_two_operands},
+    {OP_R_ARRAY_INIT, "RArrayInit", 6, print_three_operands},
+    {OP_R_ARRAY_GET, "RArrayGet", 6, print_three_operands},
+    {OP_R_ARRAY_SET, "RArraySet", 6, print_three_operands},
+    {OP_R_NEW_IARRAY, "RNewIArray", 4, print_two_operands},
+    {OP_R_IARRAY_INIT, "RIArrayInit", 6, print_three_operands},
+    {OP_R_IARRAY_GET, "RIArrayGet", 6, print_three_operands},
+    {OP_R_IARRAY_SET, "RIArraySet", 6, print_three_operands},
+    {OP_R_NEW_BARRAY, "RNewBArray", 4, print_two_operands},
+    {OP_R_BARRAY_INIT, "RBArrayInit", 6, print_three_operands},
+    {OP_R_BARRAY_GET, "RBArrayGet", 6, print_three_operands},
+    {OP_R_BARRAY_SET, "RBArraySet", 6, print_three_operands},
+    {OP_R_TAIL_CALL, "RTailCall", 4, print_two_operands},
+    {OP_R_TABLESWITCH, "RTableSwitch", 8, print_register_table_switch_operands},
+    {OP_R_LOOKUPSWITCH, "RLookupSwitch", 6, print_register_lookup_switch_operands},
+
     {0xFF, "unknown", 0, nullptr} // sentinel
 };
 
@@ -108,9 +326,37 @@ static const opcode_info *get_info(pbyte op) {
     return &opcode_table[sizeof(opcode_table) / sizeof(opcode_table[0]) - 1];
 }
 
+const char *pico_opcode_name(pbyte op) { return get_info(op)->name; }
+
+// operands lists the fixed part of a switch, its targets follow it
+static puint operand_bytes(pbyte *code, pulong pc, const opcode_info *info) {
+    switch (code[pc]) {
+    case OP_WIDE:
+        // the prefixed instruction with every operand twice as wide
+        switch (code[pc + 1]) {
+        case OP_TABLESWITCH:
+            return 13 + 4 * wide_operand_at(code, pc + 6);
+        case OP_LOOKUPSWITCH:
+            return 9 + 8 * wide_operand_at(code, pc + 2);
+        default:
+            return 1 + 2 * get_info(code[pc + 1])->operands;
+        }
+    case OP_TABLESWITCH:
+        return info->operands + 2 * operand_at(code, pc + 3);
+    case OP_LOOKUPSWITCH:
+        return info->operands + 4 * operand_at(code, pc + 1);
+    case OP_R_TABLESWITCH:
+        return info->operands + 2 * operand_at(code, pc + 5);
+    case OP_R_LOOKUPSWITCH:
+        return info->operands + 4 * operand_at(code, pc + 3);
+    default:
+        return info->operands;
+    }
+}
+
 static void print_function(const pico_function *fn, int index) {
-    printf("Function %d (name_id=%u, locals=%u, code_len=%lu):\n", index,
-           fn->name_id, fn->local_count, fn->code_len);
+    printf("Function %d (name_id=%u, locals=%u, max_stack=%u, code_len=%lu):\n",
+           index, fn->name_id, fn->local_count, fn->max_stack, fn->code_len);
 
     int index_width = snprintf(NULL, 0, "%lu", fn->code_len);
 
@@ -118,16 +364,21 @@ static void print_function(const pico_function *fn, int index) {
     while (pc < fn->code_len) {
         pbyte op = fn->code[pc];
         const opcode_info *info = get_info(op);
-        puint size = 1 + info->operands;
+        puint size = 1 + operand_bytes(fn->code, pc, info);
 
         printf("%*lu |> ", index_width, pc);
-        for (puint i = 0; i < size && pc + i < fn->code_len; i++) {
+        for (puint i = 0; i < size && i < 7 && pc + i < fn->code_len; i++) {
             printf("%02X ", fn->code[pc + i]);
         }
-        for (puint i = size; i < 4; i++)
+        for (puint i = size; i < 7; i++)
             printf("   ");
 
-        printf("%-12s", info->name);
+        if (op == OP_WIDE) {
+            printf("Wide %-7s%-15s", get_info(fn->code[pc + 1])->name, "");
+            print_wide_operands(fn->code, pc + 1);
+        } else {
+            printf("%-12s", info->name);
+        }
 
         if (info->print_fp) {
             printf("%-15s", "");
@@ -11,11 +11,12 @@
 #include "debugger.h"
 #endif
 
-void pico_env_init(pico_env *env) {
+void pico_env_init(pico_env *env, const pico_gc_config *gc_config) {
     env->lib_handles = nullptr;
     env->native_functions = nullptr;
     env->vm = malloc(sizeof(pico_vm));
-    env->gc = pico_gc_new(1024);
+    env->frame = nullptr;
+    env->gc = pico_gc_new(gc_config);
 #ifdef DEBUG_BUILD
     env->vm->state=PICO_VM_STATE_PAUSED;
     env->event_queue = malloc(sizeof(struct dbg_event_queue));
@@ -38,7 +39,7 @@ static const bool check_file_ext(const char *filename, const char *ext) {
     return strcmp(dot + 1, ext) == 0;
 }
 
-void pico_load_libraries(pico_env *env, char *lib_dir_name) {
+void pico_load_libraries(pico_env *env, const char *lib_dir_name) {
     DIR *lib_dir = opendir(lib_dir_name);
     if (!lib_dir) {
         fprintf(stderr, "failed to open %s: %s\n", lib_dir_name, strerror(1));
@@ -72,6 +73,32 @@ void pico_load_libraries(pico_env *env, char *lib_dir_name) {
     }
 }
 
+void pico_link_natives(pico_env *env, bytecode_unit *unit) {
+    const puint count = arrlen(unit->natives);
+    native_fn_entry **natives = nullptr;
+    arrsetlen(natives, count);
+
+    bool missing = false;
+    for (puint i = 0; i < count; i++) {
+        const pico_native_ref *ref = &unit->natives[i];
+        const char *name = unit->constants[ref->name_id].s_value;
+        HASH_FIND_STR(env->native_functions, name, natives[i]);
+        if (!natives[i]) {
+            fprintf(stderr, "cannot find native function: %s (library %s)\n",
+                    name, unit->constants[ref->lib_name_id].s_value);
+            missing = true;
+        }
+    }
+    arrfree(unit->natives);
+
+    if (missing) {
+        arrfree(natives);
+        pico_env_deinit(env);
+        exit(EXIT_FAILURE);
+    }
+    env->vm->natives = natives;
+}
+
 void pico_deinit_libraries(void **lib_handles) {
     puint count = arrlen(lib_handles);
     for (puint i = 0; i < count; i++) {
@@ -1,13 +1,52 @@
-/* implementation of Semi Space Copying Garbage Collector */
+/*
+ * implementation of a generational copying Garbage Collector.
+ *
+ * Objects are bump allocated in a nursery. A minor collection copies the
+ * nursery survivors to the survivor space, or to the old generation once they
+ * are old enough or the survivor space is half full, and then swaps nursery
+ * and survivor. Old objects that point
+ * into the nursery are found through the remembered set filled by the write
+ * barrier in the vm.
+ *
+ * The old generation is a pair of semi-spaces. A major collection copies every
+ * live object, young or old, to the old to-space.
+ *
+ * Both collections are a Cheney scan: roots are copied first, then the copied
+ * objects are used as the queue of objects whose fields still have to be
+ * forwarded. A copied object leaves a forwarding pointer behind so shared
+ * objects are copied once. Packed arrays have no fields, so their payload is
+ * copied but never scanned.
+ */
+// clock_gettime
+#define _POSIX_C_SOURCE 200809L
+
 #include "gc.h"
 #include "pico.h"
-#include "worklist.h"
+#include "stb_ds.h"
 #include <stddef.h>
 #include <stdint.h>
+#include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <time.h>
+
+#define GC_SPACE_USED(space) ((size_t)((space).alloc_ptr - (space).space_start))
+#define GC_SPACE_FREE(space) ((size_t)((space).space_end - (space).alloc_ptr))
+
+static uint64_t gc_now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec * 1000000000u + (uint64_t)ts.tv_nsec;
+}
 
-#define IS_OBJECT_IN_TOSPACE(obj) ((uint8_t *)obj >= gc->to_space.space_start)
+static void gc_record_pause(pico_gc_collection_stats *stats, uint64_t start) {
+    uint64_t pause = gc_now_ns() - start;
+    stats->count++;
+    stats->pause_total_ns += pause;
+    if (pause > stats->pause_max_ns) {
+        stats->pause_max_ns = pause;
+    }
+}
 
 void flip_spaces(pico_gc *gc) {
     gc_semi_space temp = gc->from_space;
@@ -19,18 +58,37 @@ void flip_spaces(pico_gc *gc) {
 gc_semi_space gc_semi_space_new(size_t size) {
     gc_semi_space space;
     space.size = size;
-    space.space_start = malloc(size);
+    space.space_start = size ? malloc(size) : nullptr;
     space.space_end = space.space_start + size;
     space.alloc_ptr = space.space_start;
     return space;
 }
 
-pico_gc *pico_gc_new(size_t heap_size) {
+pico_gc_config pico_gc_config_default(void) {
+    return (pico_gc_config){
+        .initial_size = PICO_GC_INITIAL_SIZE,
+        .max_size = 0,
+        .nursery_size = PICO_GC_NURSERY_SIZE,
+        .growth_factor = 2.0,
+        .shrink_after = 4,
+    };
+}
+
+pico_gc *pico_gc_new(const pico_gc_config *config) {
     pico_gc *gc = malloc(sizeof(pico_gc));
-    gc->from_space = gc_semi_space_new(heap_size);
-    gc->to_space = gc_semi_space_new(heap_size);
-    gc->total_objects = 0;
-    gc->heap_size = heap_size;
+    gc->from_space = gc_semi_space_new(config->initial_size);
+    gc->to_space = gc_semi_space_new(config->initial_size);
+    gc->nursery = gc_semi_space_new(config->nursery_size);
+    gc->survivor = gc_semi_space_new(config->nursery_size);
+    gc->remembered = nullptr;
+    gc->tenure_age = PICO_GC_TENURE_AGE;
+    gc->config = *config;
+    gc->idle_collections = 0;
+    gc->grow_pending = false;
+    gc->promotion_failed = false;
+    gc->collecting = false;
+    gc->stats = (pico_gc_stats){.peak_heap_size = config->initial_size};
+    gc->heap_size = config->initial_size;
     return gc;
 }
 
@@ -42,12 +100,14 @@ static void gc_semi_space_destroy(gc_semi_space *space) {
     space->size = 0;
 }
 
-bool pico_gc_extend_spaces(pico_gc *gc, pico_env *env) {
-    size_t new_size = gc->heap_size * 2;
+// collects into a new pair of semi-spaces of new_size bytes.
+bool pico_gc_resize_spaces(pico_gc *gc, pico_env *env, size_t new_size) {
     gc_semi_space new_from_space = gc_semi_space_new(new_size);
     gc_semi_space new_to_space = gc_semi_space_new(new_size);
 
     if (!new_from_space.space_start || !new_to_space.space_start) {
+        free(new_from_space.space_start);
+        free(new_to_space.space_start);
         return false;
     }
 
@@ -61,6 +121,14 @@ bool pico_gc_extend_spaces(pico_gc *gc, pico_env *env) {
     flip_spaces(gc);
     gc_semi_space_destroy(&old_to_space);
     gc_semi_space_destroy(&old_from_space);
+    if (new_size > gc->heap_size) {
+        gc->stats.heap_grows++;
+    } else if (new_size < gc->heap_size) {
+        gc->stats.heap_shrinks++;
+    }
+    if (new_size > gc->stats.peak_heap_size) {
+        gc->stats.peak_heap_size = new_size;
+    }
     gc->heap_size = new_size;
     return true;
 }
@@ -68,61 +136,383 @@ bool pico_gc_extend_spaces(pico_gc *gc, pico_env *env) {
 void pico_gc_destroy(pico_gc *gc) {
     gc_semi_space_destroy(&gc->from_space);
     gc_semi_space_destroy(&gc->to_space);
+    gc_semi_space_destroy(&gc->nursery);
+    gc_semi_space_destroy(&gc->survivor);
+    arrfree(gc->remembered);
     free(gc);
 }
 
-uint8_t *pico_gc_alloc(pico_gc *gc, uint32_t num_fields) {
-    size_t size = sizeof(pico_object) + num_fields * sizeof(pico_value);
-    if (gc->from_space.alloc_ptr + size > gc->from_space.space_end) {
+static inline uint8_t *gc_bump(gc_semi_space *space, size_t size) {
+    if (space->alloc_ptr + size > space->space_end) {
         return nullptr;
     }
-    pico_object *obj = (pico_object *)gc->from_space.alloc_ptr;
-    obj->num_fields = num_fields;
-    gc->from_space.alloc_ptr += size;
-    return (uint8_t *)obj;
+    uint8_t *ptr = space->alloc_ptr;
+    space->alloc_ptr += size;
+    return ptr;
 }
 
-static pico_object *gc_copy_object(pico_gc *gc, pico_object *obj) {
-    if (IS_OBJECT_IN_TOSPACE(obj)) {
-        return obj;
+// returns a zeroed object of size bytes, its header describes an object
+// without fields until the caller fills it in.
+uint8_t *pico_gc_alloc(pico_gc *gc, size_t size) {
+    // objects that can never fit in the nursery go straight to the old space
+    gc_semi_space *space =
+        size <= gc->nursery.size ? &gc->nursery : &gc->from_space;
+    uint8_t *obj = gc_bump(space, size);
+    if (!obj) {
+        return nullptr;
     }
-    size_t size = sizeof(pico_object) + obj->num_fields * sizeof(pico_value);
-    pico_object *new_obj = (pico_object *)gc->to_space.alloc_ptr;
-    memcpy(new_obj, obj, size);
-    gc->to_space.alloc_ptr += size;
-    return new_obj;
+    gc->stats.allocations++;
+    gc->stats.bytes_allocated += size;
+    // fields are scanned by the collector before the program initializes them
+    memset(obj, 0, size);
+    return obj;
+}
+
+void pico_gc_remember(pico_gc *gc, pico_object *obj) {
+    obj->remembered = true;
+    arrput(gc->remembered, obj);
+}
+
+// next heap size that can hold needed bytes, clamped to the configured maximum.
+static size_t gc_grown_size(pico_gc *gc, size_t needed) {
+    size_t size = gc->heap_size;
+    do {
+        size_t grown = (size_t)(size * gc->config.growth_factor);
+        size = grown > size ? grown : size + 1;
+    } while (size < needed);
+    if (gc->config.max_size && size > gc->config.max_size) {
+        size = gc->config.max_size;
+    }
+    return size;
 }
 
-void pico_gc_copy_root(pico_gc *gc, pico_value *obj) {
-    object_worklist worklist;
-    worklist.head = worklist.tail = nullptr;
-    object_worklist_enqueue(&worklist, obj);
-    while (worklist.head) {
-        pico_value *current = object_worklist_dequeue(&worklist);
-        current->objref = gc_copy_object(gc, current->objref);
-        for (puint i = 0; i < current->objref->num_fields; i++) {
-            if (current->objref->fields[i].kind == PICO_OBJECT) {
-                object_worklist_enqueue(&worklist, &current->objref->fields[i]);
+static size_t gc_shrunk_size(pico_gc *gc, size_t live) {
+    size_t size = (size_t)(gc->heap_size / gc->config.growth_factor);
+    if (size < gc->config.initial_size) {
+        size = gc->config.initial_size;
+    }
+    // never shrink into a heap that would have to grow again right away.
+    while (size < gc->heap_size && live > size * PICO_GC_GROW_RATIO) {
+        size *= 2;
+    }
+    return size < gc->heap_size ? size : gc->heap_size;
+}
+
+// runs a major collection that leaves at least min_free bytes in the old
+// space, resizing the heap on the way.
+static bool gc_collect_major(pico_gc *gc, pico_env *env, size_t min_free) {
+    // everything in the old space and the nursery may survive.
+    size_t live = GC_SPACE_USED(gc->from_space) + GC_SPACE_USED(gc->nursery);
+    if (gc->grow_pending || live + min_free > gc->heap_size) {
+        size_t new_size = gc_grown_size(gc, live + min_free);
+        if (new_size > gc->heap_size) {
+            gc->grow_pending = false;
+            gc->idle_collections = 0;
+            return pico_gc_resize_spaces(gc, env, new_size) &&
+                   GC_SPACE_FREE(gc->from_space) >= min_free;
+        }
+    }
+    pico_gc_collect(gc, env);
+    flip_spaces(gc);
+
+    // the live ratio decides the size of the heap for the next collection.
+    live = GC_SPACE_USED(gc->from_space) + min_free;
+    if (live > gc->heap_size * PICO_GC_GROW_RATIO) {
+        gc->idle_collections = 0;
+        if (live > gc->heap_size) {
+            // min_free does not fit, this allocation cannot wait.
+            size_t new_size = gc_grown_size(gc, live);
+            if (new_size < live ||
+                !pico_gc_resize_spaces(gc, env, new_size)) {
+                return false;
+            }
+        } else {
+            gc->grow_pending = true;
+        }
+    } else if (live < gc->heap_size * PICO_GC_SHRINK_RATIO &&
+               gc->config.shrink_after) {
+        // live data is small, so copying it to smaller spaces is cheap.
+        if (++gc->idle_collections >= gc->config.shrink_after) {
+            gc->idle_collections = 0;
+            size_t new_size = gc_shrunk_size(gc, live);
+            if (new_size < gc->heap_size) {
+                pico_gc_resize_spaces(gc, env, new_size);
+            }
+        }
+    } else {
+        gc->idle_collections = 0;
+    }
+    return true;
+}
+
+uint8_t *pico_gc_alloc_slow(pico_gc *gc, pico_env *env, size_t size) {
+    size_t min_free = size;
+    if (size <= gc->nursery.size) {
+        // a minor collection never fails, objects that do not fit in the old
+        // space stay in the survivor space for another round.
+        uint64_t start = gc_now_ns();
+        gc->collecting = true;
+        pico_gc_collect_minor(gc, env);
+        gc->collecting = false;
+        gc_record_pause(&gc->stats.minor, start);
+        if (!gc->promotion_failed) {
+            uint8_t *obj = pico_gc_alloc(gc, size);
+            if (obj) {
+                return obj;
             }
         }
+        // the old space is full. the major collection leaves room for a whole
+        // nursery of promotions, growing the heap at once if it has to, so
+        // the following minor collections can promote again.
+        min_free = gc->nursery.size;
+    }
+    uint64_t start = gc_now_ns();
+    gc->collecting = true;
+    bool collected = gc_collect_major(gc, env, min_free);
+    gc->collecting = false;
+    gc_record_pause(&gc->stats.major, start);
+    // a young object only needs the nursery, which the major collection
+    // emptied even when a capped heap could not leave the room asked for.
+    if (!collected && size > gc->nursery.size) {
+        return nullptr;
+    }
+    return pico_gc_alloc(gc, size);
+}
+
+static pico_object *gc_forward_object(pico_gc *gc, pico_object *obj) {
+    if (obj->forward) {
+        return obj->forward;
+    }
+    size_t size = pico_object_size(obj);
+    pico_object *new_obj = (pico_object *)gc_bump(&gc->to_space, size);
+    if (!new_obj) {
+        // only possible when the heap is capped by the configured maximum.
+        fprintf(stderr,
+                "PicoGC: live objects do not fit in the maximum heap size "
+                "(%zu bytes).\n",
+                gc->heap_size);
+        exit(EXIT_FAILURE);
+    }
+    memcpy(new_obj, obj, size);
+    new_obj->remembered = false;
+    obj->forward = new_obj;
+    gc->stats.major.bytes_copied += size;
+    return new_obj;
+}
+
+static inline void gc_forward_value(pico_gc *gc, pico_value *value) {
+    if (value->kind == PICO_OBJECT) {
+        value->objref = gc_forward_object(gc, value->objref);
     }
 }
 
+// register frames reuse the slots above sp without clearing them, so the
+// references left there by returned frames are dropped while they still point
+// at live objects. the vm starts with a zeroed stack.
+static void gc_clear_dead_stack(pico_vm *vm) {
+    memset(&vm->stack[vm->sp], 0,
+           (PICO_MAX_STACK_SIZE - vm->sp) * sizeof(pico_value));
+}
+
 void pico_gc_collect(pico_gc *gc, pico_env *env) {
-    for (puint i = 0; i < PICO_MAX_STACK_SIZE; i++) {
-        pico_value *value = &env->vm->stack[i];
-        if (value->kind == PICO_OBJECT) {
-            pico_gc_copy_root(gc, value);
+    uint8_t *scan = gc->to_space.alloc_ptr;
+
+    // frame locals live in the value stack, so everything below sp is a root.
+    for (pulong i = 0; i < env->vm->sp; i++) {
+        gc_forward_value(gc, &env->vm->stack[i]);
+    }
+    gc_clear_dead_stack(env->vm);
+
+    // everything between scan and alloc_ptr has been copied but its fields
+    // still point into from-space.
+    while (scan < gc->to_space.alloc_ptr) {
+        pico_object *obj = (pico_object *)scan;
+        for (puint i = 0; i < obj->num_fields; i++) {
+            gc_forward_value(gc, &obj->fields[i]);
         }
+        scan += pico_object_size(obj);
     }
 
-    pico_frame *temp_frame = env->frame;
-    while (temp_frame) {
-        for (puint i = 0; i < temp_frame->function->local_count; i++) {
-            if (temp_frame->locals[i].kind == PICO_OBJECT) {
-                pico_gc_copy_root(gc, &temp_frame->locals[i]);
-            }
+    // every survivor is in the old generation now.
+    gc->nursery.alloc_ptr = gc->nursery.space_start;
+    arrsetlen(gc->remembered, 0);
+}
+
+static inline void gc_minor_forward_value(pico_gc *gc, pico_value *value) {
+    if (value->kind != PICO_OBJECT || !pico_gc_is_young(gc, value->objref)) {
+        return;
+    }
+    pico_object *obj = value->objref;
+    if (!obj->forward) {
+        size_t size = pico_object_size(obj);
+        // survivors past half of the survivor space are promoted early, so
+        // the swapped nursery always has room left for new objects.
+        bool promote = obj->age + 1 >= gc->tenure_age ||
+                       GC_SPACE_USED(gc->survivor) + size > gc->survivor.size / 2;
+        pico_object *new_obj = nullptr;
+        if (promote) {
+            new_obj = (pico_object *)gc_bump(&gc->from_space, size);
+            promote = new_obj != nullptr;
+            gc->promotion_failed |= !promote;
+        }
+        if (!new_obj) {
+            new_obj = (pico_object *)gc_bump(&gc->survivor, size);
+        }
+        memcpy(new_obj, obj, size);
+        new_obj->age = obj->age + 1;
+        obj->forward = new_obj;
+        gc->stats.minor.bytes_copied += size;
+        if (promote) {
+            gc->stats.bytes_promoted += size;
         }
-        temp_frame = temp_frame->parent;
     }
+    value->objref = obj->forward;
+}
+
+static inline bool gc_points_to_survivor(pico_gc *gc, pico_object *obj) {
+    for (puint i = 0; i < obj->num_fields; i++) {
+        pico_value *field = &obj->fields[i];
+        if (field->kind == PICO_OBJECT &&
+            field->objref >= (pico_object *)gc->survivor.space_start &&
+            field->objref < (pico_object *)gc->survivor.space_end) {
+            return true;
+        }
+    }
+    return false;
+}
+
+static inline uint8_t *gc_minor_scan(pico_gc *gc, uint8_t *scan,
+                                     uint8_t *end) {
+    while (scan < end) {
+        pico_object *obj = (pico_object *)scan;
+        for (puint i = 0; i < obj->num_fields; i++) {
+            gc_minor_forward_value(gc, &obj->fields[i]);
+        }
+        scan += pico_object_size(obj);
+    }
+    return scan;
+}
+
+void pico_gc_collect_minor(pico_gc *gc, pico_env *env) {
+    // the survivor space is as big as the nursery, so every survivor fits in
+    // it when the old space has no room to promote it.
+    gc->promotion_failed = false;
+    uint8_t *promoted = gc->from_space.alloc_ptr;
+    uint8_t *scan_survivor = gc->survivor.alloc_ptr;
+    uint8_t *scan_promoted = promoted;
+
+    for (pulong i = 0; i < env->vm->sp; i++) {
+        gc_minor_forward_value(gc, &env->vm->stack[i]);
+    }
+    gc_clear_dead_stack(env->vm);
+    for (size_t i = 0; i < arrlenu(gc->remembered); i++) {
+        pico_object *obj = gc->remembered[i];
+        for (puint j = 0; j < obj->num_fields; j++) {
+            gc_minor_forward_value(gc, &obj->fields[j]);
+        }
+    }
+
+    // survivors and promoted objects are both scan queues.
+    while (scan_survivor < gc->survivor.alloc_ptr ||
+           scan_promoted < gc->from_space.alloc_ptr) {
+        scan_survivor =
+            gc_minor_scan(gc, scan_survivor, gc->survivor.alloc_ptr);
+        scan_promoted =
+            gc_minor_scan(gc, scan_promoted, gc->from_space.alloc_ptr);
+    }
+
+    // drop old objects that no longer point to young ones, then add the
+    // promoted objects that do.
+    size_t kept = 0;
+    for (size_t i = 0; i < arrlenu(gc->remembered); i++) {
+        pico_object *obj = gc->remembered[i];
+        if (gc_points_to_survivor(gc, obj)) {
+            gc->remembered[kept++] = obj;
+        } else {
+            obj->remembered = false;
+        }
+    }
+    arrsetlen(gc->remembered, kept);
+    for (uint8_t *scan = promoted; scan < gc->from_space.alloc_ptr;) {
+        pico_object *obj = (pico_object *)scan;
+        obj->remembered = false;
+        if (gc_points_to_survivor(gc, obj)) {
+            pico_gc_remember(gc, obj);
+        }
+        scan += pico_object_size(obj);
+    }
+
+    gc_semi_space temp = gc->nursery;
+    gc->nursery = gc->survivor;
+    gc->survivor = temp;
+    gc->survivor.alloc_ptr = gc->survivor.space_start;
+}
+
+static double gc_ns_to_ms(uint64_t ns) { return ns / 1e6; }
+
+static double gc_bytes_to_mib(uint64_t bytes) {
+    return bytes / (1024.0 * 1024.0);
+}
+
+static void gc_print_collections(FILE *out, const char *name,
+                                 const pico_gc_collection_stats *stats) {
+    fprintf(out,
+            "  %s collections: %llu, pause total %.3f ms, avg %.3f ms, max "
+            "%.3f ms, copied %.2f MiB\n",
+            name, (unsigned long long)stats->count,
+            gc_ns_to_ms(stats->pause_total_ns),
+            stats->count ? gc_ns_to_ms(stats->pause_total_ns) / stats->count
+                         : 0.0,
+            gc_ns_to_ms(stats->pause_max_ns),
+            gc_bytes_to_mib(stats->bytes_copied));
+}
+
+void pico_gc_print_stats(const pico_gc *gc, FILE *out) {
+    const pico_gc_stats *stats = &gc->stats;
+    fprintf(out, "PicoGC stats:\n");
+    fprintf(out, "  allocations: %llu objects, %.2f MiB\n",
+            (unsigned long long)stats->allocations,
+            gc_bytes_to_mib(stats->bytes_allocated));
+    gc_print_collections(out, "minor", &stats->minor);
+    fprintf(out, "  promoted: %.2f MiB\n",
+            gc_bytes_to_mib(stats->bytes_promoted));
+    gc_print_collections(out, "major", &stats->major);
+    fprintf(out,
+            "  heap: %.2f MiB, peak %.2f MiB, %llu grows, %llu shrinks\n",
+            gc_bytes_to_mib(gc->heap_size),
+            gc_bytes_to_mib(stats->peak_heap_size),
+            (unsigned long long)stats->heap_grows,
+            (unsigned long long)stats->heap_shrinks);
+}
+
+static void gc_write_collections_json(FILE *out, const char *name,
+                                      const pico_gc_collection_stats *stats) {
+    fprintf(out,
+            "  \"%s\": {\"count\": %llu, \"bytes_copied\": %llu, "
+            "\"pause_total_ns\": %llu, \"pause_max_ns\": %llu},\n",
+            name, (unsigned long long)stats->count,
+            (unsigned long long)stats->bytes_copied,
+            (unsigned long long)stats->pause_total_ns,
+            (unsigned long long)stats->pause_max_ns);
+}
+
+void pico_gc_write_stats_json(const pico_gc *gc, FILE *out) {
+    const pico_gc_stats *stats = &gc->stats;
+    fprintf(out, "{\n");
+    fprintf(out, "  \"allocations\": %llu,\n",
+            (unsigned long long)stats->allocations);
+    fprintf(out, "  \"bytes_allocated\": %llu,\n",
+            (unsigned long long)stats->bytes_allocated);
+    gc_write_collections_json(out, "minor", &stats->minor);
+    gc_write_collections_json(out, "major", &stats->major);
+    fprintf(out, "  \"bytes_promoted\": %llu,\n",
+            (unsigned long long)stats->bytes_promoted);
+    fprintf(out, "  \"heap_size\": %zu,\n", gc->heap_size);
+    fprintf(out, "  \"peak_heap_size\": %zu,\n", stats->peak_heap_size);
+    fprintf(out, "  \"nursery_size\": %zu,\n", gc->nursery.size);
+    fprintf(out, "  \"heap_grows\": %llu,\n",
+            (unsigned long long)stats->heap_grows);
+    fprintf(out, "  \"heap_shrinks\": %llu\n",
+            (unsigned long long)stats->heap_shrinks);
+    fprintf(out, "}\n");
 }
@@ -13,6 +13,14 @@ static const bool check_file_ext(const char *filename, const char *ext) {
     return strcmp(dot + 1, ext) == 0;
 }
 
+// a little-endian unsigned integer of size bytes, at most four
+static puint read_uint(FILE *file, int size) {
+    pbyte bytes[4] = {0};
+    fread(bytes, sizeof(pbyte), size, file);
+    return bytes[0] | (bytes[1] << 8) | (bytes[2] << 16) |
+           ((puint)bytes[3] << 24);
+}
+
 bytecode_unit load_bytecode(const char *filename) {
     if (!check_file_ext(filename, "pbc")) {
         fprintf(stderr, "Error: Invalid file extension for '%s'\n", filename);
@@ -25,17 +33,19 @@ bytecode_unit load_bytecode(const char *filename) {
         exit(EXIT_FAILURE);
     }
 
-    // skipping over header
+    // magic, instruction set, the rest is reserved
     pbyte header[HEADER_SIZE];
     fread(header, sizeof(pbyte), HEADER_SIZE, file);
+    pico_code_mode mode = header[4];
+    if (mode != PICO_MODE_STACK && mode != PICO_MODE_REGISTER) {
+        fprintf(stderr, "Error: unknown instruction set %u in '%s'\n", mode,
+                filename);
+        exit(EXIT_FAILURE);
+    }
 
-    // load constants
-    pbyte num_constants_bytes[2];
-    fread(&num_constants_bytes, sizeof(pbyte), 2, file);
+    // load constants, their count and indices into them are four bytes
     pico_value *constants = nullptr;
-
-    puint num_constants =
-        num_constants_bytes[0] | (num_constants_bytes[1] << 8);
+    puint num_constants = read_uint(file, 4);
 
     pint constants_read = 0;
     while (constants_read < num_constants) {
@@ -51,9 +61,7 @@ bytecode_unit load_bytecode(const char *filename) {
 
             arrput(constants, TO_PICO_INT(constant));
         } else if (tag == 0x02) {
-            pbyte len_bytes[2];
-            fread(&len_bytes, sizeof(pbyte), 2, file);
-            puint len = len_bytes[0] | (len_bytes[1] << 8);
+            puint len = read_uint(file, 4);
 
             pstr str = malloc(len + 1);
             fread(str, sizeof(pbyte), len, file);
@@ -85,9 +93,7 @@ bytecode_unit load_bytecode(const char *filename) {
         puint function_index = index_bytes[0] | (index_bytes[1] << 8);
 
         // read function name id
-        pbyte name_id_bytes[2];
-        fread(&name_id_bytes, sizeof(pbyte), 2, file);
-        puint name_id = name_id_bytes[0] | (name_id_bytes[1] << 8);
+        puint name_id = read_uint(file, 4);
 
         pbyte param_bytes[2];
         fread(&param_bytes, sizeof(pbyte), 2, file);
@@ -97,6 +103,8 @@ bytecode_unit load_bytecode(const char *filename) {
         fread(&local_bytes, sizeof(pbyte), 2, file);
         puint local_count = local_bytes[0] | (local_bytes[1] << 8);
 
+        puint max_stack = read_uint(file, 2);
+
         // read function code length
         pbyte code_len_bytes[4];
         fread(&code_len_bytes, sizeof(pbyte), 4, file);
@@ -110,20 +118,21 @@ bytecode_unit load_bytecode(const char *filename) {
                                   .name_id = name_id,
                                   .code_len = code_len,
                                   .local_count = local_count,
+                                  .max_stack = max_stack,
                                   .param_count = param_count};
         functions[function_index] = function;
     }
 
-    // read extern libs
+    // read extern libs, their functions form the native function table in
+    // the order they are listed.
     pbyte lib_count[2];
     fread(&lib_count, sizeof(pbyte), 2, file);
     puint num_libs = lib_count[0] | (lib_count[1] << 8);
 
+    pico_native_ref *natives = nullptr;
     for (puint i = 0; i < num_libs; i++) {
         // lib name
-        pbyte name_index_bytes[2];
-        fread(&name_index_bytes, sizeof(pbyte), 2, file);
-        puint name_index = name_index_bytes[0] | (name_index_bytes[1] << 8);
+        puint name_index = read_uint(file, 4);
 
         // functions count
         pbyte lib_function_bytes[2];
@@ -132,18 +141,20 @@ bytecode_unit load_bytecode(const char *filename) {
             lib_function_bytes[0] | (lib_function_bytes[1] << 8);
 
         for (puint j = 0; j < lib_fuctions_count; j++) {
-            pbyte lib_function_name_bytes[2];
-            fread(&lib_function_name_bytes, sizeof(pbyte), 2, file);
             // function name index
-            puint lib_function_name_index =
-                lib_function_name_bytes[0] | (lib_function_name_bytes[1] << 8);
+            puint lib_function_name_index = read_uint(file, 4);
+            arrput(natives,
+                   ((pico_native_ref){.lib_name_id = name_index,
+                                      .name_id = lib_function_name_index}));
         }
     }
 
     fclose(file);
     return (bytecode_unit){
+        .mode = mode,
         .main_function_index = main_function_index,
         .constants = constants,
         .functions = functions,
+        .natives = natives,
     };
 }
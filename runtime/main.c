@@ -1,27 +1,269 @@
 #include "gc.h"
+#include "opcode_stats.h"
 #include "pico.h"
+#include "profiler.h"
+#include <getopt.h>
 #include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 
 #ifdef DEBUG_BUILD
 #include "debugger.h"
 #endif
 
+enum {
+    OPT_HEAP_INITIAL = 256,
+    OPT_HEAP_MAX,
+    OPT_HEAP_GROWTH,
+    OPT_HEAP_SHRINK_AFTER,
+    OPT_NURSERY_SIZE,
+    OPT_GC_STATS,
+    OPT_GC_STATS_JSON,
+    OPT_PROFILE,
+    OPT_PROFILE_HZ,
+};
+
+static const struct option long_options[] = {
+    {"heap-initial", required_argument, nullptr, OPT_HEAP_INITIAL},
+    {"heap-max", required_argument, nullptr, OPT_HEAP_MAX},
+    {"heap-growth", required_argument, nullptr, OPT_HEAP_GROWTH},
+    {"heap-shrink-after", required_argument, nullptr, OPT_HEAP_SHRINK_AFTER},
+    {"nursery-size", required_argument, nullptr, OPT_NURSERY_SIZE},
+    {"gc-stats", no_argument, nullptr, OPT_GC_STATS},
+    {"gc-stats-json", required_argument, nullptr, OPT_GC_STATS_JSON},
+    {"profile", required_argument, nullptr, OPT_PROFILE},
+    {"profile-hz", required_argument, nullptr, OPT_PROFILE_HZ},
+    {"help", no_argument, nullptr, 'h'},
+    {nullptr, 0, nullptr, 0},
+};
+
+static void usage(FILE *out, const char *prog) {
+    fprintf(out,
+            "usage: %s [options] <program.pbc> [lib dir]\n"
+            "\n"
+            "options (environment variable in brackets):\n"
+            "  --heap-initial SIZE       initial size of each old semi-space "
+            "[PICO_HEAP_INITIAL]\n"
+            "  --heap-max SIZE           maximum size of each old semi-space, "
+            "0 for no limit [PICO_HEAP_MAX]\n"
+            "  --heap-growth FACTOR      heap growth factor, > 1 "
+            "[PICO_HEAP_GROWTH]\n"
+            "  --heap-shrink-after N     idle major collections before the "
+            "heap shrinks, 0 never [PICO_HEAP_SHRINK_AFTER]\n"
+            "  --nursery-size SIZE       size of each nursery half, 0 "
+            "disables it [PICO_NURSERY_SIZE]\n"
+            "  --gc-stats                print collector statistics to stderr "
+            "on exit [PICO_GC_STATS]\n"
+            "  --gc-stats-json FILE      write collector statistics as json, "
+            "- for stdout [PICO_GC_STATS_JSON]\n"
+            "  --profile FILE            sample the running functions and "
+            "write folded stacks to FILE [PICO_PROFILE]\n"
+            "  --profile-hz N            samples per second of cpu time, "
+            "default %d [PICO_PROFILE_HZ]\n"
+            "  -h, --help                show this message\n"
+            "\n"
+            "SIZE is a byte count with an optional K, M or G suffix.\n",
+            prog, PICO_PROFILER_DEFAULT_HZ);
+}
+
+static bool parse_size(const char *text, size_t *out) {
+    char *end;
+    unsigned long long value = strtoull(text, &end, 10);
+    if (end == text || *text == '-') {
+        return false;
+    }
+    switch (*end) {
+    case 'k':
+    case 'K':
+        value <<= 10;
+        end++;
+        break;
+    case 'm':
+    case 'M':
+        value <<= 20;
+        end++;
+        break;
+    case 'g':
+    case 'G':
+        value <<= 30;
+        end++;
+        break;
+    }
+    if (*end != '\0') {
+        return false;
+    }
+    *out = value;
+    return true;
+}
+
+// applies one heap setting, name is only used for error messages.
+static void set_gc_option(pico_gc_config *config, int option,
+                          const char *name, const char *value) {
+    bool ok = true;
+    switch (option) {
+    case OPT_HEAP_INITIAL:
+        ok = parse_size(value, &config->initial_size) &&
+             config->initial_size > 0;
+        break;
+    case OPT_HEAP_MAX:
+        ok = parse_size(value, &config->max_size);
+        break;
+    case OPT_NURSERY_SIZE:
+        ok = parse_size(value, &config->nursery_size);
+        break;
+    case OPT_HEAP_GROWTH: {
+        char *end;
+        config->growth_factor = strtod(value, &end);
+        ok = end != value && *end == '\0' && config->growth_factor > 1.0;
+        break;
+    }
+    case OPT_HEAP_SHRINK_AFTER: {
+        char *end;
+        unsigned long count = strtoul(value, &end, 10);
+        ok = end != value && *end == '\0' && *value != '-' &&
+             count <= UINT32_MAX;
+        config->shrink_after = count;
+        break;
+    }
+    }
+    if (!ok) {
+        fprintf(stderr, "pico: invalid value for %s: '%s'\n", name, value);
+        exit(EXIT_FAILURE);
+    }
+}
+
+static uint32_t parse_profile_hz(const char *name, const char *value) {
+    char *end;
+    unsigned long hz = strtoul(value, &end, 10);
+    if (end == value || *end != '\0' || *value == '-' || hz == 0 ||
+        hz > 1000000) {
+        fprintf(stderr, "pico: invalid value for %s: '%s'\n", name, value);
+        exit(EXIT_FAILURE);
+    }
+    return hz;
+}
+
+static void read_gc_env(pico_gc_config *config) {
+    static const struct {
+        const char *name;
+        int option;
+    } vars[] = {
+        {"PICO_HEAP_INITIAL", OPT_HEAP_INITIAL},
+        {"PICO_HEAP_MAX", OPT_HEAP_MAX},
+        {"PICO_HEAP_GROWTH", OPT_HEAP_GROWTH},
+        {"PICO_HEAP_SHRINK_AFTER", OPT_HEAP_SHRINK_AFTER},
+        {"PICO_NURSERY_SIZE", OPT_NURSERY_SIZE},
+    };
+    for (size_t i = 0; i < sizeof(vars) / sizeof(vars[0]); i++) {
+        const char *value = getenv(vars[i].name);
+        if (value && *value) {
+            set_gc_option(config, vars[i].option, vars[i].name, value);
+        }
+    }
+}
+
+static void write_gc_stats_json(const pico_gc *gc, const char *path) {
+    if (strcmp(path, "-") == 0) {
+        pico_gc_write_stats_json(gc, stdout);
+        return;
+    }
+    FILE *out = fopen(path, "w");
+    if (!out) {
+        perror(path);
+        return;
+    }
+    pico_gc_write_stats_json(gc, out);
+    fclose(out);
+}
+
 // TODO: allocate strings on heap and implement string interning
-// TODO: implement cli for pico runtime.
 int main(int argc, char *argv[]) {
+    // command line options override the environment.
+    pico_gc_config gc_config = pico_gc_config_default();
+    read_gc_env(&gc_config);
+    const char *gc_stats = getenv("PICO_GC_STATS");
+    bool print_gc_stats = gc_stats && *gc_stats && strcmp(gc_stats, "0") != 0;
+    const char *gc_stats_json = getenv("PICO_GC_STATS_JSON");
+    if (gc_stats_json && !*gc_stats_json) {
+        gc_stats_json = nullptr;
+    }
+    const char *profile_path = getenv("PICO_PROFILE");
+    if (profile_path && !*profile_path) {
+        profile_path = nullptr;
+    }
+    const char *profile_hz_env = getenv("PICO_PROFILE_HZ");
+    uint32_t profile_hz =
+        profile_hz_env && *profile_hz_env
+            ? parse_profile_hz("PICO_PROFILE_HZ", profile_hz_env)
+            : PICO_PROFILER_DEFAULT_HZ;
+    int opt;
+    int option_index;
+    while ((opt = getopt_long(argc, argv, "h", long_options, &option_index)) !=
+           -1) {
+        if (opt == 'h') {
+            usage(stdout, argv[0]);
+            return 0;
+        }
+        if (opt == '?') {
+            usage(stderr, argv[0]);
+            return EXIT_FAILURE;
+        }
+        if (opt == OPT_GC_STATS) {
+            print_gc_stats = true;
+            continue;
+        }
+        if (opt == OPT_GC_STATS_JSON) {
+            gc_stats_json = optarg;
+            continue;
+        }
+        if (opt == OPT_PROFILE) {
+            profile_path = optarg;
+            continue;
+        }
+        if (opt == OPT_PROFILE_HZ) {
+            profile_hz = parse_profile_hz("--profile-hz", optarg);
+            continue;
+        }
+        char name[64];
+        snprintf(name, sizeof(name), "--%s", long_options[option_index].name);
+        set_gc_option(&gc_config, opt, name, optarg);
+    }
+    if (gc_config.max_size && gc_config.max_size < gc_config.initial_size) {
+        fprintf(stderr, "pico: --heap-max is smaller than --heap-initial\n");
+        return EXIT_FAILURE;
+    }
+    const char *program = optind < argc ? argv[optind] : "../out.pbc";
+    const char *lib_dir = optind + 1 < argc ? argv[optind + 1] : "../lib";
+
     pico_env env;
-    pico_env_init(&env);
+    pico_env_init(&env, &gc_config);
 #ifdef DEBUG_BUILD
 
 #endif
-    pico_load_libraries(&env, argc > 1 ? argv[2] : "../lib");
-    bytecode_unit unit = load_bytecode(argv[1] ? argv[1] : "../out.pbc");
+    pico_load_libraries(&env, lib_dir);
+    bytecode_unit unit = load_bytecode(program);
 #ifdef DEBUG_BUILD
 
 #endif
     print_bytecode_unit(&unit);
     pico_vm_init(env.vm, &unit);
+    pico_link_natives(&env, &unit);
+    if (profile_path && !pico_profiler_start(&env, profile_path, profile_hz)) {
+        pico_env_deinit(&env);
+        return EXIT_FAILURE;
+    }
     pico_vm_run(&env);
+    if (profile_path) {
+        pico_profiler_stop(&env);
+    }
+    pico_opcode_stats_write(stderr, 40);
+    if (print_gc_stats) {
+        pico_gc_print_stats(env.gc, stderr);
+    }
+    if (gc_stats_json) {
+        write_gc_stats_json(env.gc, gc_stats_json);
+    }
     pico_env_deinit(&env);
     return 0;
 }
@@ -0,0 +1,126 @@
+#include "opcode_stats.h"
+#include "pico.h"
+#include "uthash.h"
+#include <stdlib.h>
+
+#ifdef PICO_OPCODE_STATS
+
+uint64_t pico_opcode_counts[256];
+uint64_t pico_opcode_pairs[256][256];
+uint16_t pico_opcode_prev;
+
+typedef struct opcode_triple {
+    // three opcodes, the first in bits 16-23
+    uint32_t key;
+    uint64_t count;
+    UT_hash_handle hh;
+} opcode_triple;
+
+static opcode_triple *triples = nullptr;
+// the last triple looked up, loops hit the same one over and over
+static opcode_triple *last_triple = nullptr;
+
+typedef struct opcode_pair {
+    uint8_t first;
+    uint8_t second;
+    uint64_t count;
+} opcode_pair;
+
+void pico_opcode_stats_record_triple(uint32_t key) {
+    opcode_triple *triple = last_triple;
+    if (!triple || triple->key != key) {
+        HASH_FIND(hh, triples, &key, sizeof(key), triple);
+    }
+    if (!triple) {
+        triple = calloc(1, sizeof(opcode_triple));
+        if (!triple) {
+            return;
+        }
+        triple->key = key;
+        HASH_ADD(hh, triples, key, sizeof(triple->key), triple);
+    }
+    triple->count++;
+    last_triple = triple;
+}
+
+static int compare_triples(const opcode_triple *a, const opcode_triple *b) {
+    return a->count < b->count ? 1 : a->count > b->count ? -1 : 0;
+}
+
+static int compare_pairs(const void *a, const void *b) {
+    const uint64_t ca = ((const opcode_pair *)a)->count;
+    const uint64_t cb = ((const opcode_pair *)b)->count;
+    return ca < cb ? 1 : ca > cb ? -1 : 0;
+}
+
+void pico_opcode_stats_write(FILE *out, uint32_t top) {
+    uint64_t total = 0;
+    opcode_pair ops[256];
+    for (uint32_t i = 0; i < 256; i++) {
+        total += pico_opcode_counts[i];
+        ops[i] = (opcode_pair){i, 0, pico_opcode_counts[i]};
+    }
+    if (total == 0) {
+        return;
+    }
+    qsort(ops, 256, sizeof(ops[0]), compare_pairs);
+
+    fprintf(out, "opcodes: %llu dispatched\n", (unsigned long long)total);
+    for (uint32_t i = 0; i < 256 && i < top && ops[i].count; i++) {
+        fprintf(out, "  %-20s %12llu %6.2f%%\n", pico_opcode_name(ops[i].first),
+                (unsigned long long)ops[i].count, 100.0 * ops[i].count / total);
+    }
+
+    // the first dispatches of the run are paired with opcode 0
+    opcode_pair *pairs = malloc(sizeof(opcode_pair) * 256 * 256);
+    if (!pairs) {
+        return;
+    }
+    uint32_t num_pairs = 0;
+    for (uint32_t i = 0; i < 256; i++) {
+        for (uint32_t j = 0; j < 256; j++) {
+            if (pico_opcode_pairs[i][j]) {
+                pairs[num_pairs++] =
+                    (opcode_pair){i, j, pico_opcode_pairs[i][j]};
+            }
+        }
+    }
+    qsort(pairs, num_pairs, sizeof(pairs[0]), compare_pairs);
+    fprintf(out, "pairs:\n");
+    for (uint32_t i = 0; i < num_pairs && i < top; i++) {
+        fprintf(out, "  %-20s %-20s %12llu %6.2f%%\n",
+                pico_opcode_name(pairs[i].first),
+                pico_opcode_name(pairs[i].second),
+                (unsigned long long)pairs[i].count,
+                100.0 * pairs[i].count / total);
+    }
+    free(pairs);
+
+    HASH_SORT(triples, compare_triples);
+    fprintf(out, "triples:\n");
+    uint32_t printed = 0;
+    opcode_triple *triple;
+    opcode_triple *tmp;
+    HASH_ITER(hh, triples, triple, tmp) {
+        if (printed++ < top) {
+            fprintf(out, "  %-20s %-20s %-20s %12llu %6.2f%%\n",
+                    pico_opcode_name(triple->key >> 16),
+                    pico_opcode_name((triple->key >> 8) & 0xFF),
+                    pico_opcode_name(triple->key & 0xFF),
+                    (unsigned long long)triple->count,
+                    100.0 * triple->count / total);
+        }
+        HASH_DEL(triples, triple);
+        free(triple);
+    }
+    last_triple = nullptr;
+}
+
+#else
+
+void pico_opcode_stats_write(FILE *out, uint32_t top) {
+    (void)out;
+    (void)top;
+}
+
+#endif
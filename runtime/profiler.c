@@ -0,0 +1,209 @@
+/*
+ * SIGPROF sampling profiler.
+ *
+ * setitimer(ITIMER_PROF) delivers SIGPROF at a fixed rate of cpu time. The
+ * handler walks env->frame through pico_frame.parent and appends the function
+ * indices of the stack to a buffer allocated up front, so it never allocates
+ * or takes locks. When the profiler stops, the samples are resolved to function
+ * names and written as folded stacks ("main;draw;mix 42"), the input format of
+ * flamegraph.pl and most flame graph viewers.
+ *
+ * Nothing in the vm checks whether the profiler is running.
+ */
+#define _DEFAULT_SOURCE
+
+#include "profiler.h"
+#include "pico.h"
+#include "stb_ds.h"
+#include "uthash.h"
+#include <errno.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/time.h>
+
+// a sample is a header word followed by the function indices, innermost first
+#define SAMPLE_DEPTH_MASK 0xFFFFu
+#define SAMPLE_IN_GC (1u << 16)
+#define SAMPLE_TRUNCATED (1u << 17)
+
+typedef struct profiler_state {
+    pico_env *env;
+    char *path;
+    uint32_t *buffer;
+    size_t capacity;
+    // only written by the signal handler while the timer is armed
+    volatile size_t used;
+    volatile size_t samples;
+    volatile size_t dropped;
+    struct sigaction previous_action;
+} profiler_state;
+
+typedef struct folded_stack {
+    char *key;
+    size_t count;
+    UT_hash_handle hh;
+} folded_stack;
+
+static profiler_state profiler;
+
+static void profiler_on_sample(int sig) {
+    (void)sig;
+    int saved_errno = errno;
+    pico_env *env = profiler.env;
+    const pico_frame *frame = env->frame;
+    if (!frame) {
+        // before main starts or after it returned
+        errno = saved_errno;
+        return;
+    }
+
+    size_t used = profiler.used;
+    if (used + 1 >= profiler.capacity) {
+        profiler.dropped++;
+        errno = saved_errno;
+        return;
+    }
+    size_t room = profiler.capacity - used - 1;
+    if (room > PICO_PROFILER_MAX_DEPTH) {
+        room = PICO_PROFILER_MAX_DEPTH;
+    }
+
+    uint32_t *out = &profiler.buffer[used + 1];
+    uint32_t depth = 0;
+    for (; frame && depth < room; frame = frame->parent) {
+        out[depth++] = (uint32_t)(frame->function - env->vm->functions);
+    }
+    if (frame && room < PICO_PROFILER_MAX_DEPTH) {
+        // the buffer is full, not the stack too deep
+        profiler.dropped++;
+        errno = saved_errno;
+        return;
+    }
+
+    uint32_t header = depth;
+    if (frame) {
+        header |= SAMPLE_TRUNCATED;
+    }
+    if (env->gc->collecting) {
+        header |= SAMPLE_IN_GC;
+    }
+    profiler.buffer[used] = header;
+    profiler.used = used + 1 + depth;
+    profiler.samples++;
+    errno = saved_errno;
+}
+
+bool pico_profiler_start(pico_env *env, const char *path, uint32_t hz) {
+    profiler.env = env;
+    profiler.path = strdup(path);
+    profiler.capacity = PICO_PROFILER_BUFFER_WORDS;
+    profiler.buffer = malloc(profiler.capacity * sizeof(uint32_t));
+    profiler.used = 0;
+    profiler.samples = 0;
+    profiler.dropped = 0;
+    if (!profiler.path || !profiler.buffer) {
+        fprintf(stderr, "pico: cannot allocate the profiler buffer\n");
+        return false;
+    }
+
+    struct sigaction action;
+    memset(&action, 0, sizeof(action));
+    action.sa_handler = profiler_on_sample;
+    action.sa_flags = SA_RESTART;
+    sigemptyset(&action.sa_mask);
+    if (sigaction(SIGPROF, &action, &profiler.previous_action) != 0) {
+        perror("pico: sigaction");
+        return false;
+    }
+
+    struct itimerval timer;
+    timer.it_interval.tv_sec = 0;
+    timer.it_interval.tv_usec = hz >= 1000000 ? 1 : 1000000 / hz;
+    timer.it_value = timer.it_interval;
+    if (setitimer(ITIMER_PROF, &timer, nullptr) != 0) {
+        perror("pico: setitimer");
+        sigaction(SIGPROF, &profiler.previous_action, nullptr);
+        return false;
+    }
+    return true;
+}
+
+static const char *function_name(pico_env *env, uint32_t index) {
+    const pico_value *name =
+        &env->vm->constants[env->vm->functions[index].name_id];
+    return name->kind == PICO_STRING ? name->s_value : "?";
+}
+
+static void profiler_write(pico_env *env, FILE *out) {
+    folded_stack *stacks = nullptr;
+    char *line = nullptr;
+    for (size_t pos = 0; pos < profiler.used;) {
+        uint32_t header = profiler.buffer[pos];
+        uint32_t depth = header & SAMPLE_DEPTH_MASK;
+        const uint32_t *functions = &profiler.buffer[pos + 1];
+        pos += 1 + depth;
+
+        // folded stacks are written outermost frame first
+        arrsetlen(line, 0);
+        if (header & SAMPLE_TRUNCATED) {
+            memcpy(arraddnptr(line, 12), "[truncated];", 12);
+        }
+        for (uint32_t i = depth; i-- > 0;) {
+            const char *name = function_name(env, functions[i]);
+            size_t len = strlen(name);
+            memcpy(arraddnptr(line, len), name, len);
+            if (i) {
+                arrput(line, ';');
+            }
+        }
+        if (header & SAMPLE_IN_GC) {
+            memcpy(arraddnptr(line, 5), ";[gc]", 5);
+        }
+        arrput(line, '\0');
+
+        folded_stack *entry;
+        HASH_FIND_STR(stacks, line, entry);
+        if (!entry) {
+            entry = malloc(sizeof(folded_stack));
+            entry->key = strdup(line);
+            entry->count = 0;
+            HASH_ADD_KEYPTR(hh, stacks, entry->key, strlen(entry->key), entry);
+        }
+        entry->count++;
+    }
+    arrfree(line);
+
+    folded_stack *entry, *tmp;
+    HASH_ITER(hh, stacks, entry, tmp) {
+        fprintf(out, "%s %zu\n", entry->key, entry->count);
+        HASH_DEL(stacks, entry);
+        free(entry->key);
+        free(entry);
+    }
+}
+
+void pico_profiler_stop(pico_env *env) {
+    struct itimerval timer;
+    memset(&timer, 0, sizeof(timer));
+    setitimer(ITIMER_PROF, &timer, nullptr);
+    sigaction(SIGPROF, &profiler.previous_action, nullptr);
+
+    FILE *out = fopen(profiler.path, "w");
+    if (out) {
+        profiler_write(env, out);
+        fclose(out);
+    } else {
+        perror(profiler.path);
+    }
+    if (profiler.dropped) {
+        fprintf(stderr,
+                "pico: profiler buffer full, dropped %zu of %zu samples\n",
+                profiler.dropped, profiler.samples + profiler.dropped);
+    }
+    free(profiler.buffer);
+    free(profiler.path);
+    profiler.buffer = nullptr;
+    profiler.path = nullptr;
+}
@@ -0,0 +1,638 @@
+#include "opcodes.h"
+#include "pico.h"
+#include "vm_dispatch.h"
+
+#include <stdatomic.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+/*
+ * Register mode.
+ *
+ * Instructions name their operands as slots of the frame's window instead of
+ * pushing and popping them: a function's local_count covers its declared
+ * locals and the temporaries the compiler needed, so an expression like
+ * a = b + c is a single OP_R_IADD. There is no operand stack, vm->sp always
+ * marks the end of the scanned part of the value stack for the gc.
+ */
+
+#define REG(index) (locals[(index)])
+
+#define ARITH_INT(op)                                                          \
+    puint dst = READ_TWO_BYTES();                                              \
+    puint a = READ_TWO_BYTES();                                                \
+    puint b = READ_TWO_BYTES();                                                \
+    REG(dst) = TO_PICO_INT(REG(a).i_value op REG(b).i_value);
+
+#define ARITH_INT_K(op)                                                        \
+    puint dst = READ_TWO_BYTES();                                              \
+    puint a = READ_TWO_BYTES();                                                \
+    const pico_value c = READ_CONSTANT();                                      \
+    REG(dst) = TO_PICO_INT(REG(a).i_value op c.i_value);
+
+#define COMPARE_INT(op)                                                        \
+    puint dst = READ_TWO_BYTES();                                              \
+    puint a = READ_TWO_BYTES();                                                \
+    puint b = READ_TWO_BYTES();                                                \
+    REG(dst) = (REG(a).i_value op REG(b).i_value) ? PICO_TRUE : PICO_FALSE;
+
+#define LOGICAL_OP(op)                                                         \
+    puint dst = READ_TWO_BYTES();                                              \
+    puint a = READ_TWO_BYTES();                                                \
+    puint b = READ_TWO_BYTES();                                                \
+    REG(dst) = (REG(a).boolean op REG(b).boolean) ? PICO_TRUE : PICO_FALSE;
+
+// jump when the comparison is false
+#define COMPARE_JUMP_INT(op)                                                   \
+    puint a = READ_TWO_BYTES();                                                \
+    puint b = READ_TWO_BYTES();                                                \
+    puint jmp_index = READ_TWO_BYTES();                                        \
+    if (!(REG(a).i_value op REG(b).i_value)) {                                 \
+        ip = code + jmp_index;                                                 \
+    }
+
+#define COMPARE_K_JUMP_INT(op)                                                 \
+    puint a = READ_TWO_BYTES();                                                \
+    const pico_value c = READ_CONSTANT();                                      \
+    puint jmp_index = READ_TWO_BYTES();                                        \
+    if (!(REG(a).i_value op c.i_value)) {                                      \
+        ip = code + jmp_index;                                                 \
+    }
+
+// a frame's window can end below its caller's, the gc keeps scanning up to
+// the caller's end so registers the caller wrote stay roots.
+#define SYNC_FRAME_SP() (vm->sp = frame->sp - vm->stack)
+
+void pico_run_register_frame(pico_env *env, pico_vm *vm, pico_frame *frame) {
+#ifdef PICO_THREADED_DISPATCH
+    static void *dispatch_table[256];
+    static bool dispatch_table_ready = false;
+    if (!dispatch_table_ready) {
+        for (puint i = 0; i < 256; i++) {
+            dispatch_table[i] = &&op_unknown;
+        }
+#define SET_HANDLER(op) dispatch_table[op] = &&op_##op
+        SET_HANDLER(OP_R_MOV);
+        SET_HANDLER(OP_R_LOADK);
+        SET_HANDLER(OP_R_LOADT);
+        SET_HANDLER(OP_R_LOADF);
+        SET_HANDLER(OP_R_INC);
+        SET_HANDLER(OP_R_DEC);
+        SET_HANDLER(OP_R_NOT);
+        SET_HANDLER(OP_R_I2B);
+        SET_HANDLER(OP_R_B2I);
+        SET_HANDLER(OP_R_LOG);
+        SET_HANDLER(OP_R_JMP);
+        SET_HANDLER(OP_R_JF);
+        SET_HANDLER(OP_R_JT);
+        SET_HANDLER(OP_R_AND);
+        SET_HANDLER(OP_R_OR);
+        SET_HANDLER(OP_R_IADD);
+        SET_HANDLER(OP_R_ISUB);
+        SET_HANDLER(OP_R_IMUL);
+        SET_HANDLER(OP_R_IDIV);
+        SET_HANDLER(OP_R_IREM);
+        SET_HANDLER(OP_R_IBAND);
+        SET_HANDLER(OP_R_IBOR);
+        SET_HANDLER(OP_R_IBXOR);
+        SET_HANDLER(OP_R_ISHL);
+        SET_HANDLER(OP_R_ISHR);
+        SET_HANDLER(OP_R_IEQ);
+        SET_HANDLER(OP_R_INE);
+        SET_HANDLER(OP_R_ILT);
+        SET_HANDLER(OP_R_ILE);
+        SET_HANDLER(OP_R_IGT);
+        SET_HANDLER(OP_R_IGE);
+        SET_HANDLER(OP_R_IADDK);
+        SET_HANDLER(OP_R_ISUBK);
+        SET_HANDLER(OP_R_IMULK);
+        SET_HANDLER(OP_R_IDIVK);
+        SET_HANDLER(OP_R_IREMK);
+        SET_HANDLER(OP_R_IBANDK);
+        SET_HANDLER(OP_R_IBORK);
+        SET_HANDLER(OP_R_IBXORK);
+        SET_HANDLER(OP_R_ISHLK);
+        SET_HANDLER(OP_R_ISHRK);
+        SET_HANDLER(OP_R_JF_ILT);
+        SET_HANDLER(OP_R_JF_ILE);
+        SET_HANDLER(OP_R_JF_IGT);
+        SET_HANDLER(OP_R_JF_IGE);
+        SET_HANDLER(OP_R_JF_IEQ);
+        SET_HANDLER(OP_R_JF_INE);
+        SET_HANDLER(OP_R_JF_ILTK);
+        SET_HANDLER(OP_R_JF_ILEK);
+        SET_HANDLER(OP_R_JF_IGTK);
+        SET_HANDLER(OP_R_JF_IGEK);
+        SET_HANDLER(OP_R_JF_IEQK);
+        SET_HANDLER(OP_R_JF_INEK);
+        SET_HANDLER(OP_R_CALL);
+        SET_HANDLER(OP_R_CALL_EXTERN);
+        SET_HANDLER(OP_R_VOID_CALL_EXTERN);
+        SET_HANDLER(OP_R_RET);
+        SET_HANDLER(OP_R_RET_VOID);
+        SET_HANDLER(OP_R_NEW_STRUCT);
+        SET_HANDLER(OP_R_GET_FIELD);
+        SET_HANDLER(OP_R_SET_FIELD);
+        SET_HANDLER(OP_R_FIELD_INC);
+        SET_HANDLER(OP_R_FIELD_DEC);
+        SET_HANDLER(OP_R_NEW_ARRAY);
+        SET_HANDLER(OP_R_ARRAY_INIT);
+        SET_HANDLER(OP_R_ARRAY_GET);
+        SET_HANDLER(OP_R_ARRAY_SET);
+        SET_HANDLER(OP_R_NEW_IARRAY);
+        SET_HANDLER(OP_R_IARRAY_INIT);
+        SET_HANDLER(OP_R_IARRAY_GET);
+        SET_HANDLER(OP_R_IARRAY_SET);
+        SET_HANDLER(OP_R_NEW_BARRAY);
+        SET_HANDLER(OP_R_BARRAY_INIT);
+        SET_HANDLER(OP_R_BARRAY_GET);
+        SET_HANDLER(OP_R_BARRAY_SET);
+        SET_HANDLER(OP_R_TAIL_CALL);
+        SET_HANDLER(OP_R_TABLESWITCH);
+        SET_HANDLER(OP_R_LOOKUPSWITCH);
+#undef SET_HANDLER
+        dispatch_table_ready = true;
+    }
+#endif
+
+    pico_value *const constants = vm->constants;
+    pbyte *code;
+    pbyte *ip;
+    pico_value *locals;
+    LOAD_FRAME();
+    env->frame = frame;
+    SYNC_FRAME_SP();
+
+#ifdef PICO_THREADED_DISPATCH
+    VM_DISPATCH();
+#else
+dispatch:
+#ifdef DEBUG_BUILD
+    if (vm->state == PICO_VM_STATE_PAUSED) {
+        goto dispatch;
+    }
+#endif
+    PICO_RECORD_OPCODE(*ip);
+    switch (READ_OPCODE()) {
+#endif
+    VM_CASE(OP_R_MOV): {
+        puint dst = READ_TWO_BYTES();
+        REG(dst) = REG(READ_TWO_BYTES());
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_LOADK): {
+        puint dst = READ_TWO_BYTES();
+        REG(dst) = READ_CONSTANT();
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_LOADT): {
+        REG(READ_TWO_BYTES()) = pico_true;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_LOADF): {
+        REG(READ_TWO_BYTES()) = pico_false;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_INC): {
+        REG(READ_TWO_BYTES()).i_value++;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_DEC): {
+        REG(READ_TWO_BYTES()).i_value--;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_NOT): {
+        puint dst = READ_TWO_BYTES();
+        REG(dst) = REG(READ_TWO_BYTES()).boolean ? pico_false : pico_true;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_I2B): {
+        puint dst = READ_TWO_BYTES();
+        REG(dst) = REG(READ_TWO_BYTES()).i_value ? pico_true : pico_false;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_B2I): {
+        puint dst = READ_TWO_BYTES();
+        REG(dst) = REG(READ_TWO_BYTES()).boolean ? pico_one : pico_zero;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_LOG): {
+        printf("%d\n", REG(READ_TWO_BYTES()).i_value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JMP): {
+        puint jmp_index = READ_TWO_BYTES();
+        ip = code + jmp_index;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_TABLESWITCH): {
+        const pico_value a = REG(READ_TWO_BYTES());
+        TABLE_SWITCH(a.i_value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_LOOKUPSWITCH): {
+        const pico_value a = REG(READ_TWO_BYTES());
+        LOOKUP_SWITCH(a.i_value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF): {
+        const pico_value a = REG(READ_TWO_BYTES());
+        puint jmp_index = READ_TWO_BYTES();
+        if (!a.boolean) {
+            ip = code + jmp_index;
+        }
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JT): {
+        const pico_value a = REG(READ_TWO_BYTES());
+        puint jmp_index = READ_TWO_BYTES();
+        if (a.boolean) {
+            ip = code + jmp_index;
+        }
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_AND): {
+        LOGICAL_OP(&&)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_OR): {
+        LOGICAL_OP(||)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IADD): {
+        ARITH_INT(+)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ISUB): {
+        ARITH_INT(-)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IMUL): {
+        ARITH_INT(*)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IDIV): {
+        ARITH_INT(/)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IREM): {
+        ARITH_INT(%)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IBAND): {
+        ARITH_INT(&)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IBOR): {
+        ARITH_INT(|)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IBXOR): {
+        ARITH_INT(^)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ISHL): {
+        ARITH_INT(<<)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ISHR): {
+        ARITH_INT(>>)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IEQ): {
+        COMPARE_INT(==)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_INE): {
+        COMPARE_INT(!=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ILT): {
+        COMPARE_INT(<)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ILE): {
+        COMPARE_INT(<=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IGT): {
+        COMPARE_INT(>)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IGE): {
+        COMPARE_INT(>=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IADDK): {
+        ARITH_INT_K(+)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ISUBK): {
+        ARITH_INT_K(-)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IMULK): {
+        ARITH_INT_K(*)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IDIVK): {
+        ARITH_INT_K(/)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IREMK): {
+        ARITH_INT_K(%)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IBANDK): {
+        ARITH_INT_K(&)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IBORK): {
+        ARITH_INT_K(|)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IBXORK): {
+        ARITH_INT_K(^)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ISHLK): {
+        ARITH_INT_K(<<)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ISHRK): {
+        ARITH_INT_K(>>)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_ILT): {
+        COMPARE_JUMP_INT(<)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_ILE): {
+        COMPARE_JUMP_INT(<=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_IGT): {
+        COMPARE_JUMP_INT(>)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_IGE): {
+        COMPARE_JUMP_INT(>=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_IEQ): {
+        COMPARE_JUMP_INT(==)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_INE): {
+        COMPARE_JUMP_INT(!=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_ILTK): {
+        COMPARE_K_JUMP_INT(<)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_ILEK): {
+        COMPARE_K_JUMP_INT(<=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_IGTK): {
+        COMPARE_K_JUMP_INT(>)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_IGEK): {
+        COMPARE_K_JUMP_INT(>=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_IEQK): {
+        COMPARE_K_JUMP_INT(==)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_JF_INEK): {
+        COMPARE_K_JUMP_INT(!=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_CALL): {
+        pico_function *function = &vm->functions[READ_TWO_BYTES()];
+        pico_value *base = locals + READ_TWO_BYTES();
+        CHECK_FRAME_FITS(function, base, 1);
+        SAVE_IP();
+
+        // the argument registers become the callee's parameters. the rest of
+        // the window is not cleared: whatever returned frames left there is
+        // either still referenced or was cleared by the last collection.
+        pico_value *end = base + function->local_count;
+        if (end < frame->sp) {
+            end = frame->sp;
+        }
+        vm->frames[vm->fc] = PICO_FRAME_NEW(function, base, frame, true);
+        frame = &vm->frames[vm->fc++];
+        frame->sp = end;
+        // see OP_CALL in vm.c
+        atomic_signal_fence(memory_order_release);
+        env->frame = frame;
+        SYNC_FRAME_SP();
+        code = function->code;
+        ip = code;
+        locals = base;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_TAIL_CALL): {
+        pico_function *function = &vm->functions[READ_TWO_BYTES()];
+        pico_value *args = locals + READ_TWO_BYTES();
+        CHECK_FRAME_FITS(function, locals, 0);
+
+        // the callee takes over this frame and returns straight to our caller.
+        // the argument registers are above every local, so copying them down
+        // in order never overwrites one that is still to be read.
+        const puint param_count = function->param_count;
+        for (puint i = 0; i < param_count; i++) {
+            locals[i] = args[i];
+        }
+        // like OP_R_CALL the window only grows, in a loop of tail calls it
+        // settles on the largest callee
+        pico_value *end = locals + function->local_count;
+        if (end > frame->sp) {
+            frame->sp = end;
+            SYNC_FRAME_SP();
+        }
+        frame->function = function;
+        frame->ip = 0;
+        // see OP_CALL in vm.c
+        atomic_signal_fence(memory_order_release);
+        code = function->code;
+        ip = code;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_CALL_EXTERN): {
+        native_fn_entry *entry = vm->natives[READ_TWO_BYTES()];
+        pico_value *args = &REG(READ_TWO_BYTES());
+        *args = entry->value_handle(env, args);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_VOID_CALL_EXTERN): {
+        native_fn_entry *entry = vm->natives[READ_TWO_BYTES()];
+        pico_value *args = &REG(READ_TWO_BYTES());
+        entry->void_handle(env, args);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_RET): {
+        const pico_value result = REG(READ_TWO_BYTES());
+        if (frame->parent) {
+            // the callee's window starts at the caller's base register
+            *frame->bp = result;
+            frame = frame->parent;
+            --vm->fc;
+            env->frame = frame;
+            SYNC_FRAME_SP();
+            LOAD_FRAME();
+            VM_DISPATCH();
+        }
+        env->frame = nullptr;
+        return;
+    }
+    VM_CASE(OP_R_RET_VOID): {
+        if (frame->parent) {
+            frame = frame->parent;
+            --vm->fc;
+            env->frame = frame;
+            SYNC_FRAME_SP();
+            LOAD_FRAME();
+            VM_DISPATCH();
+        }
+        env->frame = nullptr;
+        return;
+    }
+    VM_CASE(OP_R_NEW_STRUCT): {
+        puint dst = READ_TWO_BYTES();
+        puint num_fields = READ_TWO_BYTES();
+        pico_object *obj = pico_env_alloc_object(env, num_fields);
+        REG(dst) = TO_PICO_OBJ(obj);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_GET_FIELD): {
+        puint dst = READ_TWO_BYTES();
+        pico_object *obj = REG(READ_TWO_BYTES()).objref;
+        REG(dst) = PICO_OBJ_FIELD(obj, READ_TWO_BYTES());
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_SET_FIELD): {
+        pico_object *obj = REG(READ_TWO_BYTES()).objref;
+        puint field_index = READ_TWO_BYTES();
+        const pico_value value = REG(READ_TWO_BYTES());
+        PICO_GC_WRITE_BARRIER(env->gc, obj, value);
+        PICO_OBJECT_SET_FIELD(obj, field_index, value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_FIELD_INC): {
+        pico_object *obj = REG(READ_TWO_BYTES()).objref;
+        obj->fields[READ_TWO_BYTES()].i_value++;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_FIELD_DEC): {
+        pico_object *obj = REG(READ_TWO_BYTES()).objref;
+        obj->fields[READ_TWO_BYTES()].i_value--;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_NEW_ARRAY): {
+        puint dst = READ_TWO_BYTES();
+        puint size = READ_TWO_BYTES();
+        pico_object *obj = pico_env_alloc_object(env, size);
+        REG(dst) = TO_PICO_OBJ(obj);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ARRAY_INIT): {
+        pico_object *arr = REG(READ_TWO_BYTES()).objref;
+        puint index = READ_TWO_BYTES();
+        const pico_value value = REG(READ_TWO_BYTES());
+        PICO_GC_WRITE_BARRIER(env->gc, arr, value);
+        PICO_OBJECT_SET_FIELD(arr, index, value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ARRAY_GET): {
+        puint dst = READ_TWO_BYTES();
+        pico_object *arr = REG(READ_TWO_BYTES()).objref;
+        pint index = REG(READ_TWO_BYTES()).i_value;
+        CHECK_ARRAY_INDEX(index, arr->num_fields);
+        REG(dst) = PICO_GET_OBJECT_FIELD(arr, index);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_ARRAY_SET): {
+        pico_object *arr = REG(READ_TWO_BYTES()).objref;
+        pint index = REG(READ_TWO_BYTES()).i_value;
+        const pico_value value = REG(READ_TWO_BYTES());
+        CHECK_ARRAY_INDEX(index, arr->num_fields);
+        PICO_GC_WRITE_BARRIER(env->gc, arr, value);
+        PICO_OBJECT_SET_FIELD(arr, index, value);
+        VM_DISPATCH();
+    }
+    // packed arrays hold no references, so stores need no write barrier.
+    VM_CASE(OP_R_NEW_IARRAY): {
+        puint dst = READ_TWO_BYTES();
+        puint length = READ_TWO_BYTES();
+        pico_object *obj =
+            pico_env_alloc_packed_array(env, PICO_OBJ_INT_ARRAY, length);
+        REG(dst) = TO_PICO_OBJ(obj);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IARRAY_INIT): {
+        pico_object *arr = REG(READ_TWO_BYTES()).objref;
+        puint index = READ_TWO_BYTES();
+        PICO_ARRAY_INTS(arr)[index] = REG(READ_TWO_BYTES()).i_value;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IARRAY_GET): {
+        puint dst = READ_TWO_BYTES();
+        pico_object *arr = REG(READ_TWO_BYTES()).objref;
+        pint index = REG(READ_TWO_BYTES()).i_value;
+        CHECK_ARRAY_INDEX(index, arr->length);
+        REG(dst) = TO_PICO_INT(PICO_ARRAY_INTS(arr)[index]);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_IARRAY_SET): {
+        pico_object *arr = REG(READ_TWO_BYTES()).objref;
+        pint index = REG(READ_TWO_BYTES()).i_value;
+        const pico_value value = REG(READ_TWO_BYTES());
+        CHECK_ARRAY_INDEX(index, arr->length);
+        PICO_ARRAY_INTS(arr)[index] = value.i_value;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_NEW_BARRAY): {
+        puint dst = READ_TWO_BYTES();
+        puint length = READ_TWO_BYTES();
+        pico_object *obj =
+            pico_env_alloc_packed_array(env, PICO_OBJ_BOOL_ARRAY, length);
+        REG(dst) = TO_PICO_OBJ(obj);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_BARRAY_INIT): {
+        pico_object *arr = REG(READ_TWO_BYTES()).objref;
+        puint index = READ_TWO_BYTES();
+        PICO_ARRAY_BOOLS(arr)[index] = REG(READ_TWO_BYTES()).boolean;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_BARRAY_GET): {
+        puint dst = READ_TWO_BYTES();
+        pico_object *arr = REG(READ_TWO_BYTES()).objref;
+        pint index = REG(READ_TWO_BYTES()).i_value;
+        CHECK_ARRAY_INDEX(index, arr->length);
+        REG(dst) = PICO_ARRAY_BOOLS(arr)[index] ? PICO_TRUE : PICO_FALSE;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_R_BARRAY_SET): {
+        pico_object *arr = REG(READ_TWO_BYTES()).objref;
+        pint index = REG(READ_TWO_BYTES()).i_value;
+        const pico_value value = REG(READ_TWO_BYTES());
+        CHECK_ARRAY_INDEX(index, arr->length);
+        PICO_ARRAY_BOOLS(arr)[index] = value.boolean;
+        VM_DISPATCH();
+    }
+    VM_DEFAULT: {
+        fprintf(stderr, "unknown opcode 0x%02X at %lu in function %u\n",
+                ip[-1], (pulong)(ip - code - 1), frame->function->name_id);
+        pico_env_deinit(env);
+        exit(EXIT_FAILURE);
+    }
+#ifndef PICO_THREADED_DISPATCH
+    }
+#endif
+}
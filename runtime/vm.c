@@ -2,7 +2,9 @@
 #include "pico.h"
 #include "stb_ds.h"
 #include "uthash.h"
+#include "vm_dispatch.h"
 
+#include <stdatomic.h>
 #include <stdio.h>
 #include <stdlib.h>
 
@@ -10,352 +12,710 @@
 #include "debugger.h"
 #endif
 
-#define READ_OPCODE() frame->function->code[frame->ip++]
-#define READ_TWO_BYTES() (READ_OPCODE() | (READ_OPCODE() << 8))
-#define READ_CONSTANT(vm) (vm->constants[READ_TWO_BYTES()])
+#define PUSH(val) (*sp++ = (val))
+#define POP() (*--sp)
+#define PEEK() (sp - 1)
 
-#define PUSH(vm, val) (vm->stack[vm->sp++] = (val))
-#define POP(vm) (vm->stack[--vm->sp])
-#define PEEK(vm) (&vm->stack[vm->sp - 1])
+// write the cached registers back before anything that can observe them
+// (gc, native functions, frame switches).
+#define SYNC_SP() (vm->sp = sp - vm->stack)
 
-#define BINARY_ARITH_INT(vm, op)                                               \
-    const pico_value b = POP(vm);                                              \
-    const pico_value a = POP(vm);                                              \
-    PUSH(vm, TO_PICO_INT(a.i_value op b.i_value));
+#define BINARY_ARITH_INT(op)                                                   \
+    const pico_value b = POP();                                                \
+    const pico_value a = POP();                                                \
+    PUSH(TO_PICO_INT(a.i_value op b.i_value));
 
-#define COMPARE_INT(vm, op)                                                    \
-    const pico_value b = POP(vm);                                              \
-    const pico_value a = POP(vm);                                              \
-    PUSH(vm, ((a.i_value op b.i_value) ? PICO_TRUE : PICO_FALSE));
+#define COMPARE_INT(op)                                                        \
+    const pico_value b = POP();                                                \
+    const pico_value a = POP();                                                \
+    PUSH(((a.i_value op b.i_value) ? PICO_TRUE : PICO_FALSE));
 
-#define LOGICAL_OP(vm, op)                                                     \
-    const pico_value b = POP(vm);                                              \
-    const pico_value a = POP(vm);                                              \
-    PUSH(vm, ((a.boolean op b.boolean) ? PICO_TRUE : PICO_FALSE));
+// jump when the comparison is false, the fused form of ILT..INE followed by JF
+#define COMPARE_JUMP_INT(op)                                                   \
+    const pico_value b = POP();                                                \
+    const pico_value a = POP();                                                \
+    puint jmp_index = READ_TWO_BYTES();                                        \
+    if (!(a.i_value op b.i_value)) {                                           \
+        ip = code + jmp_index;                                                 \
+    }
+
+#define COMPARE_LOCAL_CONST_JUMP_INT(op)                                       \
+    puint index = READ_TWO_BYTES();                                            \
+    const pico_value c = READ_CONSTANT();                                      \
+    puint jmp_index = READ_TWO_BYTES();                                        \
+    if (!(locals[index].i_value op c.i_value)) {                               \
+        ip = code + jmp_index;                                                 \
+    }
+
+#define LOCAL_CONST_ARITH_INT(op)                                              \
+    puint index = READ_TWO_BYTES();                                            \
+    const pico_value c = READ_CONSTANT();                                      \
+    PUSH(TO_PICO_INT(locals[index].i_value op c.i_value));
+
+#define LOCAL_LOCAL_ARITH_INT(op)                                              \
+    puint a = READ_TWO_BYTES();                                                \
+    puint b = READ_TWO_BYTES();                                                \
+    PUSH(TO_PICO_INT(locals[a].i_value op locals[b].i_value));
+
+#define LOGICAL_OP(op)                                                         \
+    const pico_value b = POP();                                                \
+    const pico_value a = POP();                                                \
+    PUSH(((a.boolean op b.boolean) ? PICO_TRUE : PICO_FALSE));
 
 static void pico_run_frame(pico_env *env, pico_vm *vm, pico_frame *frame) {
-frame_start:
-    pulong code_len = frame->function->code_len;
-    while (frame->ip < code_len) {
+#ifdef PICO_THREADED_DISPATCH
+    static void *dispatch_table[256];
+    static bool dispatch_table_ready = false;
+    if (!dispatch_table_ready) {
+        for (puint i = 0; i < 256; i++) {
+            dispatch_table[i] = &&op_unknown;
+        }
+#define SET_HANDLER(op) dispatch_table[op] = &&op_##op
+        SET_HANDLER(OP_LIC);
+        SET_HANDLER(OP_LSC);
+        SET_HANDLER(OP_LBT);
+        SET_HANDLER(OP_LBF);
+        SET_HANDLER(OP_STORE);
+        SET_HANDLER(OP_LOAD);
+        SET_HANDLER(OP_IINC);
+        SET_HANDLER(OP_IDEC);
+        SET_HANDLER(OP_TEE);
+        SET_HANDLER(OP_POP);
+        SET_HANDLER(OP_IADD);
+        SET_HANDLER(OP_ISUB);
+        SET_HANDLER(OP_IMUL);
+        SET_HANDLER(OP_IDIV);
+        SET_HANDLER(OP_IREM);
+        SET_HANDLER(OP_IAND);
+        SET_HANDLER(OP_IOR);
+        SET_HANDLER(OP_IBAND);
+        SET_HANDLER(OP_IBOR);
+        SET_HANDLER(OP_IBXOR);
+        SET_HANDLER(OP_ISHL);
+        SET_HANDLER(OP_ISHR);
+        SET_HANDLER(OP_IEQ);
+        SET_HANDLER(OP_INE);
+        SET_HANDLER(OP_ILT);
+        SET_HANDLER(OP_ILE);
+        SET_HANDLER(OP_IGT);
+        SET_HANDLER(OP_IGE);
+        SET_HANDLER(OP_BNOT);
+        SET_HANDLER(OP_B2I);
+        SET_HANDLER(OP_B2L);
+        SET_HANDLER(OP_L2B);
+        SET_HANDLER(OP_L2I);
+        SET_HANDLER(OP_I2L);
+        SET_HANDLER(OP_I2B);
+        SET_HANDLER(OP_JF);
+        SET_HANDLER(OP_JT);
+        SET_HANDLER(OP_JMP);
+        SET_HANDLER(OP_TABLESWITCH);
+        SET_HANDLER(OP_LOOKUPSWITCH);
+        SET_HANDLER(OP_RET);
+        SET_HANDLER(OP_CALL);
+        SET_HANDLER(OP_VOID_CALL);
+        SET_HANDLER(OP_CALL_EXTERN);
+        SET_HANDLER(OP_VOID_CALL_EXTERN);
+        SET_HANDLER(OP_TAIL_CALL);
+        SET_HANDLER(OP_ALLOCA_STRUCT);
+        SET_HANDLER(OP_SET_FIELD);
+        SET_HANDLER(OP_LOAD_FIELD);
+        SET_HANDLER(OP_IFIELD_INC);
+        SET_HANDLER(OP_IFIELD_DEC);
+        SET_HANDLER(OP_STORE_FIELD);
+        SET_HANDLER(OP_ALLOCA_ARRAY);
+        SET_HANDLER(OP_ARRAY_STORE);
+        SET_HANDLER(OP_ARRAY_SET);
+        SET_HANDLER(OP_ARRAY_GET);
+        SET_HANDLER(OP_ALLOCA_IARRAY);
+        SET_HANDLER(OP_IARRAY_SET);
+        SET_HANDLER(OP_IARRAY_GET);
+        SET_HANDLER(OP_IARRAY_STORE);
+        SET_HANDLER(OP_ALLOCA_BARRAY);
+        SET_HANDLER(OP_BARRAY_SET);
+        SET_HANDLER(OP_BARRAY_GET);
+        SET_HANDLER(OP_BARRAY_STORE);
+        SET_HANDLER(OP_LOG);
+        SET_HANDLER(OP_JF_ILT);
+        SET_HANDLER(OP_JF_ILE);
+        SET_HANDLER(OP_JF_IGT);
+        SET_HANDLER(OP_JF_IGE);
+        SET_HANDLER(OP_JF_IEQ);
+        SET_HANDLER(OP_JF_INE);
+        SET_HANDLER(OP_JF_ILT_LC);
+        SET_HANDLER(OP_JF_ILE_LC);
+        SET_HANDLER(OP_JF_IGT_LC);
+        SET_HANDLER(OP_JF_IGE_LC);
+        SET_HANDLER(OP_JF_IEQ_LC);
+        SET_HANDLER(OP_JF_INE_LC);
+        SET_HANDLER(OP_IADD_LC);
+        SET_HANDLER(OP_ISUB_LC);
+        SET_HANDLER(OP_IBAND_LC);
+        SET_HANDLER(OP_IADD_LL);
+        SET_HANDLER(OP_ISUB_LL);
+        SET_HANDLER(OP_WIDE);
+#undef SET_HANDLER
+        dispatch_table_ready = true;
+    }
+#endif
+
+    pico_value *const constants = vm->constants;
+    pico_value *sp = vm->stack + vm->sp;
+    pbyte *code;
+    pbyte *ip;
+    pico_value *locals;
+    LOAD_FRAME();
+    env->frame = frame;
 
+#ifdef PICO_THREADED_DISPATCH
+    VM_DISPATCH();
+#else
+dispatch:
 #ifdef DEBUG_BUILD
-        if (vm->state == PICO_VM_STATE_PAUSED) {
-            continue;
-        }
+    if (vm->state == PICO_VM_STATE_PAUSED) {
+        goto dispatch;
+    }
 #endif
-
-        const pbyte opcode = READ_OPCODE();
-        switch (opcode) {
-        case OP_LIC: {
-            PUSH(vm, READ_CONSTANT(vm));
-            break;
-        }
-        case OP_LSC: {
-            PUSH(vm, READ_CONSTANT(vm));
-            break;
-        }
-        case OP_STORE: {
-            puint index = READ_TWO_BYTES();
-            frame->locals[index] = POP(vm);
-            break;
-        }
-        case OP_LOAD: {
-            puint index = READ_TWO_BYTES();
-            PUSH(vm, frame->locals[index]);
-            break;
-        }
-        case OP_IINC: {
-            puint index = READ_TWO_BYTES();
-            frame->locals[index].i_value++;
-            break;
-        }
-        case OP_IDEC: {
-            puint index = READ_TWO_BYTES();
-            frame->locals[index].i_value--;
-            break;
-        }
-        case OP_IADD: {
-            BINARY_ARITH_INT(vm, +)
-            break;
-        }
-        case OP_ISUB: {
-            BINARY_ARITH_INT(vm, -)
-            break;
-        }
-        case OP_IMUL: {
-            BINARY_ARITH_INT(vm, *)
-            break;
-        }
-        case OP_IDIV: {
-            BINARY_ARITH_INT(vm, /)
-            break;
-        }
-        case OP_IREM: {
-            BINARY_ARITH_INT(vm, %)
-            break;
-        }
-        case OP_IBAND: {
-            BINARY_ARITH_INT(vm, &)
-            break;
-        }
-        case OP_IBOR: {
-            BINARY_ARITH_INT(vm, |)
-            break;
-        }
-        case OP_IBXOR: {
-            BINARY_ARITH_INT(vm, ^)
-            break;
-        }
-        case OP_ISHL: {
-            BINARY_ARITH_INT(vm, <<)
-            break;
-        }
-        case OP_ISHR: {
-            BINARY_ARITH_INT(vm, >>)
-            break;
-        }
-        case OP_IEQ: {
-            COMPARE_INT(vm, ==)
-            break;
-        }
-        case OP_INE: {
-            COMPARE_INT(vm, !=)
-            break;
-        }
-        case OP_ILT: {
-            COMPARE_INT(vm, <)
-            break;
-        }
-        case OP_ILE: {
-            COMPARE_INT(vm, <=)
-            break;
-        }
-        case OP_IGT: {
-            COMPARE_INT(vm, >)
-            break;
+    PICO_RECORD_OPCODE(*ip);
+    switch (READ_OPCODE()) {
+#endif
+    VM_CASE(OP_LIC): {
+        PUSH(READ_CONSTANT());
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_LSC): {
+        PUSH(READ_CONSTANT());
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_STORE): {
+        puint index = READ_TWO_BYTES();
+        locals[index] = POP();
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_LOAD): {
+        puint index = READ_TWO_BYTES();
+        PUSH(locals[index]);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_TEE): {
+        puint index = READ_TWO_BYTES();
+        locals[index] = *PEEK();
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_POP): {
+        --sp;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IINC): {
+        puint index = READ_TWO_BYTES();
+        locals[index].i_value++;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IDEC): {
+        puint index = READ_TWO_BYTES();
+        locals[index].i_value--;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IADD): {
+        BINARY_ARITH_INT(+)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ISUB): {
+        BINARY_ARITH_INT(-)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IMUL): {
+        BINARY_ARITH_INT(*)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IDIV): {
+        BINARY_ARITH_INT(/)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IREM): {
+        BINARY_ARITH_INT(%)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IBAND): {
+        BINARY_ARITH_INT(&)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IBOR): {
+        BINARY_ARITH_INT(|)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IBXOR): {
+        BINARY_ARITH_INT(^)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ISHL): {
+        BINARY_ARITH_INT(<<)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ISHR): {
+        BINARY_ARITH_INT(>>)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IEQ): {
+        COMPARE_INT(==)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_INE): {
+        COMPARE_INT(!=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ILT): {
+        COMPARE_INT(<)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ILE): {
+        COMPARE_INT(<=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IGT): {
+        COMPARE_INT(>)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IGE): {
+        COMPARE_INT(>=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IAND): {
+        LOGICAL_OP(&&)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IOR): {
+        LOGICAL_OP(||)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_LBT): {
+        PUSH(pico_true);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_LBF): {
+        PUSH(pico_false);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_I2B) : {
+        const pico_value a = POP();
+        PUSH(a.i_value ? pico_true : pico_false);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_L2B) : {
+        // TODO: implement long to boolean
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_B2L) : {
+        const pico_value a = POP();
+        PUSH(a.boolean ? pico_one : pico_zero);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_B2I) : {
+        const pico_value a = POP();
+        PUSH(a.boolean ? pico_one : pico_zero);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_I2L) : {
+        // TODO: implement int to long
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_L2I) : {
+        // TODO: implement long to int
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_BNOT): {
+        const pico_value a = POP();
+        PUSH(a.boolean ? pico_false : pico_true);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_LOG): {
+        const pico_value a = POP();
+        printf("%d\n", a.i_value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF): {
+        const pico_value a = POP();
+        puint jmp_index = READ_TWO_BYTES();
+        if (!a.boolean) {
+            ip = code + jmp_index;
         }
-        case OP_IGE: {
-            COMPARE_INT(vm, >=)
-            break;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JT): {
+        const pico_value a = POP();
+        puint jmp_index = READ_TWO_BYTES();
+        if (a.boolean) {
+            ip = code + jmp_index;
         }
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JMP): {
+        puint jmp_index = READ_TWO_BYTES();
+        ip = code + jmp_index;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_TABLESWITCH): {
+        const pico_value a = POP();
+        TABLE_SWITCH(a.i_value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_LOOKUPSWITCH): {
+        const pico_value a = POP();
+        LOOKUP_SWITCH(a.i_value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_ILT): {
+        COMPARE_JUMP_INT(<)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_ILE): {
+        COMPARE_JUMP_INT(<=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_IGT): {
+        COMPARE_JUMP_INT(>)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_IGE): {
+        COMPARE_JUMP_INT(>=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_IEQ): {
+        COMPARE_JUMP_INT(==)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_INE): {
+        COMPARE_JUMP_INT(!=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_ILT_LC): {
+        COMPARE_LOCAL_CONST_JUMP_INT(<)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_ILE_LC): {
+        COMPARE_LOCAL_CONST_JUMP_INT(<=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_IGT_LC): {
+        COMPARE_LOCAL_CONST_JUMP_INT(>)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_IGE_LC): {
+        COMPARE_LOCAL_CONST_JUMP_INT(>=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_IEQ_LC): {
+        COMPARE_LOCAL_CONST_JUMP_INT(==)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_JF_INE_LC): {
+        COMPARE_LOCAL_CONST_JUMP_INT(!=)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IADD_LC): {
+        LOCAL_CONST_ARITH_INT(+)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ISUB_LC): {
+        LOCAL_CONST_ARITH_INT(-)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IBAND_LC): {
+        LOCAL_CONST_ARITH_INT(&)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IADD_LL): {
+        LOCAL_LOCAL_ARITH_INT(+)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ISUB_LL): {
+        LOCAL_LOCAL_ARITH_INT(-)
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_CALL):
+    VM_CASE(OP_VOID_CALL): {
+        const bool returns_value = ip[-1] == OP_CALL;
+        puint function_index = READ_TWO_BYTES();
+        pico_function *function = &vm->functions[function_index];
+        SAVE_IP();
 
-        case OP_IAND: {
-            LOGICAL_OP(vm, &&)
-            break;
-        }
-        case OP_IOR: {
-            LOGICAL_OP(vm, ||) break;
-        }
-        case OP_LBT: {
-            PUSH(vm, pico_true);
-            break;
-        }
-        case OP_LBF: {
-            PUSH(vm, pico_false);
-            break;
-        }
-        case OP_I2B: {
-            const pico_value a = POP(vm);
-            PUSH(vm, a.i_value ? pico_true : pico_false);
-            break;
-        }
-        case OP_L2B: {
-            // TODO: implement long to boolean
-            break;
-        }
-        case OP_B2L: {
-            const pico_value a = POP(vm);
-            PUSH(vm, a.boolean ? pico_one : pico_zero);
-            break;
-        }
-        case OP_B2I: {
-            const pico_value a = POP(vm);
-            PUSH(vm, a.boolean ? pico_one : pico_zero);
-            break;
-        }
-        case OP_I2L: {
-            // TODO: implement int to long
-            break;
-        }
-        case OP_L2I: {
-            // TODO: implement long to int
-            break;
-        }
-        case OP_BNOT: {
-            const pico_value a = POP(vm);
-            PUSH(vm, a.boolean ? pico_false : pico_true);
-            break;
-        }
-        case OP_LOG: {
-            const pico_value a = POP(vm);
-            printf("%d\n", a.i_value);
-            break;
-        }
-        case OP_JF: {
-            const pico_value a = POP(vm);
-            if (!a.boolean) {
-                puint jmp_index = READ_TWO_BYTES();
-                frame->ip = jmp_index;
-            }
-            break;
-        }
-        case OP_JMP: {
-            puint jmp_index = READ_TWO_BYTES();
-            frame->ip = jmp_index;
-            break;
-        }
-        case OP_CALL: {
-            puint function_index = READ_TWO_BYTES();
-            pico_function *function = &vm->functions[function_index];
+        // the arguments already on the stack become the callee's parameters
+        pico_value *args = sp - function->param_count;
+        CHECK_FRAME_FITS(function, args, 1);
+        vm->frames[vm->fc] =
+            PICO_FRAME_NEW(function, args, frame, returns_value);
+        frame = &vm->frames[vm->fc++];
+        // the profiler's signal handler may walk the frame as soon as it is
+        // published, keep the compiler from sinking the stores above past it.
+        atomic_signal_fence(memory_order_release);
+        env->frame = frame;
 
-            pulong frame_start_sp = vm->sp - function->param_count;
+        while (sp < frame->sp) {
+            *sp++ = pico_zero;
+        }
+        LOAD_FRAME();
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_TAIL_CALL): {
+        pico_function *function = &vm->functions[READ_TWO_BYTES()];
+        CHECK_FRAME_FITS(function, frame->bp, 0);
 
-            pico_frame child_frame =
-                PICO_FRAME_NEW(function, frame_start_sp, frame);
-            vm->frames[vm->fc++] = child_frame;
-            frame = &vm->frames[vm->fc - 1];
-            env->frame = frame;
+        // the callee takes over this frame and returns straight to our caller.
+        // the arguments sit above every local, so copying them down in order
+        // never overwrites one that is still to be read.
+        pico_value *args = sp - function->param_count;
+        for (puint i = 0; i < function->param_count; i++) {
+            frame->bp[i] = args[i];
+        }
+        frame->function = function;
+        frame->ip = 0;
+        frame->sp = frame->bp + function->local_count;
+        // see OP_CALL
+        atomic_signal_fence(memory_order_release);
 
-            for (pint i = function->param_count - 1; i >= 0; i--) {
-                frame->locals[i] = POP(vm);
-            }
-            goto frame_start;
+        sp = frame->bp + function->param_count;
+        while (sp < frame->sp) {
+            *sp++ = pico_zero;
         }
-        case OP_VOID_CALL_EXTERN: {
-            puint name_index = READ_TWO_BYTES();
-            pico_value *fn_name = &vm->constants[name_index];
-            native_fn_entry *entry;
-            HASH_FIND_STR(env->native_functions, fn_name->s_value, entry);
-            if (!entry) {
-                printf("cannot find function: %s\n", fn_name->s_value);
-                exit(EXIT_FAILURE);
+        LOAD_FRAME();
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_VOID_CALL_EXTERN): {
+        native_fn_entry *entry = vm->natives[READ_TWO_BYTES()];
+        pico_value *args = sp - entry->param_count;
+        SYNC_SP();
+        entry->void_handle(env, args);
+        sp = args;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_CALL_EXTERN): {
+        native_fn_entry *entry = vm->natives[READ_TWO_BYTES()];
+        pico_value *args = sp - entry->param_count;
+        SYNC_SP();
+        pico_value result = entry->value_handle(env, args);
+        sp = args;
+        PUSH(result);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_RET): {
+        if (frame->parent) {
+            // drop the callee's window, leaving the return value in its place
+            pico_value *base = frame->bp;
+            if (frame->returns_value) {
+                *base++ = sp[-1];
             }
-            pico_value *args = &vm->stack[vm->sp - entry->param_count];
-            entry->void_handle(env, args);
-            vm->sp -= entry->param_count;
-            break;
+            sp = base;
+            frame = frame->parent;
+            --vm->fc;
+            env->frame = frame;
+            LOAD_FRAME();
+            VM_DISPATCH();
         }
-        case OP_CALL_EXTERN: {
-            puint name_index = READ_TWO_BYTES();
-            pico_value *fn_name = &vm->constants[name_index];
-            native_fn_entry *entry;
-            HASH_FIND_STR(env->native_functions, fn_name->s_value, entry);
-            if (!entry) {
-                printf("cannot find function: %s\n", fn_name->s_value);
-                exit(EXIT_FAILURE);
-            }
-            pico_value *args = &vm->stack[vm->sp - entry->param_count];
-            vm->sp -= entry->param_count;
-            PUSH(vm, entry->value_handle(env, args));
+        env->frame = nullptr;
+        SYNC_SP();
+        return;
+    }
+    VM_CASE(OP_ALLOCA_STRUCT): {
+        puint num_fields = READ_TWO_BYTES();
+        SYNC_SP();
+        pico_object *obj = pico_env_alloc_object(env, num_fields);
+        PUSH(TO_PICO_OBJ(obj));
+        VM_DISPATCH();
+    }
+    // TODO: make sure store field pops the object and value
+    VM_CASE(OP_SET_FIELD): {
+        puint field_index = READ_TWO_BYTES();
+        pico_value value = POP();
+        pico_value *obj = PEEK();
+        PICO_GC_WRITE_BARRIER(env->gc, obj->objref, value);
+        PICO_OBJECT_SET_FIELD(obj->objref, field_index, value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_STORE_FIELD): {
+        puint field_index = READ_TWO_BYTES();
+        pico_value obj = POP();
+        pico_value value = POP();
+        PICO_GC_WRITE_BARRIER(env->gc, obj.objref, value);
+        PICO_OBJECT_SET_FIELD(obj.objref, field_index, value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_LOAD_FIELD): {
+        puint field_index = READ_TWO_BYTES();
+        pico_value obj = POP();
+        PUSH(PICO_OBJ_FIELD(obj.objref, field_index));
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IFIELD_INC): {
+        puint field_index = READ_TWO_BYTES();
+        pico_object *obj = POP().objref;
+        (&obj->fields[field_index])->i_value++;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IFIELD_DEC): {
+        puint field_index = READ_TWO_BYTES();
+        pico_object *obj = POP().objref;
+        (&obj->fields[field_index])->i_value--;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ALLOCA_ARRAY): {
+        puint size = READ_TWO_BYTES();
+        SYNC_SP();
+        pico_object *obj = pico_env_alloc_object(env, size);
+        PUSH(TO_PICO_OBJ(obj));
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ARRAY_SET): {
+        puint index = READ_TWO_BYTES();
+        pico_value value = POP();
+        pico_object *obj = PEEK()->objref;
+        PICO_GC_WRITE_BARRIER(env->gc, obj, value);
+        PICO_OBJECT_SET_FIELD(obj, index, value);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ARRAY_STORE): {
+        pico_value val = POP();
+        pint index = POP().i_value;
+        pico_value arr = POP();
+        CHECK_ARRAY_INDEX(index, arr.objref->num_fields);
+        PICO_GC_WRITE_BARRIER(env->gc, arr.objref, val);
+        PICO_OBJECT_SET_FIELD(arr.objref, index, val);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ARRAY_GET): {
+        pint index = POP().i_value;
+        pico_value arr = POP();
+        CHECK_ARRAY_INDEX(index, arr.objref->num_fields);
+        PUSH(PICO_GET_OBJECT_FIELD(arr.objref, index));
+        VM_DISPATCH();
+    }
+    // packed arrays hold no references, so stores need no write barrier.
+    VM_CASE(OP_ALLOCA_IARRAY): {
+        puint length = READ_TWO_BYTES();
+        SYNC_SP();
+        pico_object *obj =
+            pico_env_alloc_packed_array(env, PICO_OBJ_INT_ARRAY, length);
+        PUSH(TO_PICO_OBJ(obj));
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IARRAY_SET): {
+        puint index = READ_TWO_BYTES();
+        pico_value value = POP();
+        PICO_ARRAY_INTS(PEEK()->objref)[index] = value.i_value;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IARRAY_GET): {
+        pint index = POP().i_value;
+        pico_object *arr = POP().objref;
+        CHECK_ARRAY_INDEX(index, arr->length);
+        PUSH(TO_PICO_INT(PICO_ARRAY_INTS(arr)[index]));
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_IARRAY_STORE): {
+        pico_value val = POP();
+        pint index = POP().i_value;
+        pico_object *arr = POP().objref;
+        CHECK_ARRAY_INDEX(index, arr->length);
+        PICO_ARRAY_INTS(arr)[index] = val.i_value;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_ALLOCA_BARRAY): {
+        puint length = READ_TWO_BYTES();
+        SYNC_SP();
+        pico_object *obj =
+            pico_env_alloc_packed_array(env, PICO_OBJ_BOOL_ARRAY, length);
+        PUSH(TO_PICO_OBJ(obj));
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_BARRAY_SET): {
+        puint index = READ_TWO_BYTES();
+        pico_value value = POP();
+        PICO_ARRAY_BOOLS(PEEK()->objref)[index] = value.boolean;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_BARRAY_GET): {
+        pint index = POP().i_value;
+        pico_object *arr = POP().objref;
+        CHECK_ARRAY_INDEX(index, arr->length);
+        PUSH(PICO_ARRAY_BOOLS(arr)[index] ? PICO_TRUE : PICO_FALSE);
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_BARRAY_STORE): {
+        pico_value val = POP();
+        pint index = POP().i_value;
+        pico_object *arr = POP().objref;
+        CHECK_ARRAY_INDEX(index, arr->length);
+        PICO_ARRAY_BOOLS(arr)[index] = val.boolean;
+        VM_DISPATCH();
+    }
+    VM_CASE(OP_WIDE): {
+        // rare enough that its instructions need no handlers of their own
+        switch (READ_OPCODE()) {
+        case OP_LIC:
+        case OP_LSC:
+            PUSH(constants[READ_FOUR_BYTES()]);
             break;
-        }
-        case OP_RET: {
-            if (frame->parent) {
-                pico_frame *child_frame = frame;
-                frame = frame->parent;
-                --vm->fc;
-                env->frame = frame;
-                PICO_FRAME_DEINIT(*child_frame);
-                goto frame_start;
+        case OP_JF: {
+            const pico_value a = POP();
+            puint jmp_index = READ_FOUR_BYTES();
+            if (!a.boolean) {
+                ip = code + jmp_index;
             }
-            env->frame = nullptr;
-            goto frame_end;
-        }
-        case OP_ALLOCA_STRUCT: {
-            puint num_fields = READ_TWO_BYTES();
-            pico_object *obj = pico_env_alloc_object(env, num_fields);
-            PUSH(vm, TO_PICO_OBJ(obj));
-            break;
-        }
-        // TODO: make sure store field pops the object and value
-        case OP_SET_FIELD: {
-            puint field_index = READ_TWO_BYTES();
-            pico_value value = POP(vm);
-            pico_value *obj = PEEK(vm);
-            PICO_OBJECT_SET_FIELD(obj->objref, field_index, value);
             break;
         }
-        case OP_STORE_FIELD: {
-            puint field_index = READ_TWO_BYTES();
-            pico_value obj = POP(vm);
-            PICO_OBJECT_SET_FIELD(obj.objref, field_index, POP(vm));
-            break;
-        }
-        case OP_LOAD_FIELD: {
-            puint field_index = READ_TWO_BYTES();
-            pico_value obj = POP(vm);
-            PUSH(vm, PICO_OBJ_FIELD(obj.objref, field_index));
-            break;
-        }
-        case OP_IFIELD_INC: {
-            puint field_index = READ_TWO_BYTES();
-            pico_object *obj = POP(vm).objref;
-            (&obj->fields[field_index])->i_value++;
-            break;
-        }
-        case OP_IFIELD_DEC: {
-            puint field_index = READ_TWO_BYTES();
-            pico_object *obj = POP(vm).objref;
-            (&obj->fields[field_index])->i_value--;
-            break;
-        }
-        case OP_ALLOCA_ARRAY: {
-            puint size = READ_TWO_BYTES();
-            pico_object *obj = pico_env_alloc_object(env, size);
-            PUSH(vm, TO_PICO_OBJ(obj));
+        case OP_JT: {
+            const pico_value a = POP();
+            puint jmp_index = READ_FOUR_BYTES();
+            if (a.boolean) {
+                ip = code + jmp_index;
+            }
             break;
         }
-        case OP_ARRAY_SET: {
-            puint index = READ_TWO_BYTES();
-            pico_value value = POP(vm);
-            pico_object *obj = PEEK(vm)->objref;
-            PICO_OBJECT_SET_FIELD(obj, index, value);
+        case OP_JMP: {
+            puint jmp_index = READ_FOUR_BYTES();
+            ip = code + jmp_index;
             break;
         }
-        case OP_ARRAY_STORE: {
-            pico_value val = POP(vm);
-            pint index = POP(vm).i_value;
-            pico_value arr = POP(vm);
-            if (index < 0 || index >= arr.objref->num_fields) {
-                printf("Index %d out of bounds for length %d\n", index,
-                       arr.objref->num_fields);
-                pico_env_deinit(env);
-                exit(EXIT_FAILURE);
-            }
-            PICO_OBJECT_SET_FIELD(arr.objref, index, val);
+        case OP_TABLESWITCH: {
+            const pico_value a = POP();
+            WIDE_TABLE_SWITCH(a.i_value);
             break;
         }
-        case OP_ARRAY_GET: {
-            pint index = POP(vm).i_value;
-            pico_value arr = POP(vm);
-            if (index < 0 || index >= arr.objref->num_fields) {
-                printf("Index %d out of bounds for length %d\n", index,
-                       arr.objref->num_fields);
-                pico_env_deinit(env);
-                exit(EXIT_FAILURE);
-            }
-            PUSH(vm, PICO_GET_OBJECT_FIELD(arr.objref, index));
+        case OP_LOOKUPSWITCH: {
+            const pico_value a = POP();
+            WIDE_LOOKUP_SWITCH(a.i_value);
             break;
         }
+        default:
+            fprintf(stderr,
+                    "no wide form of opcode 0x%02X at %lu in function %u\n",
+                    ip[-1], (pulong)(ip - code - 1), frame->function->name_id);
+            pico_env_deinit(env);
+            exit(EXIT_FAILURE);
         }
-
-#ifdef PICO_DEBUG
-        if (vm->state == PICO_VM_STATE_STEP) {
-            printf("step pause");
-            vm->state = PICO_VM_STATE_PAUSED;
-        }
-#endif
+        VM_DISPATCH();
     }
-
-frame_end:;
+    VM_DEFAULT: {
+        fprintf(stderr, "unknown opcode 0x%02X at %lu in function %u\n",
+                ip[-1], (pulong)(ip - code - 1), frame->function->name_id);
+        pico_env_deinit(env);
+        exit(EXIT_FAILURE);
+    }
+#ifndef PICO_THREADED_DISPATCH
+    }
+#endif
 }
 
 void pico_vm_init(pico_vm *vm, bytecode_unit *unit) {
     vm->main_function_index = unit->main_function_index;
+    vm->mode = unit->mode;
     vm->constants = unit->constants;
     vm->fc = 0;
     vm->functions = unit->functions;
+    vm->natives = nullptr;
     vm->sp = 0;
+    // PICO_INT zero, every slot is a valid value for the gc, see
+    // gc_clear_dead_stack
+    memset(vm->stack, 0, sizeof(vm->stack));
 }
 
 void pico_vm_run(pico_env *env) {
@@ -364,10 +724,20 @@ void pico_vm_run(pico_env *env) {
         &env->vm->functions[env->vm->main_function_index];
 
     // push the main function onto the call stack
-    pico_frame frame = PICO_FRAME_NEW(main_func, env->vm->sp, nullptr);
-    env->vm->frames[env->vm->fc++] = frame;
-    pico_run_frame(env, env->vm, &frame);
-    PICO_FRAME_DEINIT(frame);
+    pico_vm *vm = env->vm;
+    CHECK_FRAME_FITS(main_func, &vm->stack[vm->sp], 1);
+    pico_frame *frame = &vm->frames[vm->fc++];
+    *frame = PICO_FRAME_NEW(main_func, &vm->stack[vm->sp], nullptr, false);
+    for (pico_value *slot = frame->bp; slot < frame->sp; slot++) {
+        *slot = pico_zero;
+    }
+    vm->sp = frame->sp - vm->stack;
+    if (vm->mode == PICO_MODE_REGISTER) {
+        pico_run_register_frame(env, vm, frame);
+    } else {
+        pico_run_frame(env, vm, frame);
+    }
+    --vm->fc;
 }
 
 void pico_vm_shutdown(pico_vm *vm) {
@@ -383,4 +753,5 @@ void pico_vm_shutdown(pico_vm *vm) {
     for (puint i = 0; i < len; i++) {
         free(vm->functions[i].code);
     }
+    arrfree(vm->natives);
 }